@@ -0,0 +1,10 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+ytsched のベンチマーク (パッケージには含めない)
+
+    $ python -m bench --help
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
@@ -0,0 +1,300 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+ytsched のベンチマーク
+
+    $ python -m bench COMMAND [OPTIONS]
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import click
+from ytsched.ytsched import SchedDataFile
+from .parse import bench_codec, bench_parser, bench_lazy, bench_memory
+from .parse import bench_logger, bench_columnar
+from .search import bench_search, bench_query, bench_range
+from .server import bench_stream, bench_days, bench_etag, bench_fragcache
+from .server import bench_async, bench_workers
+from .data import bench_watcher, bench_replace, bench_journal, \
+    bench_conf, bench_todo, bench_cache
+
+
+@click.group(help="""
+benchmarks for ytsched""")
+def cli():
+    """ benchmarks """
+
+
+@cli.command(help="""
+HTML string codec""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True),
+              default=SchedDataFile.DEF_TOP_DIR,
+              help='data directory, default=\'%s\'' % (
+                  SchedDataFile.DEF_TOP_DIR))
+@click.option('--max-files', '-n', 'max_files', type=int, default=0,
+              help='max number of files (newest first), default=0(all)')
+def codec(datadir, max_files):
+    """ codec """
+    bench_codec(datadir, max_files)
+
+
+@cli.command(help="""
+day file parser (synthetic tree, unless --datadir is given)""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=30,
+              help='years of synthetic data, default=30')
+def parser(datadir, years):
+    """ parser """
+    bench_parser(datadir, years)
+
+
+@cli.command(help="""
+eager vs lazy entities: memory and latency""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+def lazy(datadir, years):
+    """ lazy """
+    bench_lazy(datadir, years)
+
+
+@cli.command(help="""
+entity memory: per-entity bytes and RSS with a full cache""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--days', '-n', 'days', type=int, default=20000,
+              help='days of synthetic data, default=20000')
+def memory(datadir, days):
+    """ memory """
+    bench_memory(datadir, days)
+
+
+@cli.command(help="""
+SchedDataFile.load: per-object vs memoized loggers""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=10,
+              help='years of synthetic data, default=10')
+def logger(datadir, years):
+    """ logger """
+    bench_logger(datadir, years)
+
+
+@cli.command(help="""
+per-day SchedDataFile vs columnar year stores: memory and scans""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+def columnar(datadir, years):
+    """ columnar """
+    bench_columnar(datadir, years)
+
+
+@cli.command(help="""
+change detection: inotify vs scandir polling""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=30,
+              help='years of synthetic data, default=30')
+def watch(datadir, years):
+    """ watch """
+    bench_watcher(datadir, years)
+
+
+@cli.command(help="""
+full-history search: scan every day vs n-gram index""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=30,
+              help='years of synthetic data, default=30')
+def search(datadir, years):
+    """ search """
+    bench_search(datadir, years)
+
+
+@cli.command(help="""
+filter/search matching: re.search per entity vs compiled query""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory, default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=10,
+              help='years of synthetic data, default=10')
+def query(datadir, years):
+    """ query """
+    bench_query(datadir, years)
+
+
+@cli.command(help="""
+time to first byte: whole-page render vs streamed chunks""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+def stream(datadir, years, webroot):
+    """ stream """
+    bench_stream(datadir, years, webroot)
+
+
+@cli.command(help="""
+infinite scroll step: full page reload vs day-range fragment""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=5,
+              help='years of synthetic data, default=5')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+def days(datadir, years, webroot):
+    """ days """
+    bench_days(datadir, years, webroot)
+
+
+@cli.command(help="""
+reload of an unchanged view: full render vs ETag 304""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=5,
+              help='years of synthetic data, default=5')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+def etag(datadir, years, webroot):
+    """ etag """
+    bench_etag(datadir, years, webroot)
+
+
+@cli.command(help="""
+page render time: every day rendered vs cached day fragments""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=5,
+              help='years of synthetic data, default=5')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+def fragcache(datadir, years, webroot):
+    """ fragcache """
+    bench_fragcache(datadir, years, webroot)
+
+
+@cli.command(name='async', help="""
+latency of cached views while other requests load files:
+loads on the IOLoop vs in a thread pool""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+def async_(datadir, years, webroot):
+    """ async """
+    bench_async(datadir, years, webroot)
+
+
+@cli.command(help="""
+requests/sec of the main view by the number of server processes
+(--workers)""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+@click.option('--webroot', '-r', 'webroot', type=click.Path(exists=True),
+              default=None,
+              help='Web root directory, default: next to the package')
+@click.option('--clients', '-c', 'clients', type=int, default=8,
+              help='concurrent client processes, default=8')
+@click.option('--sec', '-s', 'sec', type=float, default=5.0,
+              help='seconds per run, default=5')
+def workers(datadir, years, webroot, clients, sec):
+    """ workers """
+    bench_workers(datadir, years, webroot, clients, sec)
+
+
+@cli.command(help="""
+fixing entries: del_sde() + add_sde() vs replace_sde()""")
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True), default=None,
+              help='data directory (copied), default: synthetic tree')
+@click.option('--years', '-y', 'years', type=int, default=1,
+              help='years of synthetic data, default=1')
+@click.option('--number', '-n', 'n', type=int, default=200,
+              help='entries to fix, default=200')
+def replace(datadir, years, n):
+    """ replace """
+    bench_replace(datadir, years, n)
+
+
+@cli.command(name='journal', help="""
+adding/deleting ToDo: rewriting ToDo.cgi vs appending to the journal""")
+@click.option('--number', '-n', 'n', type=int, default=50,
+              help='entries to add and delete, default=50')
+def journal_(n):
+    """ journal """
+    bench_journal(n=n)
+
+
+@cli.command(name='conf', help="""
+page views: reading Conf.cgi per request vs ConfStore""")
+@click.option('--number', '-n', 'n', type=int, default=1000,
+              help='page views, default=1000')
+def conf_(n):
+    """ conf """
+    bench_conf(n=n)
+
+
+@cli.command(help="""
+merging ToDo into a page: scanning all vs the deadline index""")
+@click.option('--days', 'days', type=int, default=90,
+              help='days in the page, default=90')
+def todo(days):
+    """ todo """
+    bench_todo(days=days)
+
+
+@cli.command(name='range', help="""
+scanning a sparse period: day-by-day get_sdf() vs iter_range()""")
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+@click.option('--limit', '-n', 'limit', type=int, default=10,
+              help='matches to stop the search at, default=10')
+def range_(years, limit):
+    """ range """
+    bench_range(years, limit=limit)
+
+
+@cli.command(help="""
+cache: estimated vs traced memory, burst vs incremental eviction""")
+@click.option('--years', '-y', 'years', type=int, default=20,
+              help='years of synthetic data, default=20')
+@click.option('--cache-days', 'cache_days', type=int, default=2000,
+              help='days the cache holds, default=2000')
+def cache(years, cache_days):
+    """ cache """
+    bench_cache(years, cache_days=cache_days)
+
+
+
+if __name__ == '__main__':
+    cli(prog_name='bench')
@@ -0,0 +1,215 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+ベンチマークの共通部分
+
+合成データのツリー(``mk_tree()``, ``data_tree()``)と、計測の補助
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import time
+import shutil
+import random
+import datetime
+import tempfile
+import contextlib
+
+
+def mk_tree(topdir: str, years: int = 30, fill_rate: float = 0.6,
+            max_ents: int = 6, seed: int = 1) -> int:
+    """
+    合成データのツリーを生成する
+
+    Parameters
+    ----------
+    topdir: str
+    years: int
+        今日から何年前まで
+    fill_rate: float
+        データがある日の割合
+    max_ents: int
+        1日の最大エンティティ数
+    seed: int
+
+    Returns
+    -------
+    n_files: int
+    """
+    rnd = random.Random(seed)
+
+    titles = ['会議', '!重要な打合せ', '(キャンセル)打合せ', '★誕生日',
+              'lunch &amp; talk', 'x 旧予定', '（欠）歯医者', '買い物', '']
+    places = ['', '', '本社', '自宅', '渋谷', 'Cafe&nbsp;A']
+    details = ['', '', 'メモ<br />2行目', '持ち物: 資料&nbsp;PC',
+               '&lt;URL&gt;<br />http://example.com/',
+               '長い説明文です。' * 8]
+
+    today = datetime.date.today()
+    date = today - datetime.timedelta(days=round(365.25 * years))
+    n_files = 0
+    n_id = 1600000000
+    while date <= today + datetime.timedelta(days=365):
+        if rnd.random() < fill_rate:
+            lines = []
+            for i in range(rnd.randint(1, max_ents)):
+                r = rnd.random()
+                if r < 0.2:
+                    time_str = ':-:'
+                elif r < 0.3:
+                    time_str = '%02d:%02d-:' % (rnd.randint(0, 23),
+                                                rnd.randint(0, 59))
+                else:
+                    h = rnd.randint(0, 22)
+                    time_str = '%02d:%02d-%02d:%02d' % (
+                        h, rnd.randint(0, 59), h + 1, rnd.randint(0, 59))
+
+                sde_type = ''
+                if rnd.random() < 0.02:
+                    sde_type = '休日'
+                elif rnd.random() < 0.2:
+                    sde_type = '仕事'
+
+                lines.append('\t'.join([
+                    '%d-%d' % (n_id, i), date.strftime('%Y/%m/%d'),
+                    time_str, sde_type, rnd.choice(titles),
+                    rnd.choice(places), rnd.choice(details)]))
+            n_id += 1
+
+            pathname = os.path.join(topdir, date.strftime('%Y/%m/%d.cgi'))
+            os.makedirs(os.path.dirname(pathname), exist_ok=True)
+            with open(pathname, mode='w') as f:
+                f.write('\n'.join(lines) + '\n')
+            n_files += 1
+
+        date += datetime.timedelta(days=1)
+
+    return n_files
+
+
+@contextlib.contextmanager
+def data_tree(datadir: str = None, years: float = 30,
+              fill_rate: float = 0.6, copy: bool = False):
+    """
+    ベンチマーク用のデータツリー (一時ディレクトリ)
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データ(``mk_tree()``)を生成する
+    years: float
+    fill_rate: float
+    copy: bool
+        True: ``datadir``を一時ディレクトリにコピーする (書き込む場合)
+        False: ``datadir``をそのまま使う
+
+    Yields
+    ------
+    (topdir, tmpdir): (str, str)
+        topdir: データのディレクトリ
+        tmpdir: 作業用の一時ディレクトリ (終了時に削除される)
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        topdir = os.path.join(tmpdir, 'data')
+        if datadir is None:
+            n_files = mk_tree(topdir, years, fill_rate=fill_rate)
+            print('synthetic tree: %s years, %s files' % (
+                round(years, 1), n_files))
+        elif copy:
+            shutil.copytree(datadir, topdir)
+        else:
+            topdir = datadir
+
+        yield (topdir, tmpdir)
+
+
+def timeit(func, *args, repeat=3):
+    """
+    Returns
+    -------
+    (sec, result): (float, any)
+        最速の実行時間と、その結果
+    """
+    best = None
+    for _ in range(repeat):
+        t_start = time.perf_counter()
+        result = func(*args)
+        sec = time.perf_counter() - t_start
+        if best is None or sec < best:
+            best = sec
+
+    return (best, result)
+
+
+def find_files(datadir: str, max_files: int = 0) -> list:
+    """
+    ``YYYY/MM/DD.cgi``のデータファイルを、新しい順に列挙する
+
+    Parameters
+    ----------
+    datadir: str
+    max_files: int
+        0: 制限なし
+
+    Returns
+    -------
+    path_list: list of str
+    """
+    path_list = []
+    for dirpath, dirnames, filenames in os.walk(
+            os.path.expanduser(datadir)):
+        for f in filenames:
+            if f.endswith('.cgi') and f[:-4].isdigit():
+                path_list.append(os.path.join(dirpath, f))
+
+    path_list.sort(reverse=True)
+    if max_files > 0:
+        path_list = path_list[:max_files]
+
+    return path_list
+
+
+def read_files(path_list: list) -> list:
+    """
+    Returns
+    -------
+    text_list: list of str
+    """
+    text_list = []
+    for path in path_list:
+        for enc in ('utf-8', 'euc_jp'):
+            try:
+                with open(path, encoding=enc) as f:
+                    text_list.append(f.read())
+                break
+            except UnicodeDecodeError:
+                continue
+
+    return text_list
+
+
+def path2date(pathname: str) -> datetime.date:
+    (yyyy, mm, dd) = pathname[:-4].split('/')[-3:]
+    return datetime.date(int(yyyy), int(mm), int(dd))
+
+
+def get_rss() -> int:
+    """
+    現在のプロセスの RSS
+
+    Returns
+    -------
+    rss: int
+        bytes. 取得できない場合は 0
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return 0
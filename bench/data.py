@@ -0,0 +1,516 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+データの変更(保存・ジャーナル・設定・変更の検出)と、
+ToDo・キャッシュのベンチマーク
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import time
+import random
+import shutil
+import asyncio
+import datetime
+import itertools
+import tempfile
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+from ytsched import watcher
+from ytsched import journal
+from ytsched.query import Query
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+from ytsched.main_handler import MainHandler
+from ytsched.confstore import ConfStore
+from .common import data_tree, timeit
+
+
+def bench_watcher(datadir: str = None, years: int = 30) -> dict:
+    """
+    データファイルの変更検出のコスト
+
+    変更がない場合の``poll()``と、
+    1ファイルを変更した場合の``poll()`` + ``SchedData.revalidate()``の時間
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (指定したディレクトリのファイルは、変更しない)
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {watcher_class_name: {'idle': sec, 'change': sec}}
+    """
+    result = {}
+
+    modify = datadir is None
+    with data_tree(datadir, years) as (datadir, _):
+        sd = SchedData(datadir)
+        sd.preload(workers=1)
+        date_list = sd.find_dates()
+
+        for w_class in (watcher.InotifyWatcher, watcher.PollWatcher):
+            try:
+                w = w_class(datadir)
+            except OSError as ex:
+                print('%s: %s' % (w_class.__name__, ex))
+                continue
+
+            r = {}
+            (r['idle'], _) = timeit(w.poll, repeat=5)
+
+            if modify:
+                pathname = os.path.join(
+                    datadir, date_list[-1].strftime('%Y/%m/%d.cgi'))
+
+                def change():
+                    with open(pathname, mode='a') as f:
+                        f.write('\n')
+                    return sd.revalidate(w.poll())
+
+                (r['change'], out) = timeit(change)
+                if out != [date_list[-1]]:
+                    raise RuntimeError('%s: not detected' % (
+                        w_class.__name__))
+
+            w.close()
+            result[w_class.__name__] = r
+
+    print('days: %s' % (len(date_list)))
+    print('%-15s %12s %12s' % ('watcher', 'idle(msec)', 'change(msec)'))
+    for (name, r) in result.items():
+        print('%-15s %12.3f %12s' % (
+            name, r['idle'] * 1000,
+            '%.3f' % (r['change'] * 1000) if 'change' in r else '-'))
+
+    return result
+
+
+def bench_replace(datadir: str = None, years: int = 1,
+                  n: int = 200) -> dict:
+    """
+    予定の修正(fix/update): ``del_sde()``と``add_sde()``で2回書き込む方法と、
+    ``replace_sde()``で1回書き込む方法の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (書き換えるので、コピーして使う)
+    years: int
+    n: int
+        修正する予定の数 (半分は、日付を変える)
+
+    Returns
+    -------
+    result: dict
+        {'del+add': {'sec': sec, 'writes': int},
+         'replace': {'sec': sec, 'writes': int}}
+    """
+    result = {}
+    with data_tree(datadir, years) as (srcdir, tmpdir):
+        for method in ['del+add', 'replace']:
+            workdir = os.path.join(tmpdir, method)
+            shutil.copytree(srcdir, workdir)
+
+            sd = SchedData(workdir)
+            targets = []
+            for date in sd.find_dates()[-n:]:
+                sde = sd.get_sdf(date).sde[0]
+                new_date = date + datetime.timedelta(len(targets) % 2)
+                targets.append((date, SchedDataEnt(
+                    sde.sde_id, new_date, sde.time_start, sde.time_end,
+                    sde.type, sde.title + '!', sde.place, sde.detail)))
+
+            n_writes = [0]
+            save = SchedDataFile.save
+
+            def counted_save(sdf):
+                n_writes[0] += 1
+                save(sdf)
+
+            SchedDataFile.save = counted_save
+            try:
+                t_start = time.perf_counter()
+                for (orig_date, new_sde) in targets:
+                    if method == 'replace':
+                        sd.replace_sde(orig_date, new_sde)
+                    else:
+                        sd.del_sde(orig_date, new_sde.sde_id)
+                        sd.add_sde(new_sde.date, new_sde)
+                sec = time.perf_counter() - t_start
+            finally:
+                SchedDataFile.save = save
+
+            result[method] = {'sec': sec, 'writes': n_writes[0]}
+
+    print('%-8s %10s %8s' % ('method', 'per fix', 'writes'))
+    for (method, r) in result.items():
+        print('%-8s %8.2fms %8s' % (
+            method, r['sec'] / len(targets) * 1000, r['writes']))
+
+    return result
+
+
+def bench_journal(sizes: tuple = (100, 1000, 10000), n: int = 50) -> dict:
+    """
+    ToDo の追加・削除の時間: ``ToDo.cgi``を全て書き直す方法と、
+    ジャーナルに追記する方法(``open_journal()``)の、ToDo の数ごとの比較
+
+    Parameters
+    ----------
+    sizes: tuple of int
+        ToDo の数
+    n: int
+        追加・削除する回数 (それぞれ)
+
+    Returns
+    -------
+    result: dict
+        {size: {False: sec, True: sec}} (1回あたり)
+    """
+    today = datetime.date.today()
+
+    result = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            result[size] = {}
+            for use_journal in (False, True):
+                topdir = os.path.join(tmpdir, '%s-%s' % (size, use_journal))
+                os.makedirs(topdir)
+                with open(SchedDataFile.TODO_PATH_FORMAT % (topdir),
+                          'w') as f:
+                    for i in range(size):
+                        f.write(SchedDataEnt(
+                            'todo-%s' % (i), today, None, None, '□',
+                            'ToDo %s' % (i), '', 'detail %s' % (i)
+                        ).mk_dataline() + '\n')
+
+                sd = SchedData(topdir)
+                if use_journal:
+                    sd.open_journal(os.path.join(topdir,
+                                                 journal.DEF_FILENAME))
+                sd.get_sdf(None)
+
+                t_start = time.perf_counter()
+                for i in range(n):
+                    sde = SchedDataEnt(None, today, None, None, '□',
+                                       'new %s' % (i), '', '')
+                    sd.add_sde(None, sde)
+                    sd.del_sde(None, sde.sde_id)
+                sec = (time.perf_counter() - t_start) / (n * 2)
+
+                if use_journal:
+                    sd.compact_journal()
+                result[size][use_journal] = sec
+
+    print('%-8s %12s %12s' % ('ToDo', 'rewrite', 'journal'))
+    for (size, r) in result.items():
+        print('%-8s %10.2fms %10.2fms' % (
+            size, r[False] * 1000, r[True] * 1000))
+
+    return result
+
+
+def bench_conf(n: int = 1000, change_every: int = 10) -> dict:
+    """
+    ページ表示ごとの設定の取得・変更: リクエストごとに``Conf.cgi``を
+    読み込み、変更のたびに全て書き直す方法と、``ConfStore``の比較
+
+    Parameters
+    ----------
+    n: int
+        ページ表示の回数
+    change_every: int
+        何回に1回、フィルター文字列を変更するか
+
+    Returns
+    -------
+    result: dict
+        {'file'|'store': {'sec': sec, 'writes': int}}
+        sec: 1回あたり
+    """
+    def read_conf(pathname):
+        conf = {}
+        with open(pathname) as f:
+            for line in f.readlines():
+                (param, value) = line.split('\t', maxsplit=2)
+                conf[param] = value.rstrip('\n')
+        return conf
+
+    def write_conf(pathname, conf):
+        with open(pathname, mode='w') as f:
+            for (param, value) in conf.items():
+                f.write('%s\t%s\n' % (param, value))
+
+    async def views_store(pathname):
+        store = ConfStore(pathname)
+        for i in range(n):
+            conf = await store.get()
+            if i % change_every == 0:
+                value = 'filter %s' % (i)
+                if conf.get(MainHandler.CONF_KEY_FILTER_STR) != value:
+                    await store.set(MainHandler.CONF_KEY_FILTER_STR, value)
+        await store.flush()
+        return store.n_writes
+
+    result = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pathname = os.path.join(tmpdir, MainHandler.CONF_FNAME)
+        init_conf = {
+            MainHandler.CONF_KEY_TODO_DAYS: '14',
+            MainHandler.CONF_KEY_FILTER_STR: '',
+            MainHandler.CONF_KEY_SEARCH_STR: '',
+            MainHandler.CONF_KEY_SEARCH_N: '10',
+        }
+
+        write_conf(pathname, init_conf)
+        writes = 0
+        t_start = time.perf_counter()
+        for i in range(n):
+            conf = read_conf(pathname)
+            if i % change_every == 0:
+                value = 'filter %s' % (i)
+                if conf.get(MainHandler.CONF_KEY_FILTER_STR) != value:
+                    conf[MainHandler.CONF_KEY_FILTER_STR] = value
+                    write_conf(pathname, conf)
+                    writes += 1
+        result['file'] = {'sec': (time.perf_counter() - t_start) / n,
+                          'writes': writes}
+
+        write_conf(pathname, init_conf)
+        t_start = time.perf_counter()
+        writes = asyncio.run(views_store(pathname))
+        result['store'] = {'sec': (time.perf_counter() - t_start) / n,
+                           'writes': writes}
+
+    print('%-8s %12s %8s' % ('', 'per view', 'writes'))
+    for (name, r) in result.items():
+        print('%-8s %10.1fus %8s' % (name, r['sec'] * 1000000, r['writes']))
+
+    return result
+
+
+def bench_todo(sizes: tuple = (100, 500, 2000), days: int = 90,
+               repeat: int = 20) -> dict:
+    """
+    ページ1回分の ToDo の統合: 全ての ToDo を条件と照合し、日ごとに
+    全てを走査する従来の方法と、期限順のインデックス
+    (``SchedData.todo_range()``)で期間内のもののみを照合し、
+    日の順に統合する方法の、ToDo の数ごとの比較
+
+    Parameters
+    ----------
+    sizes: tuple of int
+        ToDo の数 (期限は、前後1年に分散させる)
+    days: int
+        表示する日数
+    repeat: int
+
+    Returns
+    -------
+    result: dict
+        {size: {False: sec, True: sec}} (1回あたり)
+    """
+    today = datetime.date.today()
+    date_from = today - datetime.timedelta(days // 2)
+    date_to = date_from + datetime.timedelta(days - 1)
+    todo_days = MainHandler.DEF_TODO_DAYS
+    query = Query('todo', debug=False)
+    rnd = random.Random(0)
+
+    def legacy(sd):
+        todo_sde = [sde for sde in sd.get_sdf(None).sde
+                    if query.match_sde(sde)]
+        today_sde = [sde for sde in todo_sde
+                     if sde.date <= today + datetime.timedelta(todo_days)
+                     and sde.date != today]
+        out = []
+        for date in SchedData._date_range(date_from, date_to):
+            out.append([sde for sde in todo_sde if sde.date == date])
+        return (out, today_sde)
+
+    def indexed(sd):
+        todo_sde = [sde for sde in sd.todo_range(date_from, date_to)
+                    if query.match_sde(sde)]
+        today_sde = [sde for sde in sd.todo_range(
+            None, today + datetime.timedelta(todo_days))
+                     if sde.date != today and query.match_sde(sde)]
+        groups = {d: list(g) for (d, g) in itertools.groupby(
+            todo_sde, key=lambda sde: sde.date)}
+        out = [groups.get(date, [])
+               for date in SchedData._date_range(date_from, date_to)]
+        return (out, today_sde)
+
+    result = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in sizes:
+            topdir = os.path.join(tmpdir, str(size))
+            os.makedirs(topdir)
+            with open(SchedDataFile.TODO_PATH_FORMAT % (topdir), 'w') as f:
+                for i in range(size):
+                    f.write(SchedDataEnt(
+                        'todo-%s' % (i),
+                        today + datetime.timedelta(rnd.randint(-365, 365)),
+                        None, None, '□', 'ToDo %s' % (i), '', ''
+                    ).mk_dataline() + '\n')
+
+            sd = SchedData(topdir)
+            if legacy(sd) != indexed(sd):
+                raise RuntimeError('size=%s: results differ' % (size))
+
+            result[size] = {}
+            for (use_index, func) in ((False, legacy), (True, indexed)):
+                t_start = time.perf_counter()
+                for _ in range(repeat):
+                    func(sd)
+                result[size][use_index] = (
+                    time.perf_counter() - t_start) / repeat
+
+    print('%s days' % (days))
+    print('%-8s %12s %12s' % ('ToDo', 'scan', 'index'))
+    for (size, r) in result.items():
+        print('%-8s %10.2fms %10.2fms' % (
+            size, r[False] * 1000, r[True] * 1000))
+
+    return result
+
+
+class _BurstSchedData(SchedData):
+    """
+    比較用: 一杯になったら、日数の``CACHE_DISCARD_RATE``分をまとめて捨てる
+    従来のキャッシュ
+    """
+    CACHE_DISCARD_RATE = 0.1
+
+    def _cache_put(self, date, sdf):
+        if len(self._sdf_cache) + len(self._snapshot_rows) >= self._cache_size:
+            discard_size = int(self._cache_size * self.CACHE_DISCARD_RATE)
+            for i in range(discard_size):
+                if self._snapshot_rows:
+                    del self._snapshot_rows[next(iter(self._snapshot_rows))]
+                elif self._sdf_cache:
+                    self._sdf_cache.popitem(last=False)
+
+        self._sdf_cache[date] = sdf
+
+
+def _est_cache(datadir: str, lazy: bool) -> (int, int, int):
+    """
+    全データをキャッシュに読み込んで、推定値と実際のメモリ使用量を測る
+
+    ``bench_cache()``から、子プロセスで実行される。
+
+    Returns
+    -------
+    (n_days, est, mem): (int, int, int)
+        est: ``SchedData.get_cache_bytes()``
+        mem: tracemalloc の増分
+    """
+    sd = SchedData(datadir, lazy=lazy)
+    sd.get_sdf(None)
+
+    tracemalloc.start()
+    sd.preload(workers=1)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (sd.get_cache_size(), sd.get_cache_bytes(), mem)
+
+
+def bench_cache(years: int = 20, cache_days: int = 2000,
+                n: int = 20000) -> dict:
+    """
+    キャッシュのメモリ使用量の推定値と、追い出し
+
+    * 推定値(``SchedData.get_cache_bytes()``)と、tracemalloc の増分の比較
+    * 日数の10%をまとめて捨てる従来の方法と、一つずつ捨てる方法の、
+      1日を参照する時間の最大値・99パーセンタイル
+      (キャッシュにない場合は、サーバーの先読みと同様に、
+      ``load_sdf()``と``put_sdf()``で追加してから``get_sdf()``)
+
+    Parameters
+    ----------
+    years: int
+        合成データの年数 (全日にデータあり)
+    cache_days: int
+        キャッシュする日数 (従来の方法の上限、
+        一つずつ捨てる方法は、同じ日数分の推定値を``cache_mb``にする)
+    n: int
+        ランダムな日を参照する回数
+
+    Returns
+    -------
+    result: dict
+        {'est': {lazy: {...}}, 'evict': {label: {...}}}
+    """
+    result = {'est': {}, 'evict': {}}
+    ctx = multiprocessing.get_context('fork')
+
+    with data_tree(None, years, fill_rate=1.0) as (datadir, _):
+        for lazy in (False, True):
+            with concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=ctx) as executor:
+                (n_days, est, mem) = executor.submit(
+                    _est_cache, datadir, lazy).result()
+            result['est'][lazy] = {'days': n_days, 'est': est, 'mem': mem,
+                                   'ratio': est / max(mem, 1)}
+
+        date_list = SchedData(datadir).find_dates()
+        rnd = random.Random(0)
+        days = [rnd.choice(date_list[-cache_days * 2:]) for _ in range(n)]
+
+        def get_day(sd, date):
+            if not sd.is_cached(date):
+                sd.put_sdf(date, sd.load_sdf(date))
+            return sd.get_sdf(date)
+
+        # 同じ日数分のメモリ使用量の推定値を、上限にする
+        sd = SchedData(datadir)
+        for date in date_list[-cache_days:]:
+            get_day(sd, date)
+        cache_mb = sd.get_cache_bytes() / 1024 / 1024
+
+        for (label, sd) in (
+                ('burst', _BurstSchedData(datadir, cache_size=cache_days,
+                                          cache_mb=cache_mb * 10)),
+                ('incr', SchedData(datadir, cache_size=cache_days * 10,
+                                    cache_mb=cache_mb))):
+            for date in days:
+                get_day(sd, date)
+
+            lat = []
+            for date in days:
+                t_start = time.perf_counter()
+                get_day(sd, date)
+                lat.append(time.perf_counter() - t_start)
+            lat.sort()
+
+            result['evict'][label] = {
+                'max': lat[-1], 'p99': lat[int(len(lat) * 0.99)],
+                'mean': sum(lat) / len(lat),
+                'days': sd.get_cache_size()}
+
+    print('%-8s %8s %10s %10s %8s' % ('', 'days', 'est(MB)', 'mem(MB)',
+                                       'est/mem'))
+    for (lazy, r) in result['est'].items():
+        print('%-8s %8s %10.1f %10.1f %8.2f' % (
+            'lazy' if lazy else 'default', r['days'],
+            r['est'] / 1024 / 1024, r['mem'] / 1024 / 1024, r['ratio']))
+
+    print()
+    print('%s random days of the last %s, cache %.1fMB' % (
+        n, cache_days * 2, cache_mb))
+    print('%-8s %10s %10s %10s %8s' % ('', 'mean', 'p99', 'max', 'days'))
+    for (label, r) in result['evict'].items():
+        print('%-8s %8.1fus %8.1fus %8.1fus %8s' % (
+            label, r['mean'] * 1e6, r['p99'] * 1e6, r['max'] * 1e6,
+            r['days']))
+
+    return result
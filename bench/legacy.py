@@ -0,0 +1,226 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+比較用の従来の実装
+
+ベンチマークで、現在の実装と結果・時間を比較する
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+import sys
+import inspect
+import logging
+import datetime
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+from ytsched.my_logger import CONSOLE_HANDLER
+
+
+def legacy_htmlstr2text(intext: str) -> str:
+    """
+    比較用: 従来の``htmlstr2text()``
+    """
+    resub_tbl = {
+        r'&amp;#160;': ' ',
+        r'&gt;': '>',
+        r'&lt;': '<',
+        r'&nbsp:': ' ',
+        r'&#160;': ' ',
+        r'\<BR *\/*\>': '\n'
+    }
+
+    outtext = intext
+    outtext = outtext.replace('&nbsp;', ' ')
+    outtext = outtext.replace('（', '(')
+    outtext = outtext.replace('）', ')')
+
+    for k in resub_tbl:
+        outtext = re.sub(k, resub_tbl[k], outtext, flags=re.IGNORECASE)
+
+    return outtext
+
+
+class BenchEnt(SchedDataEnt):
+    """
+    ロガーの生成などを省いて、解析処理だけを比較するためのエンティティ
+    """
+    __slots__ = ()
+
+    def __init__(self, sde_id, date, time_start, time_end,
+                 sde_type, title, place, detail):
+        self._flags = 0
+        self.sde_id = sde_id
+        self.date = date
+        self.time_start = time_start
+        self.time_end = time_end
+        self.type = sde_type
+        self.title = title or self.TITLE_NULL
+        self.place = sys.intern(place)
+        self.detail = detail
+
+
+class LegacyEnt:
+    """
+    比較用: 従来の(``__dict__``を持つ)エンティティと同じ属性
+    """
+    def __init__(self, sde_id, date, time_start, time_end,
+                 sde_type, title, place, detail):
+        self._dbg = False
+        self.sde_id = sde_id
+        self.date = date
+        self.time_start = time_start
+        self.time_end = time_end
+        self.type = sde_type
+        self.title = title or SchedDataEnt.TITLE_NULL
+        self.place = place
+        self.detail = detail
+
+    EST_BYTES = SchedDataEnt.EST_BYTES
+    EST_CHAR_BYTES = SchedDataEnt.EST_CHAR_BYTES
+    est_bytes = SchedDataEnt.est_bytes
+
+    def is_holiday(self):
+        return self.type in SchedDataEnt.TYPE_HOLYDAY
+
+
+class BenchSchedDataFile(SchedDataFile):
+    """
+    ``ent_class``のエンティティを生成するデータファイル
+    """
+    ent_class = BenchEnt
+
+    def _mk_sde(self, *args):
+        return self.ent_class(*args)
+
+
+class LegacySchedDataFile(BenchSchedDataFile):
+    ent_class = LegacyEnt
+
+
+class BenchSchedData(SchedData):
+    """
+    ``sdf_class``のデータファイルを読み込む
+    """
+    sdf_class = BenchSchedDataFile
+
+    def _new_sdf(self, date=None):
+        return self.sdf_class(date, self._topdir, debug=self._dbg)
+
+
+class LegacySchedData(BenchSchedData):
+    sdf_class = LegacySchedDataFile
+
+
+def legacy_get_logger(name, dbg=False):
+    """
+    比較用: 従来の``my_logger.get_logger()``
+    """
+    filename = inspect.stack()[1].filename.split('/')[-1]
+    name = filename + '.' + name
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.addHandler(CONSOLE_HANDLER)
+    logger.setLevel(logging.INFO)
+    if dbg:
+        logger.setLevel(logging.DEBUG)
+
+    return logger
+
+
+class LegacyLogEnt(SchedDataEnt):
+    """
+    比較用: 生成ごとにロガーを取得するエンティティ
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        self.__class__._mylog = legacy_get_logger(self.__class__.__name__,
+                                                   kwargs.get('debug'))
+        self._mylog.debug('%s', args)
+        super().__init__(*args, **kwargs)
+
+
+class LegacyLogSchedDataFile(SchedDataFile):
+    """
+    比較用: 生成ごとにロガーを取得するデータファイル
+    """
+    def __init__(self, *args, **kwargs):
+        self._mylog = legacy_get_logger(self.__class__.__name__,
+                                         kwargs.get('debug'))
+        super().__init__(*args, **kwargs)
+
+    def _mk_sde(self, sde_id, date, time_start, time_end,
+                sde_type, title, place, detail):
+        return LegacyLogEnt(sde_id, date, time_start, time_end,
+                             sde_type, title, place, detail,
+                             decode_detail=False, debug=self._dbg)
+
+
+def legacy_load(pathname: str) -> list:
+    """
+    比較用: 従来の``SchedDataFile.load()``
+    """
+    try:
+        with open(pathname, encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+
+    out = []
+    for l in lines:
+        d = [legacy_htmlstr2text(d1) for d1 in l.split('\t')]
+
+        date1 = d[1].split('/')
+        date2 = datetime.date(int(date1[0]), int(date1[1]), int(date1[2]))
+
+        time1 = d[2].split('-')
+        time_start1 = time1[0].split(':')
+        time_end1 = time1[1].split(':')
+
+        if time_start1[0]:
+            time_start2 = datetime.time(
+                int(time_start1[0]) % 24, int(time_start1[1]) % 60)
+        else:
+            time_start2 = ''
+
+        if time_end1[0]:
+            time_end2 = datetime.time(
+                int(time_end1[0]) % 24, int(time_end1[1]) % 60)
+        else:
+            time_end2 = ''
+
+        sde = BenchEnt(d[0], date2, time_start2, time_end2,
+                        d[3], d[4], d[5], legacy_htmlstr2text(d[6]))
+        out.append(sde)
+
+    return sorted(out, key=lambda x: x.get_sortkey())
+
+
+def legacy_match(filter_str: str, search_str: str,
+                  sde_search_str: str) -> bool:
+    """
+    比較用: 従来の``MainHandler.match()``
+    """
+    try:
+        if filter_str.startswith('!'):
+            if re.search(filter_str[1:], sde_search_str):
+                return False
+
+        else:
+            if not re.search(filter_str, sde_search_str):
+                return False
+
+    except re.error:
+        return False
+
+    if search_str:
+        try:
+            if not re.search(search_str, sde_search_str):
+                return False
+
+        except re.error:
+            return False
+
+    return True
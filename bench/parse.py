@@ -0,0 +1,380 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+データファイルの読み込み・変換と、メモリ使用量のベンチマーク
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import tracemalloc
+import multiprocessing
+import concurrent.futures
+from ytsched import htmlcodec
+from ytsched import dayparser
+from ytsched.query import Query
+from ytsched.ytsched import SchedDataFile, SchedData
+from ytsched.my_logger import get_logger
+from .common import data_tree, timeit, find_files, read_files, path2date
+from .common import get_rss
+from .legacy import legacy_htmlstr2text, legacy_load, legacy_get_logger
+from .legacy import BenchEnt, BenchSchedData, LegacySchedData
+from .legacy import LegacyLogSchedDataFile
+
+
+def bench_codec(datadir: str, max_files: int = 0) -> dict:
+    """
+    HTML文字列の変換: 従来の逐次置換と、``htmlcodec``の比較
+
+    Parameters
+    ----------
+    datadir: str
+    max_files: int
+
+    Returns
+    -------
+    result: dict
+        {'files': .., 'lines': .., 'legacy': sec, 'field': sec,
+         'batch': sec}
+    """
+    text_list = read_files(find_files(datadir, max_files))
+    n_lines = sum(len(htmlcodec.split_lines(t)) for t in text_list)
+
+    def legacy():
+        return [[[legacy_htmlstr2text(f) for f in line.split('\t')]
+                 for line in htmlcodec.split_lines(t)]
+                for t in text_list]
+
+    def field():
+        return [[[htmlcodec.decode(f) for f in line.split('\t')]
+                 for line in htmlcodec.split_lines(t)]
+                for t in text_list]
+
+    def batch():
+        return [[line.split('\t') for line in htmlcodec.decode_lines(t)]
+                for t in text_list]
+
+    (sec_legacy, out_legacy) = timeit(legacy)
+    (sec_field, out_field) = timeit(field)
+    (sec_batch, out_batch) = timeit(batch)
+
+    if out_field != out_legacy or out_batch != out_legacy:
+        raise RuntimeError('htmlcodec: output mismatch')
+
+    result = {
+        'files': len(text_list), 'lines': n_lines,
+        'legacy': sec_legacy, 'field': sec_field, 'batch': sec_batch
+    }
+
+    print('files: %s, lines: %s' % (len(text_list), n_lines))
+    for k in ('legacy', 'field', 'batch'):
+        print('  %-8s %8.3f msec  x%.1f' % (
+            k, result[k] * 1000, sec_legacy / max(result[k], 1e-9)))
+
+    return result
+
+
+def bench_parser(datadir: str = None, years: int = 30) -> dict:
+    """
+    データファイルの読み込み: 従来の``load()``と、``dayparser``の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {'files': .., 'ents': .., 'legacy': sec, 'parser': sec}
+    """
+    with data_tree(datadir, years) as (datadir, _):
+        path_list = find_files(datadir)
+        date_list = [path2date(p) for p in path_list]
+
+        def legacy():
+            return [legacy_load(p) for p in path_list]
+
+        def parser():
+            return [dayparser.parse(htmlcodec.decode_lines(text), d,
+                                    BenchEnt)[0]
+                    for (d, text) in zip(date_list, read_files(path_list))]
+
+        (sec_legacy, out_legacy) = timeit(legacy, repeat=1)
+        (sec_parser, out_parser) = timeit(parser, repeat=1)
+
+    n_ents = sum(len(sde_list) for sde_list in out_parser)
+    for (a, b) in zip(out_legacy, out_parser):
+        if [x.mk_dataline() for x in a] != [x.mk_dataline() for x in b]:
+            raise RuntimeError('dayparser: output mismatch')
+
+    result = {'files': len(path_list), 'ents': n_ents,
+              'legacy': sec_legacy, 'parser': sec_parser}
+
+    print('files: %s, entities: %s' % (len(path_list), n_ents))
+    for k in ('legacy', 'parser'):
+        print('  %-8s %8.3f sec  %8.0f files/sec  x%.1f' % (
+            k, result[k], len(path_list) / max(result[k], 1e-9),
+            sec_legacy / max(result[k], 1e-9)))
+
+    return result
+
+
+def bench_lazy(datadir: str = None, years: int = 20) -> dict:
+    """
+    通常のエンティティと、遅延変換版(``lazy=True``)の比較
+
+    全データを読み込んだ時のメモリ使用量と、
+    読み込み・休日判定・検索・表示(直近90日分の全フィールド参照)の時間
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {False: {...}, True: {...}}
+    """
+    result = {}
+
+    with data_tree(datadir, years) as (datadir, _):
+        today = datetime.date.today()
+        recent = [today - datetime.timedelta(days=i) for i in range(90)]
+
+        for lazy in (False, True):
+            r = {}
+
+            tracemalloc.start()
+            sd = SchedData(datadir, lazy=lazy)
+            sd.preload(workers=1)
+            r['mem'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            sd = SchedData(datadir, lazy=lazy)
+            (r['load'], _) = timeit(sd.preload, repeat=1)
+            sdf_list = [sd.get_sdf(d) for d in sd.find_dates()]
+
+            (r['holiday'], _) = timeit(
+                lambda: [sdf.sde[0].is_holiday()
+                         for sdf in sdf_list if sdf.sde], repeat=1)
+
+            (r['render'], _) = timeit(
+                lambda: [(sde.title, sde.place, sde.detail, sde.time_start)
+                         for d in recent for sde in sd.get_sdf(d).sde],
+                repeat=1)
+
+            (r['search'], _) = timeit(
+                lambda: [sde for sdf in sdf_list for sde in sdf.sde
+                         if 'xyz' in sde.search_str()], repeat=1)
+
+            result[lazy] = r
+
+    print('%-6s %10s %9s %9s %9s %9s' % (
+        'lazy', 'mem(MB)', 'load', 'holiday', 'render', 'search'))
+    for lazy in (False, True):
+        r = result[lazy]
+        print('%-6s %10.1f %8.3fs %8.3fs %8.3fs %8.3fs' % (
+            lazy, r['mem'] / 1024 / 1024, r['load'], r['holiday'],
+            r['render'], r['search']))
+
+    return result
+
+
+def bench_logger(datadir: str = None, years: int = 10) -> dict:
+    """
+    ``SchedDataFile.load()``: 生成ごとにロガーを取得する従来の方法と、
+    生成済みのロガーを使う方法の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {'files': .., 'ents': .., 'legacy': sec, 'memoized': sec,
+         'get_logger': (legacy_sec, memoized_sec)}
+    """
+    with data_tree(datadir, years) as (datadir, _):
+        date_list = [path2date(p) for p in find_files(datadir)]
+
+        def load(sdf_class):
+            return [sdf_class(d, datadir) for d in date_list]
+
+        (sec_legacy, _) = timeit(load, LegacyLogSchedDataFile, repeat=1)
+        (sec_memo, out) = timeit(load, SchedDataFile, repeat=1)
+
+        n_loop = 1000
+        (sec_get_legacy, _) = timeit(
+            lambda: [legacy_get_logger('bench') for _ in range(n_loop)])
+        (sec_get_memo, _) = timeit(
+            lambda: [get_logger('bench') for _ in range(n_loop)])
+
+    n_ents = sum([len(sdf.sde) for sdf in out])
+    result = {'files': len(date_list), 'ents': n_ents,
+              'legacy': sec_legacy, 'memoized': sec_memo,
+              'get_logger': (sec_get_legacy / n_loop, sec_get_memo / n_loop)}
+
+    print('files: %s, entities: %s' % (len(date_list), n_ents))
+    for k in ('legacy', 'memoized'):
+        print('  %-8s %8.3f sec  %8.0f files/sec  x%.1f' % (
+            k, result[k], len(date_list) / max(result[k], 1e-9),
+            sec_legacy / max(result[k], 1e-9)))
+    print('  get_logger(): legacy %.1f usec, memoized %.1f usec' % (
+        result['get_logger'][0] * 1e6, result['get_logger'][1] * 1e6))
+
+    return result
+
+
+def _fill_cache(sd_class, datadir: str, cache_size: int,
+                trace: bool) -> (int, int, int):
+    """
+    全データをキャッシュに読み込んで、メモリ使用量を測る
+
+    ``bench_memory()``から、子プロセスで実行される。
+
+    Returns
+    -------
+    (n_ents, mem, rss): (int, int, int)
+        mem: tracemalloc の増分 (``trace``が False の場合は 0)
+        rss: RSS の増分
+    """
+    rss0 = get_rss()
+    if trace:
+        tracemalloc.start()
+
+    sd = sd_class(datadir, cache_size=cache_size)
+    sd.preload(workers=1)
+
+    mem = 0
+    if trace:
+        mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    n_ents = sum([len(sdf.sde) for sdf in sd._sdf_cache.values()])
+
+    return (n_ents, mem, get_rss() - rss0)
+
+
+def bench_memory(datadir: str = None, days: int = 20000) -> dict:
+    """
+    従来の(``__dict__``を持つ)エンティティと、
+    ``__slots__``版のエンティティのメモリ使用量の比較
+
+    全データ(合成データの場合は、``days``日分)をキャッシュに読み込んだ時の、
+    エンティティ 1個あたりのバイト数(tracemalloc)と、RSS の増分
+
+    Notes
+    -----
+    フラグメンテーションの影響を避けるため、測定ごとに子プロセスを使う。
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``days``日分(全日にデータあり)の合成データを生成する
+    days: int
+
+    Returns
+    -------
+    result: dict
+        {'dict': {...}, 'slots': {...}}
+    """
+    result = {}
+    ctx = multiprocessing.get_context('fork')
+
+    with data_tree(datadir, (days - 365) / 365.25,
+                   fill_rate=1.0) as (datadir, _):
+        cache_size = len(SchedData(datadir).find_dates()) + 1
+
+        for (k, sd_class) in (('dict', LegacySchedData),
+                              ('slots', BenchSchedData)):
+            r = {}
+            for trace in (False, True):
+                with concurrent.futures.ProcessPoolExecutor(
+                        1, mp_context=ctx) as executor:
+                    (n_ents, mem, rss) = executor.submit(
+                        _fill_cache, sd_class, datadir, cache_size,
+                        trace).result()
+                if trace:
+                    r['mem'] = mem
+                else:
+                    r['rss'] = rss
+
+            r['n_ents'] = n_ents
+            r['bytes/ent'] = r['mem'] / max(n_ents, 1)
+            result[k] = r
+
+    print('cache: %s days, entities: %s' % (cache_size - 1, n_ents))
+    print('%-6s %10s %10s %10s' % ('', 'bytes/ent', 'mem(MB)', 'RSS(MB)'))
+    for k in ('dict', 'slots'):
+        r = result[k]
+        print('%-6s %10.1f %10.1f %10.1f' % (
+            k, r['bytes/ent'], r['mem'] / 1024 / 1024,
+            r['rss'] / 1024 / 1024))
+
+    return result
+
+
+def bench_columnar(datadir: str = None, years: int = 20) -> dict:
+    """
+    日ごとの SchedDataFile と、列指向ストア(``columnar=True``)の比較
+
+    全データを読み込んだ時のメモリ使用量と、
+    全期間の走査(条件なし・正規表現で絞り込み)の時間
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {False: {...}, True: {...}}
+    """
+    result = {}
+
+    query = Query('打合せ')
+
+    with data_tree(datadir, years) as (datadir, _):
+        for columnar in (False, True):
+            r = {}
+
+            tracemalloc.start()
+            sd = SchedData(datadir, columnar=columnar)
+            sd.preload(workers=1)
+            r['mem'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            date_list = sd.find_dates()
+            (date_from, date_to) = (date_list[0], date_list[-1])
+
+            (r['scan'], _) = timeit(
+                lambda: list(sd.iter_range(date_from, date_to,
+                                           reverse=True)))
+            (r['filter'], out) = timeit(
+                lambda: list(sd.iter_range(date_from, date_to,
+                                           reverse=True, query=query)))
+            r['hits'] = sum([len(sde_list) for (_, _, sde_list) in out])
+
+            result[columnar] = r
+
+    if result[False]['hits'] != result[True]['hits']:
+        raise RuntimeError('columnar: output mismatch')
+
+    print('%-9s %10s %9s %9s' % ('columnar', 'mem(MB)', 'scan', 'filter'))
+    for columnar in (False, True):
+        r = result[columnar]
+        print('%-9s %10.1f %8.3fs %8.3fs' % (
+            columnar, r['mem'] / 1024 / 1024, r['scan'], r['filter']))
+    print('filter hits: %s' % (result[True]['hits']))
+
+    return result
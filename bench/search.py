@@ -0,0 +1,223 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+検索・フィルター・期間の走査のベンチマーク
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import datetime
+from ytsched import ngram
+from ytsched.query import Query, is_structured
+from ytsched.ytsched import SchedData
+from .common import data_tree, timeit, find_files, path2date
+from .legacy import legacy_match
+
+
+def bench_search(datadir: str = None, years: int = 30) -> dict:
+    """
+    全期間の検索: 全ての日を照合する方法と、
+    N-gram インデックスで候補の日を絞り込んでから照合する方法の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {pattern: {'hits': .., 'candidates': .., 'scan': sec, 'index': sec}}
+    """
+    result = {}
+
+    patterns = ['打合せ', '歯医者', '本社', 'example.com',
+                '重要.*打合せ', r'\d行目', '定期健診', '健診.*本社']
+
+    synthetic = datadir is None
+    with data_tree(datadir, years) as (datadir, tmpdir):
+        if synthetic:
+            # 滅多に出てこない言葉
+            for pathname in find_files(datadir)[::1000]:
+                with open(pathname, mode='a') as f:
+                    f.write('\t'.join([
+                        '1-1', path2date(pathname).strftime('%Y/%m/%d'),
+                        ':-:', '', '定期健診', '本社', '']) + '\n')
+
+        sd = SchedData(datadir, search_index=True)
+        sd.preload(workers=1)
+        (sec_build, _) = timeit(
+            sd.load_index, os.path.join(tmpdir, 'index'), 1, repeat=1)
+
+        date_list = sd.find_dates()
+        (date_from, date_to) = (date_list[0], date_list[-1])
+
+        for pattern in patterns:
+            query = Query('', pattern)
+
+            def scan(dates=None):
+                return [(d, sde.sde_id) for (d, _, sde_list)
+                        in sd.iter_range(date_from, date_to, reverse=True,
+                                         query=query, dates=dates)
+                        for sde in sde_list]
+
+            literal_list = ngram.required_literals(pattern)
+
+            def index():
+                return scan(sd.search_dates(literal_list))
+
+            r = {}
+            (r['scan'], out_scan) = timeit(scan)
+            (r['index'], out_index) = timeit(index)
+            if out_scan != out_index:
+                raise RuntimeError('%s: output mismatch' % (pattern))
+
+            candidates = sd.search_dates(literal_list)
+            r['hits'] = len(out_scan)
+            r['candidates'] = None if candidates is None else len(candidates)
+            result[pattern] = r
+
+    print('days: %s, index build: %.3f sec' % (len(date_list), sec_build))
+    print('%-14s %6s %6s %10s %10s' % (
+        'pattern', 'hits', 'cands', 'scan', 'index'))
+    for (pattern, r) in result.items():
+        print('%-14s %6s %6s %8.1fms %8.1fms' % (
+            pattern, r['hits'],
+            '-' if r['candidates'] is None else r['candidates'],
+            r['scan'] * 1000, r['index'] * 1000))
+
+    return result
+
+
+def bench_query(datadir: str = None, years: int = 10) -> dict:
+    """
+    フィルター・検索文字列の照合:
+    エンティティごとに``re.search()``する従来の方法と、
+    コンパイルした``Query``の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+    years: int
+
+    Returns
+    -------
+    result: dict
+        {(filter_str, search_str): {'hits': .., 'legacy': sec, 'query': sec}}
+    """
+    result = {}
+
+    cases = [(' ', ''), ('!打合せ', ''), ('重要.*打合せ', ''), ('本社', ''),
+             (' ', '歯医者'), ('!本社', r'\d行目'),
+             ('?NOT 本社', '?打合せ OR 歯医者'),
+             ('', '?+打合せ after:%d' % (datetime.date.today().year - 2))]
+
+    with data_tree(datadir, years) as (datadir, _):
+        sd = SchedData(datadir)
+        sd.preload(workers=1)
+
+        sde_list = [sde for date in sd.find_dates()
+                    for sde in sd.get_sdf(date).sde]
+        search_list = [sde.search_str() for sde in sde_list]
+
+        for (filter_str, search_str) in cases:
+            def legacy():
+                (f, s) = (filter_str.lower(), search_str.lower())
+                return [i for (i, sde_s) in enumerate(search_list)
+                        if legacy_match(f, s, sde_s)]
+
+            def query():
+                match_sde = Query(filter_str, search_str).match_sde
+                return [i for (i, sde) in enumerate(sde_list)
+                        if match_sde(sde)]
+
+            r = {}
+            (r['legacy'], out_legacy) = timeit(legacy)
+            (r['query'], out_query) = timeit(query)
+            # クエリーとして解析するものは、結果が異なる
+            legacy_str = not (is_structured(filter_str) or
+                              is_structured(search_str))
+            if legacy_str and out_legacy != out_query:
+                raise RuntimeError('%a %a: output mismatch' % (
+                    filter_str, search_str))
+
+            r['hits'] = len(out_query)
+            result[(filter_str, search_str)] = r
+
+    print('entities: %s' % (len(sde_list)))
+    print('%-14s %-22s %6s %10s %10s' % (
+        'filter', 'search', 'hits', 'legacy', 'query'))
+    for ((filter_str, search_str), r) in result.items():
+        print('%-14s %-22s %6s %8.1fms %8.1fms' % (
+            filter_str, search_str, r['hits'],
+            r['legacy'] * 1000, r['query'] * 1000))
+
+    return result
+
+
+def bench_range(years: int = 20, fill_rate: float = 0.05,
+                limit: int = 10) -> dict:
+    """
+    期間内の走査: 1日ずつ``get_sdf()``する従来のループと、
+    ``SchedData.iter_range()``(空の月を飛ばす)の比較
+    (まばらな合成データ、キャッシュ済み)
+
+    Parameters
+    ----------
+    years: int
+    fill_rate: float
+        データがある日の割合
+    limit: int
+        検索で止める件数
+
+    Returns
+    -------
+    result: dict
+        {label: {False: sec, True: sec}}
+        'all': 全期間の全てのエンティティ
+        'search': 新しい日付から、条件に合うものを``limit``件
+    """
+    today = datetime.date.today()
+    date_from = today - datetime.timedelta(round(365.25 * years))
+
+    def day_loop(sd, query, limit):
+        out = []
+        count = 0
+        for date in SchedData._date_range(date_from, today, reverse=True):
+            sdf = sd.get_sdf(date)
+            sde_list = [sde for sde in sdf.sde
+                        if query is None or query.match_sde(sde)]
+            if not sdf.sde:
+                continue
+            out.append((date, sdf.is_holiday, sde_list))
+            count += len(sde_list)
+            if limit is not None and count >= limit:
+                break
+        return out
+
+    def iter_range(sd, query, limit):
+        return list(sd.iter_range(date_from, today, reverse=True,
+                                  query=query, limit=limit))
+
+    result = {}
+    with data_tree(None, years, fill_rate=fill_rate) as (datadir, _):
+        sd = SchedData(datadir)
+        sd.preload(workers=1)
+
+        for (label, args) in (('all', (None, None)),
+                              ('search', (Query('誕生日'), limit))):
+            result[label] = {}
+            for (use_iter, func) in ((False, day_loop), (True, iter_range)):
+                (result[label][use_iter], out) = timeit(func, sd, *args)
+                result[label][(use_iter, 'days')] = len(out)
+
+    print('%-8s %12s %12s %6s' % ('', 'day loop', 'iter_range', 'days'))
+    for (label, r) in result.items():
+        print('%-8s %10.2fms %10.2fms %6s' % (
+            label, r[False] * 1000, r[True] * 1000, r[(True, 'days')]))
+
+    return result
@@ -0,0 +1,549 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+``ytsched webapp``を別プロセスで起動して計測するベンチマーク
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import datetime
+import subprocess
+import http.client
+import urllib.parse
+import multiprocessing
+import concurrent.futures
+from ytsched.main_handler import MainHandler
+from ytsched.async_data import AsyncSchedData
+from .common import data_tree, timeit, path2date
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _ttfb(port: int, params: dict, path: str = '/ytsched/',
+          method: str = 'POST', headers: dict = None) -> (float, float, int):
+    """
+    Returns
+    -------
+    (ttfb, total, size): (float, float, int)
+        最初の1バイトまでの時間(秒)、全体の時間(秒)、サイズ
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        t_start = time.perf_counter()
+        if method == 'GET':
+            conn.request('GET', path + '?' + urllib.parse.urlencode(params),
+                         headers=headers or {})
+        else:
+            conn.request(
+                'POST', path, urllib.parse.urlencode(params),
+                {'Content-Type': 'application/x-www-form-urlencoded'})
+        resp = conn.getresponse()
+        body = resp.read(1)
+        ttfb = time.perf_counter() - t_start
+        body += resp.read()
+        total = time.perf_counter() - t_start
+    finally:
+        conn.close()
+
+    return (ttfb, total, len(body))
+
+
+def _start_server(datadir: str, webroot: str = None,
+                  args: list = ()) -> (subprocess.Popen, int):
+    """
+    ``ytsched webapp``を別プロセスで起動して、応答するまで待つ
+
+    Parameters
+    ----------
+    datadir: str
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+    args: list of str
+        追加のオプション
+
+    Returns
+    -------
+    (proc, port): (subprocess.Popen, int)
+    """
+    topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if webroot is None:
+        webroot = os.path.join(topdir, 'webroot')
+
+    port = _free_port()
+    cmd = [sys.executable, '-m', 'ytsched', 'webapp',
+           '-p', str(port), '-r', webroot, '-w', datadir,
+           '--preload-years', '100', '--snapshot-interval', '0',
+           '--watch-interval', '0'] + list(args)
+
+    proc = subprocess.Popen(cmd, cwd=topdir, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for _ in range(600):
+        try:
+            _ttfb(port, {}, '/ytsched/static/favicon.ico', 'GET')
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    return (proc, port)
+
+
+def bench_stream(datadir: str = None, years: int = 20,
+                 webroot: str = None) -> dict:
+    """
+    ページ全体を描画してから送る方法と、分割して送る方法(``--stream``)の
+    最初の1バイトまでの時間(TTFB)の比較
+
+    サーバーを別プロセスで起動して、HTTP で計る。
+    (N-gram インデックスは使わない: 検索モードでは5年分を遡る)
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+
+    Returns
+    -------
+    result: dict
+        {(label, stream): {'ttfb': sec, 'total': sec, 'size': bytes}}
+    """
+    today = datetime.date.today()
+    cases = [
+        ('main', {'date': str(today), 'filter_str': ' ', 'search_str': ''}),
+        ('search hit', {'date': str(today), 'filter_str': ' ',
+                        'search_str': '歯医者', 'search_n': '100'}),
+        ('search rare', {'date': str(today), 'filter_str': ' ',
+                         'search_str': '定期健診'}),
+    ]
+
+    result = {}
+    with data_tree(datadir, years, copy=True) as (workdir, _):
+        # 滅多に出てこない言葉 (遡りきる直前に見つかる)
+        pathname = os.path.join(workdir, (
+            today - datetime.timedelta(365 * 4 + 300)).strftime(
+                '%Y/%m/%d.cgi'))
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        with open(pathname, mode='a') as f:
+            f.write('\t'.join([
+                '1-1', path2date(pathname).strftime('%Y/%m/%d'),
+                ':-:', '', '定期健診', '', '']) + '\n')
+
+        for stream in (False, True):
+            args = ['--no-search-index']
+            if stream:
+                args.append('--stream')
+
+            (proc, port) = _start_server(workdir, webroot, args)
+            try:
+                for (label, params) in cases:
+                    (sec, (ttfb, total, size)) = timeit(
+                        _ttfb, port, params)
+                    result[(label, stream)] = {
+                        'ttfb': ttfb, 'total': total, 'size': size}
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    print('%-12s %-7s %10s %10s %9s' % (
+        'request', 'stream', 'ttfb', 'total', 'size'))
+    for ((label, stream), r) in result.items():
+        print('%-12s %-7s %8.1fms %8.1fms %9s' % (
+            label, stream, r['ttfb'] * 1000, r['total'] * 1000, r['size']))
+
+    return result
+
+
+def bench_days(datadir: str = None, years: int = 5,
+               webroot: str = None) -> dict:
+    """
+    無限スクロールの1回分:
+    ページ全体を読み込み直す従来の方法と、
+    ``/ytsched/days``で追加する日の断片だけを取得する方法の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+
+    Returns
+    -------
+    result: dict
+        {label: {'total': sec, 'size': bytes}}
+    """
+    today = datetime.date.today()
+    date_from = today - datetime.timedelta(MainHandler.DEF_DAYS)
+    step = 14
+
+    result = {}
+    with data_tree(datadir, years, copy=True) as (workdir, _):
+        (proc, port) = _start_server(workdir, webroot)
+        try:
+            # フィルター文字列を設定ファイルに保存する
+            _ttfb(port, {'date': str(today), 'filter_str': ' '})
+
+            cases = [
+                ('page', (port, {'date': str(date_from),
+                                 'sde_align': 'top'})),
+                ('days', (port, {
+                    'from': str(date_from - datetime.timedelta(step)),
+                    'to': str(date_from - datetime.timedelta(1)),
+                    'date': str(today)}, '/ytsched/days', 'GET')),
+            ]
+            for (label, args) in cases:
+                (_, (_, total, size)) = timeit(_ttfb, *args, repeat=5)
+                result[label] = {'total': total, 'size': size}
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print('scroll step: %s days (page: +/-%s days)' % (
+        step, MainHandler.DEF_DAYS))
+    print('%-6s %10s %9s' % ('', 'total', 'size'))
+    for (label, r) in result.items():
+        print('%-6s %8.1fms %9s' % (label, r['total'] * 1000, r['size']))
+
+    return result
+
+
+def bench_etag(datadir: str = None, years: int = 5,
+               webroot: str = None) -> dict:
+    """
+    変更されていないページの再読み込み:
+    毎回描画する場合(200)と、ETag で 304 Not Modified を返す場合の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+
+    Returns
+    -------
+    result: dict
+        {label: {'total': sec, 'size': bytes}}
+    """
+    today = datetime.date.today()
+    cases = [
+        ('main', {'date': str(today)}, '/ytsched/'),
+        ('days', {'from': str(today - datetime.timedelta(59)),
+                  'to': str(today - datetime.timedelta(46))},
+         '/ytsched/days'),
+    ]
+
+    result = {}
+    with data_tree(datadir, years, copy=True) as (workdir, _):
+        (proc, port) = _start_server(workdir, webroot)
+        try:
+            for (label, params, path) in cases:
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+                conn.request('GET', path + '?' + urllib.parse.urlencode(
+                    params))
+                resp = conn.getresponse()
+                resp.read()
+                etag = resp.getheader('Etag')
+                conn.close()
+
+                (_, (_, total, size)) = timeit(
+                    _ttfb, port, params, path, 'GET', repeat=5)
+                result[(label, 200)] = {'total': total, 'size': size}
+
+                (_, (_, total, size)) = timeit(
+                    _ttfb, port, params, path, 'GET',
+                    {'If-None-Match': etag}, repeat=5)
+                result[(label, 304)] = {'total': total, 'size': size}
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print('%-6s %6s %10s %9s' % ('', 'status', 'total', 'size'))
+    for ((label, status), r) in result.items():
+        print('%-6s %6s %8.1fms %9s' % (
+            label, status, r['total'] * 1000, r['size']))
+
+    return result
+
+
+def bench_fragcache(datadir: str = None, years: int = 5,
+                    webroot: str = None, n_edits: int = 5) -> dict:
+    """
+    ページの描画時間:
+    毎回全ての日を描画する場合(既定)と、
+    描画済みの日ごとの HTML を使う場合の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (データと設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+    n_edits: int
+        編集(追加)の回数
+
+    Returns
+    -------
+    result: dict
+        {(label, case): sec}
+        case: 'first' 最初の表示, 'view' 再表示, 'edit' 編集直後の表示
+    """
+    today = datetime.date.today()
+    params = {'date': str(today)}
+
+    result = {}
+    with data_tree(datadir, years) as (srcdir, tmpdir):
+        for (label, args) in [('off', []),
+                              ('on', ['--fragment-cache'])]:
+            workdir = os.path.join(tmpdir, label)
+            shutil.copytree(srcdir, workdir)
+
+            (proc, port) = _start_server(workdir, webroot, args)
+            try:
+                # POST は ETag(304)の対象外なので、毎回描画される
+                (_, total, _) = _ttfb(port, params)
+                result[(label, 'first')] = total
+
+                (_, (_, total, _)) = timeit(
+                    _ttfb, port, params, repeat=5)
+                result[(label, 'view')] = total
+
+                sec_list = []
+                for i in range(n_edits):
+                    _ttfb(port, {'cmd': 'add', 'sde_id': '',
+                                 'date': str(today + datetime.timedelta(i)),
+                                 'title': 'bench %s' % (i)})
+                    # バックグラウンドの再描画を待つ
+                    time.sleep(0.3)
+                    (_, total, _) = _ttfb(port, params)
+                    sec_list.append(total)
+                result[(label, 'edit')] = sum(sec_list) / len(sec_list)
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    print('%-4s %10s %10s %10s' % ('', 'first', 'view', 'edit'))
+    for label in ['off', 'on']:
+        print('%-4s %8.1fms %8.1fms %8.1fms' % (
+            label, *[result[(label, case)] * 1000
+                     for case in ['first', 'view', 'edit']]))
+
+    return result
+
+
+def bench_async(datadir: str = None, years: int = 20,
+                webroot: str = None, n_cold: int = 20) -> dict:
+    """
+    キャッシュにない期間を読み込んでいる間の、他のリクエストの応答時間:
+    IOLoop のスレッドで読み込む場合(``--io-workers 0``)と、
+    スレッドプールで読み込む場合の比較
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+    n_cold: int
+        キャッシュにない期間(62日)を読み込むリクエストの数
+
+    Returns
+    -------
+    result: dict
+        {workers: {'median': sec, 'max': sec, 'n': int, 'cold': sec,
+                   'same': sec}}
+        median, max: 読み込み中の、キャッシュ済みの期間のリクエスト
+        cold: キャッシュにない期間のリクエスト(1つ)の平均
+        same: 同じ期間を同時に8つリクエストした場合の全体の時間
+    """
+    today = datetime.date.today()
+    hot = {'from': str(today - datetime.timedelta(13)), 'to': str(today)}
+
+    def days_params(i):
+        date_to = today - datetime.timedelta(365 + i * 62)
+        return {'from': str(date_to - datetime.timedelta(61)),
+                'to': str(date_to)}
+
+    result = {}
+    with data_tree(datadir, years) as (srcdir, tmpdir):
+        for workers in [0, AsyncSchedData.DEF_WORKERS]:
+            workdir = os.path.join(tmpdir, 'w%s' % (workers))
+            shutil.copytree(srcdir, workdir)
+
+            (proc, port) = _start_server(
+                workdir, webroot, ['--preload-years', '0',
+                                   '--io-workers', str(workers)])
+            try:
+                _ttfb(port, hot, '/ytsched/days', 'GET')
+
+                with concurrent.futures.ThreadPoolExecutor(8) as executor:
+                    cold = executor.submit(lambda: [
+                        _ttfb(port, days_params(i), '/ytsched/days',
+                              'GET')[1] for i in range(n_cold)])
+
+                    sec_list = []
+                    while not cold.done():
+                        sec_list.append(
+                            _ttfb(port, hot, '/ytsched/days', 'GET')[1])
+                    cold_list = cold.result()
+
+                    # 同じ期間への同時のリクエスト (読み込みは一つにまとめる)
+                    params = days_params(n_cold)
+                    t_start = time.perf_counter()
+                    list(executor.map(
+                        lambda _: _ttfb(port, params, '/ytsched/days', 'GET'),
+                        range(8)))
+                    sec_same = time.perf_counter() - t_start
+            finally:
+                proc.terminate()
+                proc.wait()
+
+            sec_list.sort()
+            result[workers] = {
+                'median': sec_list[len(sec_list) // 2],
+                'max': sec_list[-1],
+                'n': len(sec_list),
+                'cold': sum(cold_list) / len(cold_list),
+                'same': sec_same,
+            }
+
+    print('%-8s %10s %10s %6s %10s %10s' % (
+        'workers', 'median', 'max', 'n', 'cold', 'same x8'))
+    for (workers, r) in result.items():
+        print('%-8s %8.1fms %8.1fms %6s %8.1fms %8.1fms' % (
+            workers, r['median'] * 1000, r['max'] * 1000, r['n'],
+            r['cold'] * 1000, r['same'] * 1000))
+
+    return result
+
+
+def _child_pids(pid: int) -> list:
+    try:
+        with open('/proc/%s/task/%s/children' % (pid, pid)) as f:
+            return [int(s) for s in f.read().split()]
+    except OSError:
+        return []
+
+
+def _pss(pid_list: list) -> int:
+    """
+    Returns
+    -------
+    pss: int
+        bytes. 共有しているページを、プロセス数で割った合計
+        取得できない場合は 0
+    """
+    pss = 0
+    for pid in pid_list:
+        try:
+            with open('/proc/%s/smaps_rollup' % (pid)) as f:
+                for line in f:
+                    if line.startswith('Pss:'):
+                        pss += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+
+    return pss
+
+
+def _load_client(port: int, params: dict, sec: float) -> int:
+    """
+    Returns
+    -------
+    n: int
+        ``sec``秒間に完了したリクエストの数
+    """
+    n = 0
+    t_end = time.perf_counter() + sec
+    while time.perf_counter() < t_end:
+        _ttfb(port, params)
+        n += 1
+
+    return n
+
+
+def bench_workers(datadir: str = None, years: int = 20,
+                  webroot: str = None, clients: int = 8,
+                  sec: float = 5.0) -> dict:
+    """
+    サーバーのプロセス数(``--workers``)ごとの、
+    メイン画面の1秒あたりのリクエスト数
+
+    Parameters
+    ----------
+    datadir: str
+        None: ``years``年分の合成データを一時ディレクトリに生成する
+        (設定ファイルが書き換えられるので、コピーして使う)
+    years: int
+    webroot: str
+        None: パッケージと同じ場所の``webroot``
+    clients: int
+        同時にリクエストするクライアントのプロセス数
+    sec: float
+        計測する時間(秒)
+
+    Returns
+    -------
+    result: dict
+        {workers: {'rps': float, 'pss': bytes}}
+        pss: サーバーの全プロセスの PSS の合計 (0: 取得できない)
+    """
+    params = {'date': str(datetime.date.today())}
+
+    result = {}
+    with data_tree(datadir, years) as (srcdir, tmpdir):
+        for workers in [1, 2, 4]:
+            workdir = os.path.join(tmpdir, 'w%s' % (workers))
+            shutil.copytree(srcdir, workdir)
+
+            (proc, port) = _start_server(workdir, webroot,
+                                         ['--workers', str(workers)])
+            try:
+                with multiprocessing.Pool(clients) as pool:
+                    # 全てのプロセスの描画キャッシュを温める
+                    pool.starmap(_load_client,
+                                 [(port, params, 1.0)] * clients)
+
+                    n = sum(pool.starmap(_load_client,
+                                         [(port, params, sec)] * clients))
+                pss = _pss([proc.pid] + _child_pids(proc.pid))
+            finally:
+                # 子プロセスが正常終了すると、親プロセスも終了する
+                for pid in _child_pids(proc.pid):
+                    os.kill(pid, signal.SIGTERM)
+                proc.terminate()
+                proc.wait()
+
+            result[workers] = {'rps': n / sec, 'pss': pss}
+
+    print('CPUs: %s, clients: %s' % (os.cpu_count(), clients))
+    print('%-8s %10s %8s %10s' % ('workers', 'req/sec', 'scale', 'PSS'))
+    for (workers, r) in result.items():
+        print('%-8s %10.1f %7.2fx %8.1fMB' % (
+            workers, r['rps'], r['rps'] / max(result[1]['rps'], 1e-9),
+            r['pss'] / 1024 / 1024))
+
+    return result
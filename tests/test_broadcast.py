@@ -0,0 +1,85 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+broadcast.py のテスト
+
+他のプロセスへの通知、読み出しの遅れすぎ、
+ロックを持ったまま終了したプロセスがあっても止まらないこと
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import fcntl
+import datetime
+import pytest
+from ytsched.broadcast import ChangeRing, DEF_LOCK_FILENAME
+
+DATE1 = datetime.date(2021, 3, 1)
+DATE2 = datetime.date(2021, 3, 2)
+
+
+@pytest.fixture
+def ring(tmp_path):
+    return ChangeRing(str(tmp_path / DEF_LOCK_FILENAME), 100, n_slots=8)
+
+
+def in_child(func) -> int:
+    """ fork したプロセスで``func()``を実行し、終了コードを返す """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def test_publish(ring):
+    """ 他のプロセスが変更した日のみ、読み出す """
+    assert ring.poll() == []
+
+    ring.publish(DATE1)
+    assert in_child(lambda: (ring.publish(DATE2), ring.publish(None))) == 0
+
+    assert ring.poll() == [DATE2, None]
+    assert ring.poll() == []
+
+
+def test_version(ring):
+    """ バージョン番号は、全プロセスで通し """
+    assert ring.next_version() == 101
+    assert in_child(ring.next_version) == 0
+    assert ring.next_version() == 103
+
+
+def test_overflow(ring):
+    """ ``n_slots``を超えて遅れた場合は、None """
+    def publish_many():
+        for i in range(9):
+            ring.publish(DATE1 + datetime.timedelta(i))
+
+    assert in_child(publish_many) == 0
+    assert ring.poll() is None
+    assert ring.poll() == []
+
+
+def test_dead_lock_holder(ring, tmp_path):
+    """
+    ロックを持ったまま異常終了したプロセスがあっても、
+    他のプロセスは、読み書きできる
+    """
+    def die_locked():
+        with ring._locked():
+            os._exit(1)  # ロックを持ったまま
+
+    assert in_child(die_locked) == 1
+
+    # ロックは、解放されている
+    with open(str(tmp_path / DEF_LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+    assert in_child(lambda: ring.publish(DATE1)) == 0
+    assert ring.poll() == [DATE1]
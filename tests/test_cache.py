@@ -0,0 +1,116 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+キャッシュの上限(``cache_mb``, ``cache_size``)のテスト
+
+メモリ使用量の推定値の合計が、追加・削除・読み込み直しでずれないこと、
+上限を超えたら、最近参照されていない日から一つずつ捨てること
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import pytest
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+from ytsched.webapp import WebServer
+
+DATE1 = datetime.date(2021, 3, 1)
+DATES = [DATE1 + datetime.timedelta(i) for i in range(10)]
+
+
+@pytest.fixture
+def topdir(tmp_path):
+    topdir = str(tmp_path)
+    for date in DATES:
+        sdf = SchedDataFile(date, topdir, sde_list=[])
+        for i in range(3):
+            sdf.add_sde(SchedDataEnt('%s-%d' % (date, i), date, '', '',
+                                     '', '予定%d' % (i), '渋谷', 'メモ' * 10))
+        sdf.save()
+    return topdir
+
+
+@pytest.fixture
+def day_bytes(topdir):
+    """ 1日分の推定値 (全ての日で同じ) """
+    return SchedDataFile(DATE1, topdir).nbytes
+
+
+def cached(sd):
+    """ キャッシュされている日 (最近参照されていない順) """
+    return [datetime.date.fromisoformat(k) for k in sd.get_keys()]
+
+
+def check_total(sd):
+    """ 合計は、キャッシュされている日の推定値の和 """
+    assert sd.get_cache_bytes() == sum(
+        [sd.get_sdf(date).nbytes for date in cached(sd)])
+
+
+def test_account(topdir, day_bytes):
+    """ 追加・削除・読み込み直しで、合計がずれない """
+    sd = SchedData(topdir)
+    for date in DATES[:3]:
+        sd.get_sdf(date)
+    assert sd.get_cache_bytes() == day_bytes * 3
+
+    sd.add_sde(DATE1, SchedDataEnt('new', DATE1, '', '', '', '追加' * 20,
+                                   '', ''))
+    check_total(sd)
+    assert sd.get_cache_bytes() > day_bytes * 3
+
+    sd.del_sde(DATE1, 'new')
+    check_total(sd)
+    assert sd.get_cache_bytes() == day_bytes * 3
+
+    sd.invalidate(DATES[1])
+    check_total(sd)
+    assert sd.get_cache_bytes() == day_bytes * 2
+
+
+def test_evict_by_bytes(topdir, day_bytes):
+    """ 上限を超えたら、最近参照されていない日から一つずつ捨てる """
+    sd = SchedData(topdir, cache_mb=day_bytes * 3.5 / 1024 / 1024)
+
+    for (i, date) in enumerate(DATES[:5]):
+        sd.get_sdf(date)
+        assert sd.get_cache_bytes() <= day_bytes * 3.5
+        assert cached(sd) == DATES[max(i - 2, 0):i + 1]
+
+    # 参照した日は、最後に捨てる
+    sd.get_sdf(DATES[2])
+    sd.get_sdf(DATES[5])
+    assert cached(sd) == [DATES[4], DATES[2], DATES[5]]
+    check_total(sd)
+
+
+def test_evict_by_days(topdir):
+    """ 日数の上限も有効 """
+    sd = SchedData(topdir, cache_size=4)
+
+    for date in DATES:
+        sd.get_sdf(date)
+    assert cached(sd) == DATES[-4:]
+    check_total(sd)
+
+
+def test_keep_last(topdir, day_bytes):
+    """ 1日分が上限より大きくても、最後に追加した日は残す """
+    sd = SchedData(topdir, cache_mb=day_bytes / 2 / 1024 / 1024)
+
+    for date in DATES[:3]:
+        assert sd.get_sdf(date).sde
+        assert cached(sd) == [date]
+    check_total(sd)
+
+
+def test_webapp(topdir, day_bytes):
+    """ ``--cache-mb``は、サーバーの SchedData の上限になる """
+    # workers=2: autoreload しない
+    sd = WebServer(datadir=topdir, workers=2,
+                   cache_mb=day_bytes * 2.5 / 1024 / 1024)._sd
+
+    for date in DATES:
+        sd.get_sdf(date)
+    assert cached(sd) == DATES[-2:]
@@ -0,0 +1,98 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+colstore.py のテスト
+
+1日分の置き換え(``set_day()``)の結果が、全体を作り直した結果と同じこと、
+文字列プールでの絞り込み(``literals``)が、照合の結果を変えないこと
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import random
+import pytest
+from ytsched.colstore import YearStore, sde2row
+from ytsched.ytsched import SchedDataEnt
+
+YEAR = 2020
+
+
+def mk_day(date, n, rnd):
+    sde_list = [SchedDataEnt(
+        '%s-%d' % (date.toordinal(), i), date,
+        datetime.time(rnd.randint(0, 23), 0), '',
+        rnd.choice(['', '仕事', '休日']),
+        rnd.choice(['会議', '打合せ', '(欠)歯医者', '']),
+        rnd.choice(['', '渋谷', '本社']),
+        rnd.choice(['', 'メモ<br />2行目', '持ち物']))
+                for i in range(n)]
+    is_holiday = any(sde.is_holiday() for sde in sde_list)
+    return (date, is_holiday, [sde2row(sde) for sde in sde_list])
+
+
+def mk_days(seed=0):
+    rnd = random.Random(seed)
+    jan1 = datetime.date(YEAR, 1, 1)
+    return {jan1 + datetime.timedelta(i): mk_day(
+        jan1 + datetime.timedelta(i), rnd.randint(1, 4), rnd)
+            for i in range(0, 366, 3)}
+
+
+def factory(*args):
+    return args
+
+
+def dump(store):
+    """ 全ての日の (date, is_holiday, エンティティ) """
+    return list(store.scan(datetime.date(YEAR, 1, 1),
+                           datetime.date(YEAR, 12, 31), None, factory))
+
+
+@pytest.mark.parametrize('n_rows', [0, 1, 3, 8])
+@pytest.mark.parametrize('day', [0, 1, 2, 180, 364, 365])
+def test_set_day(day, n_rows):
+    """ 1日分を置き換えた結果は、全体を作り直した結果と同じ """
+    days = mk_days()
+    store = YearStore(YEAR, days.values())
+
+    date = datetime.date(YEAR, 1, 1) + datetime.timedelta(day)
+    days[date] = mk_day(date, n_rows, random.Random(day))
+    store.set_day(*days[date])
+
+    expected = YearStore(YEAR, days.values())
+    assert dump(store) == dump(expected)
+    assert (store.n_days, store.n_rows) == (expected.n_days, expected.n_rows)
+    assert store.is_holiday(date) == days[date][1]
+
+
+def test_set_day_repeat():
+    """ 何度置き換えても、他の日は変わらない """
+    days = mk_days()
+    store = YearStore(YEAR, days.values())
+    rnd = random.Random(1)
+    for i in range(50):
+        date = datetime.date(YEAR, 1, 1) + datetime.timedelta(
+            rnd.randint(0, 365))
+        days[date] = mk_day(date, rnd.randint(0, 5), rnd)
+        store.set_day(*days[date])
+
+    assert dump(store) == dump(YearStore(YEAR, days.values()))
+
+
+@pytest.mark.parametrize('literals', [
+    ['会議'], ['渋谷', '会議'], ['2行目'], ['存在しない'], ['#仕事 +'],
+])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_scan_literals(literals, reverse):
+    """ ``literals``で照合する日を絞っても、結果は同じ """
+    store = YearStore(YEAR, mk_days().values())
+
+    def match(s, d):
+        return all(lit in s for lit in literals)
+
+    args = (datetime.date(YEAR, 2, 1), datetime.date(YEAR, 11, 30),
+            match, factory, reverse)
+    assert list(store.scan(*args, literals=literals)) == \
+        list(store.scan(*args))
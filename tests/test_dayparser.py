@@ -0,0 +1,109 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+dayparser.py のテスト
+
+正しい行は、従来の解析(``bench.legacy.legacy_load()``)と同じ結果になること、
+不正な行は、その行だけ読み飛ばして報告すること
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import datetime
+import pytest
+from ytsched import dayparser
+from ytsched.ytsched import SchedDataEnt, SchedDataFile
+from bench.legacy import legacy_load
+
+DATE = datetime.date(2021, 3, 1)
+
+LINES = [
+    '1-1\t2021/03/01\t10:00-11:30\t仕事\t会議\t本社\tメモ<br />2行目',
+    '1-2\t2021/03/01\t:-:\t\t時刻なし\t\t',
+    '1-3\t2021/03/01\t:-:\t祝日\t建国記念の日\t\t',
+    '1-4\t2021/03/01\t:-:\t\t(欠)歯医者\t\t',
+    '1-5\t2021/03/01\t9:05-:\t\t開始のみ\t渋谷\t',
+    '1-6\t2021/03/01\t:-18:00\t\t終了のみ\t\t',
+    '1-7\t2021/03/01\t25:70-24:00\t\t範囲外\t\t',
+    '1-8\t2021/03/01\t08:00-09:00\t\t\t\t',
+    '1-9\t2021/03/01\t12:00-13:00\t\tA&amp;B &lt;x&gt;\t\t&nbsp;',
+]
+""" 正しい行 (従来の解析でも例外にならない) """
+
+EXTRA_TABS = '1-10\t2021/03/01\t07:00-:\t\t余分なタブ\t\t詳細\t余分\t\t'
+
+
+def write_day(topdir, lines, newline='\n'):
+    pathname = SchedDataFile(DATE, topdir, sde_list=[]).pathname
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    with open(pathname, mode='w', encoding='utf-8', newline='') as f:
+        f.write(''.join(line + newline for line in lines))
+    return pathname
+
+
+def fields(sde_list):
+    return [(sde.sde_id, sde.date, sde.time_start, sde.time_end,
+             sde.type, sde.title, sde.place, sde.detail)
+            for sde in sde_list]
+
+
+def load(topdir, lazy):
+    return fields(SchedDataFile(DATE, topdir, lazy=lazy).sde)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+@pytest.mark.parametrize('extra', [[], [EXTRA_TABS]])
+def test_legacy(tmp_path, lazy, newline, extra):
+    """ 時刻なし、余分なタブ、CRLF でも、従来の解析と同じ """
+    pathname = write_day(str(tmp_path), LINES + extra, newline)
+
+    assert load(str(tmp_path), lazy) == fields(legacy_load(pathname))
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('bad', [
+    '2-1\t2021/03/01\t\t\t時刻が空\t\t',
+    '2-2\t2021/03/01\t10:00\t\t終了がない\t\t',
+    '2-3\t2021/03/01\tab:cd-:\t\t数字でない\t\t',
+    '2-4\t2021/03/01\t10:00-11:00x\t\t余分な文字\t\t',
+    '2-5\t2021/03/01\t10:00-11:00\tフィールドが足りない',
+])
+def test_bad_line(tmp_path, lazy, bad):
+    """ 不正な行だけ読み飛ばし、他の行は従来の解析と同じ """
+    good = write_day(str(tmp_path / 'good'), LINES)
+    write_day(str(tmp_path / 'bad'), LINES[:3] + [bad] + LINES[3:])
+
+    assert load(str(tmp_path / 'bad'), lazy) == fields(legacy_load(good))
+
+
+def test_errors():
+    """ 不正な行は、行番号と理由を返す (空行は無視する) """
+    lines = [LINES[0] + '\n', '\n', 'x\ty\n',
+             '3-1\t2021/03/01\t1-2\t\t\t\t\n', LINES[1] + '\n']
+
+    (sde_list, errors) = dayparser.parse(lines, DATE, SchedDataEnt)
+
+    assert [sde.sde_id for sde in sde_list] == ['1-1', '1-2']
+    assert [(lineno, reason) for (lineno, reason, _) in errors] == [
+        (3, 'too few fields'), (4, "invalid time: '1-2'")]
+
+
+@pytest.mark.parametrize('time_str,expected', [
+    (':-:', (dayparser.MIN_NULL, dayparser.MIN_NULL)),
+    ('00:00-23:59', (0, 23 * 60 + 59)),
+    ('9:5-:', (9 * 60 + 5, dayparser.MIN_NULL)),
+    (':-18:00', (dayparser.MIN_NULL, 18 * 60)),
+    ('24:60-25:61', (0, 60 + 1)),
+])
+def test_parse_time(time_str, expected):
+    assert dayparser.parse_time(time_str) == expected
+
+
+@pytest.mark.parametrize('time_str', ['', '10:00', '10:00-', 'a:b-:',
+                                      '10-11', ' 10:00-11:00'])
+def test_parse_time_invalid(time_str):
+    with pytest.raises(ValueError):
+        dayparser.parse_time(time_str)
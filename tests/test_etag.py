@@ -0,0 +1,98 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+ETag/304 のテスト
+
+表示する範囲の日と ToDo が変更されていなければ 304、
+変更されたら(他の範囲の変更では 304 のまま)、描画し直すこと
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import datetime
+import tempfile
+import urllib.parse
+import tornado.testing
+from ytsched.webapp import WebServer
+from ytsched.ytsched import SchedDataEnt
+
+WEBROOT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'webroot')
+
+DATE = datetime.date(2021, 3, 1)
+FAR = datetime.date(2000, 1, 1)
+
+
+class TestEtag(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        # workers=2: autoreload しない (テスト中にプロセスを置き換えない)
+        self.server = WebServer(webroot=WEBROOT, datadir=tmpdir.name,
+                                workers=2)
+        self.sd = self.server._sd
+        self.add(DATE, '会議')
+        return self.server._app
+
+    def add(self, date, title):
+        self.sd.add_sde(date, SchedDataEnt(
+            '%s-%s' % (date, title), date or DATE, '', '', '', title, '', ''))
+
+    def fetch_page(self, path, etag=None, **params):
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        return self.fetch('%s?%s' % (path, urllib.parse.urlencode(params)),
+                          headers=headers)
+
+    def check(self, path, **params):
+        """ 変更がなければ 304、範囲内の日・ToDo が変更されたら 200 """
+        res = self.fetch_page(path, **params)
+        self.assertEqual(res.code, 200)
+        self.assertIn('会議', res.body.decode())
+        etag = res.headers['Etag']
+
+        res = self.fetch_page(path, etag, **params)
+        self.assertEqual(res.code, 304)
+        self.assertEqual(res.body, b'')
+
+        # 範囲外の日の変更
+        self.add(FAR, '範囲外')
+        self.assertEqual(self.fetch_page(path, etag, **params).code, 304)
+
+        for date in (DATE + datetime.timedelta(1), None):
+            self.add(date, '追加 %s' % (date))
+            res = self.fetch_page(path, etag, **params)
+            self.assertEqual(res.code, 200)
+            self.assertIn('追加 %s' % (date), res.body.decode())
+            self.assertNotEqual(res.headers['Etag'], etag)
+            etag = res.headers['Etag']
+
+            self.assertEqual(self.fetch_page(path, etag, **params).code, 304)
+
+        return etag
+
+    def test_main(self):
+        etag = self.check('/ytsched/', date=str(DATE))
+
+        # 表示の条件が違えば、別の ETag
+        res = self.fetch_page('/ytsched/', etag, date=str(DATE), todo_days=1)
+        self.assertEqual(res.code, 200)
+
+    def test_days(self):
+        self.check('/ytsched/days', date=str(DATE),
+                   **{'from': str(DATE - datetime.timedelta(3)),
+                      'to': str(DATE + datetime.timedelta(3))})
+
+    def test_post(self):
+        """ POST は、304 にしない """
+        res = self.fetch('/ytsched/', method='POST',
+                         body=urllib.parse.urlencode({'date': str(DATE)}))
+        self.assertEqual(res.code, 200)
+
+        res = self.fetch('/ytsched/', method='POST',
+                         headers={'If-None-Match': res.headers['Etag']},
+                         body=urllib.parse.urlencode({'date': str(DATE)}))
+        self.assertEqual(res.code, 200)
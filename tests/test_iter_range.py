@@ -0,0 +1,162 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+SchedData.iter_range() のテスト
+
+順方向・逆方向とも、1日ずつ読み込んだ結果と同じ日・エンティティを
+同じ順に生成すること、``limit``で止めた場合は先の月を読み込まないこと
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import random
+import datetime
+import pytest
+from ytsched import packfile
+from ytsched.query import Query
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+
+DATE_FROM = datetime.date(2019, 11, 15)
+DATE_TO = datetime.date(2021, 2, 10)
+
+
+def mk_days(seed=0):
+    """ 月の境界、うるう日、ファイルのない月を含む日 """
+    rnd = random.Random(seed)
+    days = {datetime.date(2019, 11, 30), datetime.date(2019, 12, 1),
+            datetime.date(2020, 2, 29), datetime.date(2020, 3, 1),
+            datetime.date(2020, 12, 31), datetime.date(2021, 1, 1)}
+    date = DATE_FROM - datetime.timedelta(20)
+    while date <= DATE_TO + datetime.timedelta(20):
+        if date.month not in (5, 6) and rnd.random() < 0.2:
+            days.add(date)
+        date += datetime.timedelta(1)
+
+    return {date: [(
+        '%s-%d' % (date, i),
+        rnd.choice(['', '仕事', '祝日']),
+        rnd.choice(['会議', '打合せ', '(欠)歯医者']))
+                   for i in range(rnd.randint(1, 3))]
+            for date in sorted(days)}
+
+
+DAYS = mk_days()
+
+
+@pytest.fixture(scope='module')
+def topdir(tmp_path_factory):
+    topdir = str(tmp_path_factory.mktemp('data'))
+    for (date, ents) in DAYS.items():
+        sdf = SchedDataFile(date, topdir, sde_list=[])
+        for (sde_id, sde_type, title) in ents:
+            sdf.add_sde(SchedDataEnt(sde_id, date, '', '',
+                                     sde_type, title, '', ''))
+        sdf.save()
+
+    # 2019年は、パックファイルから読み込む
+    packfile.pack(topdir, 2019)
+    return topdir
+
+
+def day_by_day(topdir, date_from, date_to, reverse=False, query=None,
+               limit=None, dates=None):
+    """ 1日ずつ読み込む (``iter_range()``の期待値) """
+    date_list = [d for d in DAYS if date_from <= d <= date_to]
+    if dates is not None:
+        date_list = [d for d in date_list if d in dates]
+    if reverse:
+        date_list.reverse()
+
+    out = []
+    count = 0
+    for date in date_list:
+        sdf = SchedDataFile(date, topdir)
+        sde_list = [sde.sde_id for sde in sdf.sde
+                    if query is None or query.match_sde(sde)]
+        out.append((date, sdf.is_holiday, sde_list))
+
+        count += len(sde_list)
+        if limit is not None and count >= limit:
+            break
+
+    return out
+
+
+def iter_range(sd, *args, **kwargs):
+    return [(date, is_holiday, [sde.sde_id for sde in sde_list])
+            for (date, is_holiday, sde_list)
+            in sd.iter_range(*args, **kwargs)]
+
+
+def matched(days):
+    """ 条件に合うエンティティがある日のみ """
+    return [d for d in days if d[2]]
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('date_from,date_to', [
+    (DATE_FROM, DATE_TO),
+    (datetime.date(2020, 2, 29), datetime.date(2020, 3, 1)),
+    (datetime.date(2020, 5, 1), datetime.date(2020, 6, 30)),
+    (datetime.date(2020, 12, 31), datetime.date(2020, 12, 31)),
+])
+def test_all(topdir, columnar, reverse, date_from, date_to):
+    """ 全てのエンティティ: 1日ずつ読み込んだ結果と同じ """
+    sd = SchedData(topdir, columnar=columnar)
+
+    assert iter_range(sd, date_from, date_to, reverse) == day_by_day(
+        topdir, date_from, date_to, reverse)
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('query_str', ['会議', '?#祝日 AND NOT 打合せ'])
+def test_query(topdir, columnar, reverse, query_str):
+    """ 条件に合うエンティティ: 1日ずつ照合した結果と同じ """
+    sd = SchedData(topdir, columnar=columnar)
+    query = Query(query_str)
+
+    assert matched(iter_range(sd, DATE_FROM, DATE_TO, reverse,
+                              query=query)) == matched(
+        day_by_day(topdir, DATE_FROM, DATE_TO, reverse, query=query))
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('limit', [1, 5, 10000])
+def test_limit(topdir, columnar, reverse, limit):
+    """ 合計``limit``個以上生成したら止める """
+    sd = SchedData(topdir, columnar=columnar)
+
+    assert iter_range(sd, DATE_FROM, DATE_TO, reverse,
+                      limit=limit) == day_by_day(
+        topdir, DATE_FROM, DATE_TO, reverse, limit=limit)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_limit_lazy_load(topdir, reverse):
+    """ 止めた場合、先の月は読み込まない """
+    sd = SchedData(topdir)
+
+    out = iter_range(sd, DATE_FROM, DATE_TO, reverse, limit=1)
+    (last_date, _, _) = out[-1]
+
+    loaded = [date for date in DAYS if sd.is_cached(date)]
+    assert loaded
+    for date in loaded:
+        assert (date.year, date.month) == (last_date.year, last_date.month)
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('reverse', [False, True])
+def test_dates(topdir, columnar, reverse):
+    """ 候補の日(``dates``)のみ (ファイルのない日・期間外は除く) """
+    sd = SchedData(topdir, columnar=columnar)
+    dates = list(DAYS)[::3] + [datetime.date(2020, 5, 5),
+                               DATE_TO + datetime.timedelta(1)]
+
+    assert iter_range(sd, DATE_FROM, DATE_TO, reverse,
+                      dates=dates) == day_by_day(
+        topdir, DATE_FROM, DATE_TO, reverse, dates=set(dates))
@@ -0,0 +1,172 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+journal.py のテスト
+
+再生(開き直した時の読み込み)、途中で切れた最後の行、
+同じレコードの再適用、圧縮(``truncate()``)と他のプロセスの追記
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import pytest
+from ytsched.journal import Journal
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+
+DATE1 = datetime.date(2021, 3, 1)
+DATE2 = datetime.date(2021, 3, 2)
+
+
+def mk_line(sde_id, date=DATE1, title='会議'):
+    return SchedDataEnt(sde_id, date, title=title).mk_dataline()
+
+
+def mk_sdf(topdir, date=DATE1):
+    return SchedDataFile(date, str(topdir), sde_list=[])
+
+
+def titles(sdf):
+    return [(sde.sde_id, sde.title) for sde in sdf.sde]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / '.ytsched.journal')
+
+
+def test_replay(path):
+    """ 開き直すと、追記したレコードを順番どおりに読み込む """
+    j = Journal(path)
+    assert j.append([(DATE1, 'a', mk_line('a'))]) == 1
+    assert j.append([(DATE1, 'a', None), (None, 'b', mk_line('b'))]) == 2
+    assert j.append([(DATE2, 'c', mk_line('c', DATE2))]) == 3
+
+    j2 = Journal(path)
+    assert sorted(j2.dates(), key=str) == sorted([DATE1, DATE2, None],
+                                                 key=str)
+    assert [(seq, sde_id, line is None)
+            for (seq, sde_id, line) in j2.pending(DATE1)] == [
+                (1, 'a', False), (2, 'a', True)]
+    assert [seq for (seq, _, _) in j2.pending(None)] == [2]
+
+    # 番号は続きから
+    assert j2.append([(DATE1, 'd', mk_line('d'))]) == 4
+
+
+def test_replay_apply(path, tmp_path):
+    """ 再生した結果が、変更した順に適用した結果と同じ """
+    j = Journal(path)
+    j.append([(DATE1, 'a', mk_line('a', title='x'))])
+    j.append([(DATE1, 'b', mk_line('b', title='y'))])
+    j.append([(DATE1, 'a', mk_line('a', title='x2'))])  # 修正
+    j.append([(DATE1, 'b', None)])  # 削除
+
+    sdf = mk_sdf(tmp_path)
+    Journal.apply(sdf, Journal(path).pending(DATE1))
+    assert titles(sdf) == [('a', 'x2')]
+
+
+def test_apply_idempotent(path, tmp_path):
+    """ 反映済みのデータに、もう一度適用しても変わらない """
+    j = Journal(path)
+    j.append([(DATE1, 'a', mk_line('a', title='x'))])
+    j.append([(DATE1, 'b', mk_line('b', title='y'))])
+    j.append([(DATE1, 'b', None)])
+    ops = j.pending(DATE1)
+
+    sdf = mk_sdf(tmp_path)
+    Journal.apply(sdf, ops)
+    once = titles(sdf)
+    Journal.apply(sdf, ops)
+    assert titles(sdf) == once == [('a', 'x')]
+
+
+def test_torn_last_line(path):
+    """ 書き込み途中で切れた最後の行は、開く時に捨てる """
+    j = Journal(path)
+    j.append([(DATE1, 'a', mk_line('a'))])
+    with open(path, 'ab') as f:
+        f.write(b'{"seq": 2, "ops": [["2021-03-01", "b", "b\\t20')
+
+    j2 = Journal(path)
+    assert [seq for (seq, _, _) in j2.pending(DATE1)] == [1]
+    with open(path, 'rb') as f:
+        assert f.read().endswith(b'\n')
+
+    # 捨てた番号から、追記し直せる
+    assert j2.append([(DATE1, 'b', mk_line('b'))]) == 2
+    assert [seq for (seq, _, _) in Journal(path).pending(DATE1)] == [1, 2]
+
+
+def test_truncate(path):
+    """ 反映したレコードを捨てても、番号は引き継ぐ """
+    j = Journal(path)
+    j.append([(DATE1, 'a', mk_line('a'))])
+    j.append([(DATE2, 'b', mk_line('b', DATE2))])
+
+    (seq, days) = j.plan()
+    assert seq == 2
+    assert set(days) == {DATE1, DATE2}
+
+    assert j.truncate(seq) == 0
+    assert j.dates() == []
+    assert Journal(path).dates() == []
+    assert j.append([(DATE1, 'c', mk_line('c'))]) == 3
+
+
+def test_truncate_racing_append(path):
+    """
+    ``plan()``から``truncate()``までの間に、他のプロセスが追記した
+    レコードは残り、両方のプロセスで読み込み直される
+    """
+    j1 = Journal(path)
+    j2 = Journal(path)  # 他のプロセス
+    j1.append([(DATE1, 'a', mk_line('a'))])
+
+    (seq, _) = j1.plan()
+    assert j2.append([(DATE2, 'b', mk_line('b', DATE2))]) == seq + 1
+
+    assert j1.truncate(seq) == 1
+    for j in (j1, j2, Journal(path)):
+        j.refresh()
+        assert j.dates() == [DATE2]
+        assert [s for (s, _, _) in j.pending(DATE2)] == [seq + 1]
+
+    assert j1.append([(DATE1, 'c', mk_line('c'))]) == seq + 2
+    assert j2.refresh() == [DATE1]
+
+
+def test_sched_data_replay(tmp_path):
+    """
+    ジャーナルの変更は、データファイルに反映する前でも、
+    起動し直した``SchedData``から見え、反映後も重複しない
+    """
+    topdir = str(tmp_path)
+    path = str(tmp_path / '.ytsched.journal')
+
+    sd = SchedData(topdir)
+    sd.open_journal(path)
+    sdf = sd.begin_edit(DATE1)
+    sde = SchedDataEnt('a', DATE1, title='会議')
+    sdf.add_sde(sde)
+    sd.save_edit([sdf], [(DATE1, 'a', sde)])
+    sd.end_edit(sdf)
+
+    # 再起動 (データファイルは、まだ空)
+    sd2 = SchedData(topdir)
+    assert sd2.open_journal(path) == 1
+    assert titles(sd2.get_sdf(DATE1)) == [('a', '会議')]
+
+    assert sd2.compact_journal() == 1
+    assert titles(SchedDataFile(DATE1, topdir)) == [('a', '会議')]
+
+    # 反映済みのファイルに、古いジャーナルを適用し直しても同じ
+    sdf = SchedDataFile(DATE1, topdir)
+    Journal.apply(sdf, [(1, 'a', sde.mk_dataline())])
+    assert titles(sdf) == [('a', '会議')]
+
+    sd3 = SchedData(topdir)
+    assert sd3.open_journal(path) == 0
+    assert titles(sd3.get_sdf(DATE1)) == [('a', '会議')]
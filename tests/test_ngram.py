@@ -0,0 +1,69 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+ngram.py のテスト
+
+候補の日の絞り込みと、保存用の状態(``to_state()``)からの復元
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import json
+import datetime
+import pytest
+from ytsched.ngram import NgramIndex, required_literals
+
+DATE1 = datetime.date(2021, 3, 1)
+DATE2 = datetime.date(2021, 3, 2)
+DATE3 = datetime.date(2020, 1, 1)
+
+
+def mk_index():
+    index = NgramIndex()
+    index.add(DATE1, ['#仕事 +会議 @渋谷 detail:'], ('cgi', 1, 10))
+    index.add(DATE2, ['# +打合せ @本社 detail:memo'], ('cgi', 2, 20))
+    index.add(DATE3, ['# +会議 @本社 detail:'], ('pack', 3, 30))
+    return index
+
+
+@pytest.mark.parametrize('pattern,dates', [
+    ('会議', {DATE1, DATE3}),
+    ('本社', {DATE2, DATE3}),
+    ('会議.*本社', {DATE3}),
+    ('memo', {DATE2}),
+    ('存在しない', set()),
+    ('会議|打合せ', None),
+])
+def test_query(pattern, dates):
+    assert mk_index().query(pattern) == dates
+
+
+def test_required_literals():
+    assert required_literals('重要.*打合せ') == ['重要', '打合せ']
+    assert required_literals('a|b') is None
+    assert required_literals('(') is None
+
+
+def test_state():
+    """ JSON にした状態から、同じインデックスを復元する """
+    index = mk_index()
+    state = json.loads(json.dumps(index.to_state()))
+    index2 = NgramIndex.from_state(state)
+
+    assert index2.keys == index.keys
+    assert index2.n_updates == index.n_updates
+    assert str(index2) == str(index)
+    for pattern in ('会議', '本社', 'memo', '#仕事'):
+        assert index2.query(pattern) == index.query(pattern)
+
+
+@pytest.mark.parametrize('state', [
+    None, {}, {'postings': [], 'keys': [], 'n_updates': 0},
+    {'postings': {'a': '!!'}, 'keys': [], 'n_updates': 0},
+    {'postings': {}, 'keys': [[1, 'cgi']], 'n_updates': 0},
+    {'postings': {}, 'keys': [], 'n_updates': 'x'},
+])
+def test_invalid_state(state):
+    with pytest.raises(ValueError):
+        NgramIndex.from_state(state)
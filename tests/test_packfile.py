@@ -0,0 +1,136 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+packfile.py のテスト
+
+パックしたデータが元の``.cgi``ファイルと同じバイト列であること、
+``unpack()``で元に戻ること、``.cgi``ファイルが優先されること
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import datetime
+import pytest
+from ytsched import packfile
+from ytsched.ytsched import SchedDataFile
+
+YEAR = 2020
+
+DAYS = {
+    datetime.date(YEAR, 1, 1):
+    '1-1\t2020/01/01\t:-:\t祝日\t元日\t\t\n'.encode('utf-8'),
+    datetime.date(YEAR, 2, 29):
+    '1-2\t2020/02/29\t10:00-11:00\t仕事\t会議\t本社\tメモ\n'.encode('utf-8'),
+    datetime.date(YEAR, 7, 7):
+    '1-3\t2020/07/07\t:-:\t\t七夕\t\t\r\n'.encode('euc_jp'),
+    datetime.date(YEAR, 12, 31):
+    '1-4\t2020/12/31\t23:00-:\t\t大晦日\t\t\n'.encode('utf-8'),
+}
+""" うるう日、大晦日(366日目)、EUC-JP、CRLF を含む """
+
+
+def write_cgi(topdir, date, data):
+    pathname = packfile.cgi_path(topdir, date)
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    with open(pathname, 'wb') as f:
+        f.write(data)
+
+
+def read_cgi(topdir, date):
+    with open(packfile.cgi_path(topdir, date), 'rb') as f:
+        return f.read()
+
+
+def fields(topdir, date):
+    return [(sde.sde_id, sde.time_start, sde.type, sde.title, sde.detail)
+            for sde in SchedDataFile(date, topdir).sde]
+
+
+@pytest.fixture
+def topdir(tmp_path):
+    topdir = str(tmp_path)
+    for (date, data) in DAYS.items():
+        write_cgi(topdir, date, data)
+    return topdir
+
+
+def test_read_day(topdir):
+    """ パックした各日のデータは、元の``.cgi``ファイルと同じバイト列 """
+    expected = {date: fields(topdir, date) for date in DAYS}
+    assert all(expected.values())
+
+    assert packfile.pack(topdir, YEAR) == len(DAYS)
+    assert not os.path.exists(os.path.join(topdir, '%04d' % YEAR))
+    assert packfile.list_years(topdir) == [YEAR]
+
+    for (date, data) in DAYS.items():
+        assert packfile.read_day(topdir, date) == data
+        assert fields(topdir, date) == expected[date]
+
+    assert packfile.read_day(topdir, datetime.date(YEAR, 1, 2)) is None
+    assert packfile.read_day(topdir, datetime.date(YEAR + 1, 1, 1)) is None
+
+    pack = packfile.open_pack(topdir, YEAR)
+    assert pack.dates() == sorted(DAYS)
+    assert pack.month_bitmap(2) == 1 << 29
+
+
+def test_round_trip(topdir):
+    """ ``unpack()``で、元の``.cgi``ファイルに戻る """
+    packfile.pack(topdir, YEAR)
+
+    assert packfile.unpack(topdir, YEAR) == len(DAYS)
+    assert packfile.list_years(topdir) == []
+    for (date, data) in DAYS.items():
+        assert read_cgi(topdir, date) == data
+
+    with pytest.raises(FileNotFoundError):
+        packfile.unpack(topdir, YEAR)
+
+
+def test_cgi_first(topdir):
+    """ パックした後に保存された``.cgi``ファイルが優先される """
+    packfile.pack(topdir, YEAR)
+
+    date = datetime.date(YEAR, 2, 29)
+    new_data = '2-1\t2020/02/29\t:-:\t\t変更\t\t\n'.encode('utf-8')
+    write_cgi(topdir, date, new_data)
+    assert [f[3] for f in fields(topdir, date)] == ['変更']
+
+    # unpack: .cgi ファイルは上書きしない
+    assert packfile.unpack(topdir, YEAR) == len(DAYS) - 1
+    assert read_cgi(topdir, date) == new_data
+
+
+def test_repack(topdir):
+    """ 再度パックすると、``.cgi``ファイルを優先して統合する """
+    packfile.pack(topdir, YEAR)
+
+    changed = datetime.date(YEAR, 1, 1)
+    added = datetime.date(YEAR, 5, 5)
+    write_cgi(topdir, changed, b'changed\n')
+    write_cgi(topdir, added, b'added\n')
+
+    assert packfile.pack(topdir, YEAR) == len(DAYS) + 1
+    assert packfile.read_day(topdir, changed) == b'changed\n'
+    assert packfile.read_day(topdir, added) == b'added\n'
+    assert packfile.read_day(topdir, datetime.date(YEAR, 12, 31)) == DAYS[
+        datetime.date(YEAR, 12, 31)]
+
+
+def test_this_year(tmp_path):
+    """ 今年以降は、パックできない """
+    with pytest.raises(ValueError):
+        packfile.pack(str(tmp_path), datetime.date.today().year)
+
+
+@pytest.mark.parametrize('data', [b'', b'YTSPACK1', b'XXXXXXXX' + bytes(4096)])
+def test_invalid(tmp_path, data):
+    """ 不正なパックファイルは、ValueError """
+    with open(packfile.pack_path(str(tmp_path), YEAR), 'wb') as f:
+        f.write(data)
+
+    with pytest.raises(ValueError):
+        packfile.open_pack(str(tmp_path), YEAR)
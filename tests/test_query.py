@@ -0,0 +1,302 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+query.py のテスト
+
+従来の文字列(正規表現)は、従来の``re.search()``による照合と同じ結果になり、
+``?``で始まるクエリーの構文(``AND``, ``OR``, ``NOT``, ``( )``, ``"``,
+フィールド, ``before:``, ``after:``)は、記述どおりに照合する。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+import datetime
+import itertools
+import pytest
+from ytsched.query import Query, QueryError, is_structured, tokenize
+from ytsched.ytsched import SchedDataEnt
+
+DATE = datetime.date(2021, 3, 1)
+
+ENTS = [
+    SchedDataEnt('1', DATE, sde_type='仕事', title='会議', place='渋谷',
+                 detail='memo\nline2'),
+    SchedDataEnt('2', DATE, sde_type='', title='!重要会議', place='本社'),
+    SchedDataEnt('3', DATE, sde_type='', title='(キャンセル)打合せ',
+                 place='新宿'),
+    SchedDataEnt('4', DATE, sde_type='', title='(欠)歯医者', place='home'),
+    SchedDataEnt('5', DATE, sde_type='□', title='lunch & talk',
+                 place='Cafe A', detail='a.b'),
+    SchedDataEnt('6', DATE, sde_type='休日', title='Meet <Bob>',
+                 place='', detail='持ち物: 資料 PC'),
+    SchedDataEnt('7', DATE, sde_type='', title='x old', place='渋谷'),
+    SchedDataEnt('8', DATE, sde_type='', title='say hi', place=''),
+]
+SEARCH_STRS = [sde.search_str() for sde in ENTS]
+
+
+def legacy_match(filter_str: str, search_str: str, s: str) -> bool:
+    """
+    従来の``MainHandler``の照合 (不正な正規表現は、一致しない)
+    """
+    filter_str = filter_str.lower()
+    search_str = search_str.lower()
+    try:
+        if filter_str.startswith('!'):
+            if re.search(filter_str[1:], s):
+                return False
+        else:
+            if not re.search(filter_str, s):
+                return False
+    except re.error:
+        return False
+
+    if search_str:
+        try:
+            if not re.search(search_str, s):
+                return False
+        except re.error:
+            return False
+
+    return True
+
+
+def query_match(filter_str: str, search_str: str, s: str,
+                date: datetime.date = DATE) -> bool:
+    match = Query(filter_str, search_str).match
+    return match is None or match(s, date)
+
+
+def query_match_sde(filter_str: str, search_str: str,
+                    sde: SchedDataEnt) -> bool:
+    return Query(filter_str, search_str).match_sde(sde)
+
+
+LEGACY = [
+    '', ' ', 'x', 'X', '会議', '!会議', '!', '!x', 'bob', '!Bob',
+    '会議|打合せ', '!会議|打合せ', 'lunch.*talk', '^#仕事', '!^#仕事',
+    '#仕事', '+会議', '@渋谷', 'detail:memo', 'a.b', 'a b', '(欠)',
+    r'\(欠\)', '(キャンセル', '!(キャンセル', '!(', '[', '!*', '*',
+    r'!\(', '渋谷$', '&', 'and', 'or', 'not',
+    # ``?``がないので、クエリーとして解析しない
+    'say "hi"', '"lunch & talk"', '会議 OR 打合せ', '会議 AND x', 'NOT 会議',
+    '( 会議 )', 'after:2020', 'BEFORE:2021-04', '!会議 OR x', '"',
+]
+
+
+@pytest.mark.parametrize('filter_str', LEGACY)
+def test_legacy_filter(filter_str):
+    """ 従来のフィルター文字列は、従来と同じものに一致する """
+    assert not is_structured(filter_str)
+    assert [query_match(filter_str, '', s) for s in SEARCH_STRS] == \
+        [legacy_match(filter_str, '', s) for s in SEARCH_STRS]
+    assert [query_match_sde(filter_str, '', sde) for sde in ENTS] == \
+        [legacy_match(filter_str, '', s) for s in SEARCH_STRS]
+
+
+@pytest.mark.parametrize('search_str', LEGACY)
+def test_legacy_search(search_str):
+    """ 従来の検索文字列は、従来と同じものに一致する (``!``は否定ではない) """
+    assert [query_match('', search_str, s) for s in SEARCH_STRS] == \
+        [legacy_match('', search_str, s) for s in SEARCH_STRS]
+    assert [query_match_sde('', search_str, sde) for sde in ENTS] == \
+        [legacy_match('', search_str, s) for s in SEARCH_STRS]
+
+
+def corpus() -> list:
+    """ タイプ・タイトル・場所・詳細の組み合わせ """
+    types = ['', '仕事', '□', '休日']
+    titles = ['会議', '!重要な打合せ', '(キャンセル)打合せ', '★誕生日',
+              'lunch & talk', 'x 旧予定', '(欠)歯医者', 'say hi',
+              'say "hi"', 'NOT 会議', 'after:2020', '']
+    places = ['', '本社', '渋谷', 'Cafe A', '( 会議 )']
+    details = ['', 'メモ\n2行目', '持ち物: 資料 PC', '<URL>\nhttp://x.com/']
+    return [SchedDataEnt(str(i), DATE, sde_type=t, title=ti, place=p,
+                         detail=d)
+            for (i, (t, ti, p, d)) in enumerate(
+                itertools.product(types, titles, places, details))]
+
+
+def test_legacy_corpus():
+    """
+    従来の文字列は、フィルター・検索文字列のどちらでも、
+    従来の``re.search()``のループと同じものに一致する
+    """
+    ents = corpus()
+    for query_str in LEGACY:
+        for args in ((query_str, ''), ('', query_str)):
+            baseline = [sde.sde_id for sde in ents
+                        if legacy_match(*args, sde.search_str())]
+            query = Query(*args)
+            assert [sde.sde_id for sde in ents
+                    if query.match_sde(sde)] == baseline, args
+            assert [sde.sde_id for sde in ents
+                    if query.match is None or
+                    query.match(sde.search_str(), sde.date)] == baseline, args
+
+
+@pytest.mark.parametrize('filter_str,search_str', [
+    ('!会議', '渋谷'), ('渋谷', 'x'), ('!(', 'x'), ('x', '('),
+    ('!^#仕事', '会議|打合せ'),
+])
+def test_legacy_filter_and_search(filter_str, search_str):
+    assert [query_match(filter_str, search_str, s) for s in SEARCH_STRS] == \
+        [legacy_match(filter_str, search_str, s) for s in SEARCH_STRS]
+
+
+@pytest.mark.parametrize('query_str,expected', [
+    ('?会議 OR 打合せ', True),
+    ('?会議', True),
+    ('?', True),
+    ('会議 OR 打合せ', False),
+    ('NOT 会議', False),
+    ('"lunch & talk"', False),
+    ('after:2020', False),
+    ('!?会議', False),
+    (' ?会議', False),
+])
+def test_is_structured(query_str, expected):
+    assert is_structured(query_str) == expected
+
+
+def test_tokenize():
+    assert tokenize('(a OR (b)) "c d" (欠)') == [
+        ('(', False), ('a', False), ('OR', False), ('(b)', False),
+        (')', False), ('c d', True), ('(欠)', False)]
+
+    with pytest.raises(QueryError):
+        tokenize('"a')
+
+
+def matched(query_str: str, as_filter: bool = False) -> list:
+    """
+    一致したエンティティの``sde_id``
+    (検索用文字列とエンティティで、同じものに一致する)
+    """
+    args = (query_str, '') if as_filter else ('', query_str)
+    sde_ids = [sde.sde_id for (sde, s) in zip(ENTS, SEARCH_STRS)
+               if query_match(*args, s)]
+    assert [sde.sde_id for sde in ENTS
+            if query_match_sde(*args, sde)] == sde_ids
+    return sde_ids
+
+
+@pytest.mark.parametrize('query_str,sde_ids', [
+    ('会議 OR 打合せ', ['1', '2', '3']),
+    ('会議 AND 渋谷', ['1']),
+    ('"会議" 渋谷', ['1']),
+    ('NOT 会議 AND NOT 打合せ', ['4', '5', '6', '7', '8']),
+    ('#仕事 AND NOT (新宿 OR 本社)', ['1']),
+    ('NOT (渋谷 OR 新宿) 会議', ['2']),
+    ('会議 OR 打合せ AND 新宿', ['1', '2', '3']),
+    ('( 会議 OR 打合せ ) AND 新宿', ['3']),
+    # フィールド
+    ('+会議 OR +x', ['1', '2', '7']),
+    ('@渋谷 OR @home', ['1', '4', '7']),
+    ('#□ OR #休日', ['5', '6']),
+    ('detail:memo OR detail:資料', ['1', '6']),
+    ('+渋谷 OR #会議', []),
+    # "..." は正規表現ではない
+    ('"a.b"', ['5']),
+    ('"a.b" OR "(欠)"', ['4', '5']),
+    ('"lunch & talk"', ['5']),
+    ('"." OR x', ['5', '7']),
+    # 大文字・小文字を区別しない
+    ('BOB OR MEET', ['6']),
+    ('"hi"', ['8']),
+])
+def test_query(query_str, sde_ids):
+    assert matched('?' + query_str) == sde_ids
+
+
+def test_query_filter_not():
+    """ クエリーの``NOT``は、フィルターでも否定 (``!``は従来の文字列のみ) """
+    assert matched('?NOT 渋谷 AND NOT 会議', as_filter=True) == \
+        ['3', '4', '5', '6', '8']
+
+
+@pytest.mark.parametrize('query_str', [
+    '(', 'a OR', 'NOT', '( 会議', '会議 )', 'OR 会議', 'after:2021-13',
+    'before:2021-02-30', '"会議',
+])
+def test_query_fallback(query_str):
+    """
+    解析できないクエリーは、``?``を除いた部分を、
+    従来の文字列(正規表現)として照合する
+    """
+    for (sde, s) in zip(ENTS, SEARCH_STRS):
+        for args in ((query_str, ''), ('', query_str)):
+            marked = tuple(['?' + a if a else '' for a in args])
+            assert query_match(*marked, s) == legacy_match(*args, s)
+            assert query_match_sde(*marked, sde) == legacy_match(*args, s)
+
+
+@pytest.mark.parametrize('query_str,date,expected', [
+    ('after:2020', datetime.date(2020, 12, 31), False),
+    ('after:2020', datetime.date(2021, 1, 1), True),
+    ('before:2021-04', datetime.date(2021, 3, 31), True),
+    ('before:2021-04', datetime.date(2021, 4, 1), False),
+    ('after:2021-02', datetime.date(2021, 2, 28), False),
+    ('after:2021-02', datetime.date(2021, 3, 1), True),
+    ('after:2021/3/1', datetime.date(2021, 3, 1), False),
+    ('after:2021/3/1', datetime.date(2021, 3, 2), True),
+    ('after:2020 before:2021', datetime.date(2020, 12, 31), False),
+    ('after:2019 before:2021', datetime.date(2020, 12, 31), True),
+    ('before:2020 OR after:2021', datetime.date(2020, 6, 1), False),
+    ('before:2020 OR after:2021', datetime.date(2022, 6, 1), True),
+])
+def test_date_terms(query_str, date, expected):
+    assert query_match('', '?' + query_str, SEARCH_STRS[0], date) == expected
+
+    sde = SchedDataEnt('1', date, title='会議')
+    assert query_match_sde('', '?' + query_str, sde) == expected
+
+
+@pytest.mark.parametrize('filter_str,search_str,bounds', [
+    ('', '?after:2020', (datetime.date(2021, 1, 1), None)),
+    ('', '?before:2021-04', (None, datetime.date(2021, 3, 31))),
+    ('?after:2019', '?会議 before:2021',
+     (datetime.date(2020, 1, 1), datetime.date(2020, 12, 31))),
+    ('', '?会議', (None, None)),
+    # ``OR``は、期間を絞り込まない
+    ('', '?before:2020 OR after:2021', (None, None)),
+    # ``?``がなければ、正規表現
+    ('', 'after:2020', (None, None)),
+])
+def test_date_bounds(filter_str, search_str, bounds):
+    assert Query(filter_str, search_str).date_bounds() == bounds
+
+
+@pytest.mark.parametrize('filter_str,search_str,literals', [
+    ('', '?会議 AND 渋谷', ['会議', '渋谷']),
+    ('', '?会議 OR 渋谷', None),
+    ('', '?NOT 会議', None),
+    ('', '?"a.b"', ['a.b']),
+    ('渋谷', '会議', ['渋谷', '会議']),
+    ('!渋谷', '会議', ['会議']),
+    ('', '', None),
+])
+def test_required_literals(filter_str, search_str, literals):
+    assert Query(filter_str, search_str).required_literals() == literals
+
+
+def test_search_cache():
+    """ 検索用文字列・フィールドは、変更すると作り直す """
+    sde = SchedDataEnt('1', DATE, sde_type='仕事', title='会議',
+                       place='渋谷', detail='a\nB')
+    assert sde.search_str() == '#仕事 +会議 @渋谷 detail:a b'
+    assert sde.search_fields() == ('仕事', '会議', '渋谷', 'a b')
+
+    query = Query('', '?+打合せ')
+    assert not query.match_sde(sde)
+
+    sde.title = '打合せ'
+    sde.place = 'Home'
+    assert sde.search_str() == '#仕事 +打合せ @home detail:a b'
+    assert query.match_sde(sde)
+
+    sde.type = '□'
+    sde.detail = 'x'
+    assert sde.search_fields() == ('□', '打合せ', 'home', 'x')
@@ -0,0 +1,160 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+replace_sde() のテスト
+
+予定の修正は、日ごとに1回の書き込みで、日付が変わる場合は新しい日を先に
+書き込むこと (予定がどちらのファイルにもない瞬間がないこと)、
+書き込みに失敗しても、ファイルは壊れず、キャッシュはファイルの内容に戻ること
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import asyncio
+import datetime
+import pytest
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+from ytsched.async_data import AsyncSchedData
+
+DATE1 = datetime.date(2021, 3, 1)
+DATE2 = datetime.date(2021, 3, 5)
+SDE_ID = 'fix-1'
+
+
+def mk_sde(date, title, sde_type=''):
+    return SchedDataEnt(SDE_ID, date, datetime.time(10, 0), '',
+                        sde_type, title, '', '')
+
+
+def on_disk(topdir, date):
+    """ ファイルにある予定 (キャッシュを使わない) """
+    return [(sde.sde_id, sde.title)
+            for sde in SchedDataFile(date, topdir).sde]
+
+
+def read_bytes(topdir, date):
+    with open(SchedDataFile(date, topdir, sde_list=[]).pathname, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def topdir(tmp_path):
+    topdir = str(tmp_path)
+    for date in (DATE1, DATE2):
+        sdf = SchedDataFile(date, topdir, sde_list=[])
+        sdf.add_sde(SchedDataEnt('other-%s' % (date), date, '', '',
+                                 '', 'その他', '', ''))
+        if date == DATE1:
+            sdf.add_sde(mk_sde(DATE1, '修正前'))
+        sdf.save()
+    return topdir
+
+
+@pytest.fixture
+def saves(monkeypatch, topdir):
+    """
+    保存した日の順序
+
+    保存するたびに、予定がどちらかのファイルにあることを確認する
+    """
+    saved = []
+    orig_save = SchedDataFile.save
+
+    def save(sdf):
+        orig_save(sdf)
+        saved.append(sdf.date)
+        assert any(sde_id == SDE_ID
+                   for date in (DATE1, DATE2, None)
+                   for (sde_id, _) in on_disk(topdir, date))
+
+    monkeypatch.setattr(SchedDataFile, 'save', save)
+    return saved
+
+
+def replace(sd, orig_date, new_sde, use_async):
+    if not use_async:
+        sd.replace_sde(orig_date, new_sde)
+        return
+
+    asd = AsyncSchedData(sd, workers=1)
+    asyncio.run(asd.replace_sde(orig_date, new_sde))
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_same_day(topdir, saves, use_async):
+    """ 同じ日の修正は、1回の書き込み (前の内容は``.bak``) """
+    sd = SchedData(topdir)
+    before = read_bytes(topdir, DATE1)
+
+    replace(sd, DATE1, mk_sde(DATE1, '修正後'), use_async)
+
+    assert saves == [DATE1]
+    assert sorted(on_disk(topdir, DATE1)) == [
+        (SDE_ID, '修正後'), ('other-%s' % (DATE1), 'その他')]
+    with open(SchedDataFile(DATE1, topdir).pathname + '.bak', 'rb') as f:
+        assert f.read() == before
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+@pytest.mark.parametrize('new_date', [DATE2, None])
+def test_move(topdir, saves, use_async, new_date):
+    """ 日付が変わる場合は、新しい日を先に書き込む (ToDo への移動も) """
+    sd = SchedData(topdir)
+    sde_type = '' if new_date else SchedDataEnt.TYPE_PREFIX_TODO
+
+    replace(sd, DATE1, mk_sde(new_date or DATE1, '移動', sde_type),
+            use_async)
+
+    assert saves == [new_date, DATE1]
+    assert (SDE_ID, '移動') in on_disk(topdir, new_date)
+    assert on_disk(topdir, DATE1) == [('other-%s' % (DATE1), 'その他')]
+    assert sd.get_sdf(DATE1).get_sde(SDE_ID) is None
+    assert sd.get_sdf(new_date).get_sde(SDE_ID).title == '移動'
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_failed_write(topdir, monkeypatch, use_async):
+    """
+    置き換える前に失敗したら、ファイルは元のまま、
+    キャッシュもファイルの内容に戻る
+    """
+    sd = SchedData(topdir)
+    sd.get_sdf(DATE1)
+    before = read_bytes(topdir, DATE1)
+
+    def fail(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        replace(sd, DATE1, mk_sde(DATE1, '修正後'), use_async)
+    monkeypatch.undo()
+
+    assert read_bytes(topdir, DATE1) == before
+    assert sd.get_sdf(DATE1).get_sde(SDE_ID).title == '修正前'
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_failed_second_write(topdir, monkeypatch, use_async):
+    """
+    元の日の書き込みに失敗しても、予定はなくならない
+    (新しい日に書き込み済み)
+    """
+    sd = SchedData(topdir)
+    orig_save = SchedDataFile.save
+
+    def save(sdf):
+        if sdf.date == DATE1:
+            raise OSError('disk full')
+        orig_save(sdf)
+
+    monkeypatch.setattr(SchedDataFile, 'save', save)
+    with pytest.raises(OSError):
+        replace(sd, DATE1, mk_sde(DATE2, '移動'), use_async)
+
+    assert (SDE_ID, '移動') in on_disk(topdir, DATE2)
+    assert (SDE_ID, '修正前') in on_disk(topdir, DATE1)
+    assert sd.get_sdf(DATE2).get_sde(SDE_ID).title == '移動'
+    assert sd.get_sdf(DATE1).get_sde(SDE_ID).title == '修正前'
@@ -0,0 +1,153 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+snapshot.py のテスト
+
+保存・復元の結果が同じこと、変更された日(古い日)は読み込み直すこと、
+破損・不正なスナップショットは使わないこと
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import json
+import datetime
+import pytest
+from ytsched import snapshot
+from ytsched.ytsched import SchedDataEnt, SchedDataFile, SchedData
+
+DATES = [datetime.date(2020, 12, 31), datetime.date(2021, 3, 1),
+         datetime.date(2021, 3, 2)]
+
+
+def save_day(topdir, date, titles):
+    sdf = SchedDataFile(date, topdir, sde_list=[])
+    for (i, title) in enumerate(titles):
+        sdf.add_sde(SchedDataEnt('%s-%d' % (date, i), date,
+                                 datetime.time(9 + i, 30), None,
+                                 '仕事', title, '渋谷', 'メモ<br />2行目'))
+    sdf.save()
+
+
+def titles(sd, date):
+    return [(sde.sde_id, sde.time_start, sde.title, sde.place, sde.detail)
+            for sde in sd.get_sdf(date).sde]
+
+
+@pytest.fixture
+def topdir(tmp_path):
+    topdir = str(tmp_path / 'data')
+    for date in DATES:
+        save_day(topdir, date, ['会議 %s' % (date), '打合せ'])
+    return topdir
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / snapshot.DEF_FILENAME)
+
+
+def mk_sd(topdir, columnar):
+    sd = SchedData(topdir, columnar=columnar)
+    sd.preload()
+    return sd
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_restore(topdir, path, columnar):
+    """ 復元したデータが、ファイルから読み込んだものと同じ """
+    sd = mk_sd(topdir, columnar)
+    assert sd.save_snapshot(path) == len(DATES)
+
+    sd2 = SchedData(topdir, columnar=columnar)
+    assert sd2.load_snapshot(path) == (len(DATES), 0)
+    for date in DATES:
+        assert titles(sd2, date) == titles(sd, date)
+
+
+def test_format(topdir, path):
+    """ データは JSON (オブジェクトを含まない) """
+    mk_sd(topdir, True).save_snapshot(path)
+
+    with open(path, 'rb') as f:
+        buf = f.read()
+    assert buf.startswith(snapshot.MAGIC)
+    state = json.loads(buf[len(snapshot.MAGIC) + snapshot.DIGEST_SIZE:])
+    assert state['version'] == snapshot.VERSION
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_stale(topdir, path, columnar):
+    """ 保存後に変更された日は、読み込み直す """
+    mk_sd(topdir, columnar).save_snapshot(path)
+    save_day(topdir, DATES[1], ['変更'])
+
+    sd = SchedData(topdir, columnar=columnar)
+    assert sd.load_snapshot(path) == (len(DATES) - 1, 1)
+    assert [t[2] for t in titles(sd, DATES[1])] == ['変更']
+    assert [t[2] for t in titles(sd, DATES[2])] == [
+        '会議 %s' % (DATES[2]), '打合せ']
+
+
+def corrupt(path):
+    with open(path, 'r+b') as f:
+        f.seek(-10, os.SEEK_END)
+        b = f.read(1)
+        f.seek(-10, os.SEEK_END)
+        f.write(bytes([b[0] ^ 0xff]))
+
+
+def truncate(path):
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+
+def bad_magic(path):
+    with open(path, 'r+b') as f:
+        f.write(b'XXXXXXXX')
+
+
+@pytest.mark.parametrize('damage', [corrupt, truncate, bad_magic])
+@pytest.mark.parametrize('columnar', [False, True])
+def test_corrupt(topdir, path, columnar, damage):
+    """ 破損したスナップショットは使わず、ファイルから読み込む """
+    mk_sd(topdir, columnar).save_snapshot(path)
+    damage(path)
+
+    with pytest.raises(ValueError):
+        snapshot.read(path)
+
+    sd = SchedData(topdir, columnar=columnar)
+    assert sd.load_snapshot(path) == (0, 0)
+    assert [t[2] for t in titles(sd, DATES[0])] == [
+        '会議 %s' % (DATES[0]), '打合せ']
+
+
+def test_topdir(topdir, path, tmp_path):
+    """ 他のディレクトリのスナップショットは使わない """
+    mk_sd(topdir, False).save_snapshot(path)
+    assert SchedData(str(tmp_path)).load_snapshot(path) == (0, 0)
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+@pytest.mark.parametrize('key,value', [
+    ('days', [[None, ['cgi', 1, 1], [['a', None, 0]]]]),
+    ('days', [['2021-03-01', ['cgi', 1, 1], []]]),
+    ('years', [[2021, [], {'year': 2021}]]),
+    ('years', 'x'),
+])
+def test_invalid_state(topdir, path, columnar, key, value):
+    """
+    チェックサムが正しくても、内容が不正なスナップショットは、
+    一部だけ使うことはせず、全く使わない
+    """
+    mk_sd(topdir, True).save_snapshot(path)
+    state = snapshot.read(path)
+    state[key] = value
+    snapshot.write(path, state)
+
+    sd = SchedData(topdir, columnar=columnar)
+    assert sd.load_snapshot(path) == (0, 0)
+    assert not sd._snapshot_rows
+    assert not sd._year_store
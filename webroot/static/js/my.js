@@ -306,14 +306,96 @@ const scrollHdr = (event) => {
         el = document.getElementById("date_from");
         date = el.value;
         console.log(`date=${date}`);
-        doPost('/ytsched/', {date: date, sde_align: "top"});
+        loadDays(-1).then(() => {
+            scrollFlag = true;
+        }).catch((err) => {
+            console.log(`loadDays: ${err}`);
+            doPost('/ytsched/', {date: date, sde_align: "top"});
+        });
     }
     if (d_bottom < 80) {
         scrollFlag = false;
         el = document.getElementById("date_to");
         date = el.value;
         console.log(`date=${date}`);
-        doPost('/ytsched/', {date: date, sde_align: "bottom"});
+        loadDays(1).then(() => {
+            scrollFlag = true;
+        }).catch((err) => {
+            console.log(`loadDays: ${err}`);
+            doPost('/ytsched/', {date: date, sde_align: "bottom"});
+        });
+    }
+};
+
+const DAYS_STEP = 14;
+
+/**
+ * 表示している範囲の前、または後の日を読み込んで、追加する
+ *
+ * ページ全体を読み込み直さずに、``/ytsched/days``から
+ * ``DAYS_STEP``日分の断片を取得する。
+ *
+ * @param {number} direction   -1: ``date_from``の前, 1: ``date_to``の後
+ *
+ * @return {Promise}
+ */
+const loadDays = async (direction) => {
+    const el_edge = document.getElementById(
+        direction < 0 ? "date_from" : "date_to");
+
+    // 区切りを '/'にして、Localtimeとみなす
+    const edge_str = el_edge.value.split('-').join('/');
+    let d_from;
+    let d_to;
+    if (direction < 0) {
+        d_from = shiftDays(new Date(edge_str), -DAYS_STEP);
+        d_to = shiftDays(new Date(edge_str), -1);
+    } else {
+        d_from = shiftDays(new Date(edge_str), 1);
+        d_to = shiftDays(new Date(edge_str), DAYS_STEP);
+    }
+    const from_str = getLocaltimeDateString(d_from);
+    const to_str = getLocaltimeDateString(d_to);
+    const date_str = document.getElementById("date").value;
+
+    const url = `/ytsched/days?from=${from_str}&to=${to_str}&date=${date_str}`;
+    console.log(`loadDays: url=${url}`);
+    const res = await fetch(url, {credentials: "same-origin"});
+    if (! res.ok) {
+        throw new Error(`${url}: ${res.status}`);
+    }
+
+    const tmpl = document.createElement("template");
+    tmpl.innerHTML = await res.text();
+    const days = Array.from(tmpl.content.children).filter(
+        (el) => el.id.startsWith("date-"));
+
+    const el_anchor = document.getElementById(`date-${el_edge.value}`);
+    const anchor_y = el_anchor.getBoundingClientRect().top;
+    let el_end = el_anchor;
+
+    // ストリーミング表示では、逆順(column-reverse)に並べた部分がある
+    const reversed = getComputedStyle(
+        el_end.parentElement).flexDirection == "column-reverse";
+
+    if (direction < 0) {
+        days.reverse(); // 近い日から
+    }
+    for (const el of days) {
+        if ((direction < 0) != reversed) {
+            el_end.before(el);
+        } else {
+            el_end.after(el);
+        }
+        el_end = el;
+    }
+    el_edge.value = direction < 0 ? from_str : to_str;
+
+    // 前に追加した分だけ、表示位置がずれないようにする
+    // (ブラウザの scroll anchoring で、既にずれていない場合は 0)
+    const shift_y = el_anchor.getBoundingClientRect().top - anchor_y;
+    if (shift_y != 0) {
+        window.scrollBy(0, shift_y);
     }
 };
 
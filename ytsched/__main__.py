@@ -6,9 +6,11 @@ main for musicbox package
 """
 import click
 import datetime
-from . import SchedDataFile
+from . import SchedDataFile, SchedData
 from . import WebServer, __prog_name__
 from . import MainHandler
+from .async_data import AsyncSchedData
+from .packfile import pack as pack_year, unpack as unpack_year
 from .my_logger import get_logger
 
 __author__ = 'Yoichi Tanibayashi'
@@ -102,21 +104,120 @@ Web server""")
               default=100*1024*1024,
               help='upload size limit, default=%s' % (
                   WebServer.DEF_SIZE_LIMIT))
+@click.option('--preload-years', 'preload_years', type=int, default=0,
+              help='preload data files of the last N years, default=0')
+@click.option('--lazy', 'lazy', is_flag=True, default=False,
+              help='decode data fields on demand')
+@click.option('--columnar', 'columnar', is_flag=True, default=False,
+              help='hold data in per-year columnar stores')
+@click.option('--snapshot-interval', 'snapshot_interval', type=int,
+              default=WebServer.DEF_SNAPSHOT_INTERVAL,
+              help='minutes between parsed-cache snapshots '
+              '(0: disable), default=%s' % (
+                  WebServer.DEF_SNAPSHOT_INTERVAL))
+@click.option('--watch-interval', 'watch_interval', type=int,
+              default=WebServer.DEF_WATCH_INTERVAL,
+              help='seconds between checks for data files changed '
+              'outside the server (0: disable), default=%s' % (
+                  WebServer.DEF_WATCH_INTERVAL))
+@click.option('--search-index/--no-search-index', 'search_index',
+              default=False,
+              help='use an n-gram index to search the whole history, '
+              'default=off')
+@click.option('--stream', 'stream', is_flag=True, default=False,
+              help='send the page in chunks, days near the target first')
+@click.option('--fragment-cache/--no-fragment-cache', 'fragment_cache',
+              default=False,
+              help='cache the rendered HTML of each day, default=off')
+@click.option('--io-workers', 'io_workers', type=int,
+              default=AsyncSchedData.DEF_WORKERS,
+              help='threads for data and config file I/O '
+              '(0: on the IOLoop), default=%s' % (
+                  AsyncSchedData.DEF_WORKERS))
+@click.option('--workers', 'workers', type=int, default=1,
+              help='server processes forked after preloading, '
+              'sharing the cache copy-on-write, default=1')
+@click.option('--journal', 'use_journal', is_flag=True, default=False,
+              help='append edits to a journal, compacted into the data '
+              'files in the background')
+@click.option('--conf-cookie', 'conf_cookie', is_flag=True, default=False,
+              help='keep view settings (filter, search, ToDo days) '
+              'in browser cookies instead of Conf.cgi')
+@click.option('--cache-mb', 'cache_mb', type=float,
+              default=SchedData.DEF_CACHE_MB,
+              help='memory budget of the parsed-data cache in MB, '
+              'default=%s' % (SchedData.DEF_CACHE_MB))
 @click.option('--version', '-v', 'version', is_flag=True, default=False,
               help='print version')
 @click.option('--debug', '-d', 'debug', is_flag=True, default=False,
               help='debug flag')
-def webapp(port, webroot, datadir, days, size_limit, version, debug):
+def webapp(port, webroot, datadir, days, size_limit, preload_years,
+           lazy, columnar, snapshot_interval, watch_interval, search_index,
+           stream, fragment_cache, io_workers, workers, use_journal,
+           conf_cookie, cache_mb, version, debug):
     """ webapp  """
     log = get_logger(__name__, debug)
 
-    app = WebServer(port, webroot, datadir, days, size_limit, version,
-                    debug=debug)
+    app = WebServer(port, webroot, datadir, days, size_limit,
+                    preload_years, lazy, columnar, snapshot_interval,
+                    watch_interval, search_index, stream, fragment_cache,
+                    io_workers, workers, use_journal, conf_cookie,
+                    cache_mb, version, debug=debug)
     try:
         app.main()
     finally:
         log.info('end')
 
 
+@cli.group(help="""
+data files""")
+def data():
+    """ data files """
+
+
+@data.command(help="""
+pack the day files of a past YEAR into one memory-mapped file""")
+@click.argument('year', type=int)
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True),
+              default=SchedDataFile.DEF_TOP_DIR,
+              help='data directory, default=\'%s\'' % (
+                  SchedDataFile.DEF_TOP_DIR))
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def pack(year, datadir, debug):
+    """ pack """
+    log = get_logger(__name__, debug)
+
+    try:
+        n_days = pack_year(datadir, year)
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+
+    log.info('%s: %s days packed', year, n_days)
+
+
+@data.command(help="""
+restore the day files of YEAR from its pack file""")
+@click.argument('year', type=int)
+@click.option('--datadir', '--data', 'datadir',
+              type=click.Path(exists=True),
+              default=SchedDataFile.DEF_TOP_DIR,
+              help='data directory, default=\'%s\'' % (
+                  SchedDataFile.DEF_TOP_DIR))
+@click.option('--debug', '-d', 'debug', is_flag=True, default=False,
+              help='debug flag')
+def unpack(year, datadir, debug):
+    """ unpack """
+    log = get_logger(__name__, debug)
+
+    try:
+        n_files = unpack_year(datadir, year)
+    except FileNotFoundError as ex:
+        raise click.BadParameter('%s: not found' % (ex))
+
+    log.info('%s: %s files restored', year, n_files)
+
+
 if __name__ == '__main__':
     cli(prog_name=__prog_name__)
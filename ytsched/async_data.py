@@ -0,0 +1,590 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+``SchedData``の非同期ファサード
+
+ファイルの読み書きをスレッドプールで実行し、IOLoop を止めない。
+(ディスクが遅くても、他のクライアントを待たせない)
+
+  IOLoop のスレッド                 スレッドプール
+  ----------------------------------------------------------------
+  await prefetch(from, to)  --->   read_month_bitmap(), load_sdf()
+  put_month_bitmap(),       <---
+  put_sdf(), put_year()
+  async for .. in iter_range()
+      月ごとに await prefetch() ---> (同上)
+      SchedData.iter_range() (キャッシュのみ)
+
+``SchedData``はスレッドセーフではないので、
+キャッシュの参照・更新は、IOLoop のスレッドのみで行う。
+
+* 同じ日(月、年)の読み込みが重なった場合は、一つにまとめる。
+  (最初の読み込みの結果を、全員で待つ)
+* 同じ日への書き込みは、日ごとのロックで順番に行う。
+* 読み込み中に変更された日の結果は、捨てる。(古い内容の可能性がある)
+
+複数のプロセスで動かす場合(``set_ring()``)は、
+書き込んだ日を``ChangeRing``(``broadcast.py``)で他のプロセスに知らせ、
+``sync()``で他のプロセスが書き込んだ日のキャッシュを捨てる。
+(``sync()``は、リクエストの処理中ではなく、定期的と書き込みの前に呼ぶ)
+
+ジャーナルを使う場合は、``compact_journal()``で、
+データファイルへの反映(書き込み)をスレッドプールで行う。
+
+``get_sdf()``, ``iter_range()``, ``add_sde()``, ``del_sde()``,
+``replace_sde()``, ``compact_journal()``, ``revalidate()``, ``sync()``以外は、
+そのまま``SchedData``に委譲する。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import asyncio
+import calendar
+import datetime
+import itertools
+import contextlib
+import concurrent.futures
+from .ytsched import SchedData, SchedDataEnt, SchedDataFile, EMPTY_SDF
+from .my_logger import get_logger
+
+
+class AsyncSchedData:
+    """
+    ``SchedData``の非同期ファサード
+
+    Attributes
+    ----------
+    n_loads: int
+        スレッドプールで実行した読み込みの数 (まとめて読み込んだ日は、1回)
+    n_merged: int
+        実行中の読み込みにまとめた数
+    """
+    DEF_WORKERS = 4
+
+    def __init__(self, sd: SchedData, workers: int = DEF_WORKERS,
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        sd: SchedData
+        workers: int
+            スレッド数
+            0: スレッドを使わない (IOLoop のスレッドで読み書きする)
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('workers=%s', workers)
+
+        self._sd = sd
+        self._executor = None
+        if workers > 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                workers, thread_name_prefix='ytsched-io')
+
+        self._inflight = {}
+        self._locks = {}
+        self._ring = None
+        self._compacting = set()
+        self._compact_lock = asyncio.Lock()
+
+        self.n_loads = 0
+        self.n_merged = 0
+
+    def __str__(self):
+        """ __str__ """
+        return '%s, loads:%s, merged:%s' % (
+            self._sd, self.n_loads, self.n_merged)
+
+    def __getattr__(self, name):
+        return getattr(self._sd, name)
+
+    @property
+    def sd(self) -> SchedData:
+        """ 同期版 """
+        return self._sd
+
+    def set_ring(self, ring) -> None:
+        """
+        プロセス間の変更通知を使う
+
+        Parameters
+        ----------
+        ring: broadcast.ChangeRing
+        """
+        self._ring = ring
+        self._sd.set_version_source(ring.next_version)
+
+    def _publish(self, date_list) -> None:
+        if self._ring is None:
+            return
+
+        for date in date_list:
+            self._ring.publish(date)
+
+    async def sync(self) -> list:
+        """
+        他のプロセスが変更した日のキャッシュを捨てる
+
+        リクエストの処理とは別に(``SYNC_INTERVAL``ごとに)呼ぶ。
+        書き込みの前にも呼び、古いキャッシュに変更を加えないようにする。
+        ジャーナルの読み込み直しは、スレッドプールで行う。
+
+        Returns
+        -------
+        date_list: list
+            キャッシュを捨てた日
+        """
+        if self._ring is None:
+            return []
+
+        date_list = self._ring.poll()
+        if date_list is None:
+            # ``SchedData.revalidate_all()``
+            self._mylog.warning('change ring overflowed: revalidate all')
+            if self._sd.journal is not None:
+                await self.run(self._sd.journal.refresh)
+            date_list = await self._revalidate(self._sd.cached_years())
+            self._sd.reset_versions()
+            return date_list
+
+        if date_list and self._sd.journal is not None:
+            # 他のプロセスが追記した変更を、読み込み直す日に適用する
+            await self.run(self._sd.journal.refresh)
+
+        await self._invalidate(date_list)
+        return date_list
+
+    async def run(self, func, *args):
+        """
+        ``func(*args)``を、スレッドプールで実行する
+
+        Returns
+        -------
+        result:
+            ``func``の戻り値
+        """
+        if self._executor is None:
+            return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args)
+
+    async def _single_flight(self, key, func, *args):
+        """
+        ``key``の読み込みが実行中なら、その結果を待つ
+        (実行中でなければ、``run(func, *args)``)
+        """
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.n_merged += 1
+            return await asyncio.shield(fut)
+
+        self.n_loads += 1
+        fut = asyncio.ensure_future(self.run(func, *args))
+        self._inflight[key] = fut
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    @contextlib.asynccontextmanager
+    async def write_lock(self, key):
+        """
+        ``key``(日付、ファイル名など)ごとの書き込みロック
+
+        Examples
+        --------
+        async with asd.write_lock(date):
+            ...
+        """
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = [asyncio.Lock(), 0]
+
+        lock[1] += 1
+        try:
+            async with lock[0]:
+                yield
+        finally:
+            lock[1] -= 1
+            if lock[1] == 0:
+                del self._locks[key]
+
+    def is_writing(self, key) -> bool:
+        """
+        Returns
+        -------
+        result: bool
+            True: ``key``の書き込み中(待ちを含む)
+        """
+        return key in self._locks
+
+    async def _load_months(self, months) -> None:
+        """
+        ファイル存在ビットマップがない月を、読み込む
+
+        Parameters
+        ----------
+        months: iterable of (year, month)
+        """
+        async def load(year, month):
+            bitmap = await self._single_flight(
+                ('month', year, month), self._sd.read_month_bitmap,
+                year, month)
+            self._sd.put_month_bitmap(year, month, bitmap)
+
+        await asyncio.gather(*[
+            load(year, month) for (year, month) in set(months)
+            if not self._sd.has_month_bitmap(year, month)])
+
+    async def _load_day(self, date: datetime.date = None) -> None:
+        await self._load_days([date])
+
+    async def _load_days(self, date_list: list) -> None:
+        """
+        キャッシュにない日を、まとめて一つのスレッドで読み込む
+        (読み込み中の日は、その結果を待つ)
+
+        Parameters
+        ----------
+        date_list: list of datetime.date
+        """
+        loop = asyncio.get_running_loop()
+
+        waiting = []
+        new_list = []
+        for date in date_list:
+            fut = self._inflight.get(date)
+            if fut is None:
+                fut = self._inflight[date] = loop.create_future()
+                new_list.append(date)
+            else:
+                self.n_merged += 1
+            waiting.append((date, self._sd.version(date), fut))
+
+        if new_list:
+            self.n_loads += 1
+            try:
+                sdf_list = await self.run(
+                    lambda: [self._sd.load_sdf(d) for d in new_list])
+                for (date, sdf) in zip(new_list, sdf_list):
+                    self._inflight.pop(date).set_result(sdf)
+            except Exception as ex:
+                for date in new_list:
+                    fut = self._inflight.pop(date)
+                    fut.set_exception(ex)
+                    fut.exception()  # 待っているものがなくても、警告しない
+                raise
+
+        for (date, version, fut) in waiting:
+            sdf = await fut
+            if self._sd.version(date) == version:
+                self._sd.put_sdf(date, sdf)
+
+    async def _load_year(self, year: int, date_list: list) -> None:
+        if not date_list:
+            self._sd.put_year(year, [])
+            return
+
+        version = self._sd.range_version(date_list[0], date_list[-1])
+        sdf_list = await self._single_flight(
+            ('year', year), lambda: [self._sd.load_sdf(d) for d in date_list])
+        if self._sd.range_version(date_list[0], date_list[-1]) == version:
+            self._sd.put_year(year, sdf_list)
+
+    async def prefetch(self, date_from: datetime.date,
+                       date_to: datetime.date, dates=None) -> None:
+        """
+        期間内のキャッシュにない日を、スレッドプールで読み込んでおく
+        (その後の``iter_range()``などは、ファイルを読まない)
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            期間 (両端を含む)
+        dates: iterable of datetime.date
+            候補の日 (``search_dates()``)
+            None: 全ての日
+        """
+        if dates is None:
+            dates = SchedData._date_range(date_from, date_to)
+        else:
+            dates = sorted([d for d in dates if date_from <= d <= date_to])
+
+        dates = [d for d in dates if not self._sd.is_cached(d)]
+        if not dates:
+            return
+
+        await self._load_months([(d.year, d.month) for d in dates])
+
+        dates = [d for d in dates if not self._sd.is_cached(d)]
+        if not dates:
+            return
+        self._mylog.debug('%s .. %s: %s days', dates[0], dates[-1],
+                          len(dates))
+
+        if self._sd.columnar:
+            # 列指向ストアは、年単位で生成する
+            years = sorted({d.year for d in dates})
+            await self._load_months([(year, month) for year in years
+                                     for month in range(1, 13)])
+            await asyncio.gather(*[
+                self._load_year(year, self._sd.existing_dates(year))
+                for year in years])
+            return
+
+        await self._load_days(dates)
+
+    async def iter_range(self, date_from: datetime.date,
+                         date_to: datetime.date, reverse: bool = False,
+                         query=None, limit: int = None, dates=None):
+        """
+        ``SchedData.iter_range()``の非同期版 (async generator)
+
+        月ごとに、キャッシュにない日をスレッドプールで読み込んでから
+        (``prefetch()``)、その月を走査する。
+        ``limit``個で止めた場合、先の月は読み込まない。
+        (検索モードで、期間全体を先に読み込まない)
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+        reverse: bool
+        query: query.Query or None
+        limit: int
+        dates: iterable of datetime.date
+
+        Yields
+        ------
+        (date, is_holiday, sde_list): (datetime.date, bool, list)
+        """
+        if dates is None:
+            months = [(ym, None) for ym in SchedData._month_range(
+                date_from, date_to, reverse)]
+        else:
+            dates = sorted([d for d in dates if date_from <= d <= date_to],
+                           reverse=reverse)
+            months = [(ym, list(month_dates)) for (ym, month_dates)
+                      in itertools.groupby(
+                          dates, key=lambda d: (d.year, d.month))]
+
+        count = 0
+        for ((year, month), month_dates) in months:
+            month_from = max(date_from, datetime.date(year, month, 1))
+            month_to = min(date_to, datetime.date(
+                year, month, calendar.monthrange(year, month)[1]))
+
+            await self.prefetch(month_from, month_to, month_dates)
+
+            for (date, is_holiday, sde_list) in self._sd.iter_range(
+                    month_from, month_to, reverse=reverse,
+                    query=query,
+                    limit=None if limit is None else limit - count,
+                    dates=month_dates):
+                count += len(sde_list)
+                yield (date, is_holiday, sde_list)
+
+            if limit is not None and count >= limit:
+                return
+
+    async def get_sdf(self, date: datetime.date = None) -> SchedDataFile:
+        """
+        ``SchedData.get_sdf()``の非同期版
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+
+        Returns
+        -------
+        sdf: SchedDataFile
+        """
+        if date is None:
+            if not self._sd.is_cached(None):
+                await self._load_day(None)
+        else:
+            await self.prefetch(date, date)
+
+        return self._sd.get_sdf(date)
+
+    async def get_sde(self, date: datetime.date = None,
+                      sde_id: str = '') -> SchedDataEnt:
+        """
+        ``SchedData.get_sde()``の非同期版
+        """
+        sdf = await self.get_sdf(date)
+        return sdf.get_sde(sde_id)
+
+    async def add_sde(self, date: datetime.date = None,
+                      sde: SchedDataEnt = None) -> None:
+        """
+        ``SchedData.add_sde()``の非同期版
+        (保存は、スレッドプールで行う)
+
+        保存に失敗した場合は、キャッシュをファイルの内容に戻す。
+        """
+        self._mylog.debug('date=%s, sde=%s', date, sde)
+
+        async with self.write_lock(date):
+            await self.sync()
+            await self.get_sdf(date)
+
+            sdf = self._sd.begin_edit(date)
+            sdf.add_sde(sde)
+            await self._save_edit(sdf, [(date, sde.sde_id, sde)])
+
+    async def del_sde(self, date: datetime.date = None,
+                      sde_id: str = '') -> None:
+        """
+        ``SchedData.del_sde()``の非同期版
+        (保存は、スレッドプールで行う)
+
+        保存に失敗した場合は、キャッシュをファイルの内容に戻す。
+        """
+        self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
+
+        async with self.write_lock(date):
+            await self.sync()
+            if await self.get_sdf(date) is EMPTY_SDF:
+                return
+
+            sdf = self._sd.begin_edit(date)
+            sdf.del_sde(sde_id)
+            await self._save_edit(sdf, [(date, sde_id, None)])
+
+    async def _save_edit(self, sdf: SchedDataFile, ops: list) -> None:
+        """
+        変更した1日分を保存する (スレッドプールで)
+        (``write_lock()``を取って呼ぶこと)
+
+        成功した場合のみ``end_edit()``し、
+        失敗した場合は、キャッシュをファイルの内容に戻す。
+        (``replace_sde()``と同様)
+
+        Parameters
+        ----------
+        sdf: SchedDataFile
+            ``begin_edit()``で取得し、変更したもの
+        ops: list of (date, sde_id, sde)
+            ``SchedData.save_edit()``
+        """
+        try:
+            await self.run(self._sd.save_edit, [sdf], ops)
+        except Exception:
+            # ファイルの内容に戻す
+            self._sd.invalidate(sdf.date)
+            raise
+        else:
+            self._sd.end_edit(sdf)
+        finally:
+            self._publish([sdf.date])
+
+    async def replace_sde(self, orig_date: datetime.date = None,
+                          new_sde: SchedDataEnt = None) -> None:
+        """
+        ``SchedData.replace_sde()``の非同期版
+        (保存は、スレッドプールで行う)
+
+        元の日と新しい日の両方の書き込みロックを、日付順に取る。
+        """
+        self._mylog.debug('orig_date=%s, new_sde=%s', orig_date, new_sde)
+
+        date = None if new_sde.is_todo() else new_sde.date
+        date_list = sorted({orig_date, date},
+                           key=lambda d: d or datetime.date.min)
+
+        async with contextlib.AsyncExitStack() as stack:
+            for d in date_list:
+                await stack.enter_async_context(self.write_lock(d))
+            await self.sync()
+            for d in date_list:
+                await self.get_sdf(d)
+
+            sdf_list = self._sd.begin_replace(orig_date, new_sde)
+            try:
+                await self.run(self._sd.save_edit, sdf_list,
+                               self._sd.replace_ops(orig_date, new_sde))
+            except Exception:
+                # ファイルの内容に戻す
+                for sdf in sdf_list:
+                    self._sd.invalidate(sdf.date)
+                raise
+            else:
+                for sdf in sdf_list:
+                    self._sd.end_edit(sdf)
+            finally:
+                self._publish([sdf.date for sdf in sdf_list])
+
+    async def compact_journal(self) -> int:
+        """
+        ``SchedData.compact_journal()``の非同期版
+        (ジャーナルの読み込み・切り詰めと、データファイルへの書き込みは、
+        スレッドプールで行う)
+
+        Returns
+        -------
+        n_days: int
+            書き込んだ日数
+        """
+        journal = self._sd.journal
+        if journal is None or self._compact_lock.locked():
+            return 0
+
+        async with self._compact_lock:
+            (seq, days) = await self.run(journal.plan)
+            if not days:
+                return 0
+
+            self._compacting.update(days)
+            try:
+                keys = await self.run(self._sd.compact_days, days)
+                await self.run(journal.truncate, seq)
+                for (date, key) in keys.items():
+                    self._sd.set_stat_key(date, key)
+            finally:
+                self._compacting.clear()
+
+        self._mylog.info('compact_journal: %s days', len(keys))
+        return len(keys)
+
+    async def revalidate(self, changed) -> list:
+        """
+        ``SchedData.revalidate()``の非同期版
+        (ファイルの mtime, size の確認と、読み込み直しは、スレッドプールで行う)
+
+        書き込み中の日は、自分の変更なので、除く。
+        (保存後に``end_edit()``で反映する)
+        ジャーナルを反映中の日も、同様に除く。
+        キャッシュを捨てた日は、他のプロセスにも知らせる。
+        """
+        date_list = await self._revalidate(
+            [d for d in changed
+             if not self.is_writing(d) and d not in self._compacting])
+        self._publish(date_list)
+        return date_list
+
+    async def _revalidate(self, changed) -> list:
+        keys = self._sd.cached_keys(changed)
+        date_list = await self.run(self._sd.stale_dates, keys)
+        await self._invalidate(date_list)
+
+        if date_list:
+            self._mylog.info('revalidate: %s changed', len(date_list))
+        return date_list
+
+    async def _invalidate(self, date_list: list) -> None:
+        """
+        ``SchedData.invalidate()``
+        (読み込み直す日は、スレッドプールで読み込んでおく)
+        """
+        reload = [d for d in date_list if self._sd.reload_on_invalidate(d)]
+        sdf_list = await asyncio.gather(
+            *[self.run(self._sd.load_sdf, d) for d in reload])
+        loaded = dict(zip(reload, sdf_list))
+
+        for date in date_list:
+            self._sd.invalidate(date, loaded.get(date))
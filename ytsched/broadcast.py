@@ -0,0 +1,165 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+プロセス間の変更通知 (``ytsched webapp --workers N``)
+
+fork する前に作成した共有メモリ(無名 mmap)のリングバッファに、
+変更された日を書き込み、各プロセスが読み出して、キャッシュを捨てる。
+
+  header:  (seq, version)
+      seq: 書き込んだ数
+      version: 全プロセスで通しのバージョン番号 (``next_version()``)
+  slot[seq % n_slots]: (seq, pid, key)
+      key: 日の ordinal (0: ToDo)
+
+読み出しが``n_slots``以上遅れた場合は、``poll()``が None を返す。
+(全てのキャッシュを確認し直す必要がある)
+
+Notes
+-----
+* 書き込みと、新しいものがある場合の読み出しは、ロックファイルの
+  ``fcntl.flock()``で排他する。(新しいものがない場合の確認は、ロックしない)
+  ロックを持ったままプロセスが異常終了しても、OS が解放するので、
+  他のプロセスが止まらない。(``multiprocessing.Lock``は、解放されない)
+  ロックファイルは、プロセスごとに開く。(fork 前に開いたファイルは、
+  全プロセスで共有され、``flock()``が排他にならない)
+* 異常終了して再起動されたプロセスは、fork した時点からの変更を
+  全て読み出すので、古いキャッシュが残らない。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import mmap
+import fcntl
+import struct
+import datetime
+import threading
+import contextlib
+
+DEF_LOCK_FILENAME = '.ytsched.ring.lock'
+
+
+class ChangeRing:
+    """
+    変更された日を、全プロセスに通知するリングバッファ
+    """
+    DEF_SLOTS = 4096
+
+    _HEADER = struct.Struct('<QQ')
+    _SLOT = struct.Struct('<Qii')
+
+    def __init__(self, lock_path: str, version: int = 0,
+                 n_slots: int = DEF_SLOTS):
+        """ Constructor (fork する前に作成すること)
+
+        Parameters
+        ----------
+        lock_path: str
+            ロックファイル (なければ作成する)
+        version: int
+            バージョン番号の初期値
+        n_slots: int
+        """
+        self._n_slots = n_slots
+        self._mm = mmap.mmap(-1, self._HEADER.size +
+                             self._SLOT.size * n_slots)
+        self._HEADER.pack_into(self._mm, 0, 0, version)
+        self._seen = 0
+
+        self._lock_path = lock_path
+        self._lock_f = None
+        self._lock_pid = None
+        self._thread_lock = threading.Lock()
+        open(lock_path, 'a').close()
+
+    def __str__(self):
+        """ __str__ """
+        (seq, version) = self._HEADER.unpack_from(self._mm, 0)
+        return 'seq:%s, version:%s, seen:%s' % (seq, version, self._seen)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        他のプロセス(とスレッド)と排他する
+        """
+        with self._thread_lock:
+            if self._lock_pid != os.getpid():
+                # fork 後の最初のロックで、このプロセス用に開く
+                self._lock_f = open(self._lock_path, 'a')
+                self._lock_pid = os.getpid()
+
+            fcntl.flock(self._lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_f, fcntl.LOCK_UN)
+
+    def publish(self, date: datetime.date = None) -> None:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+        """
+        key = date.toordinal() if date else 0
+
+        with self._locked():
+            (seq, version) = self._HEADER.unpack_from(self._mm, 0)
+            seq += 1
+            self._SLOT.pack_into(
+                self._mm,
+                self._HEADER.size + self._SLOT.size * (seq % self._n_slots),
+                seq, os.getpid(), key)
+            self._HEADER.pack_into(self._mm, 0, seq, version)
+
+    def next_version(self) -> int:
+        """
+        ``SchedData.set_version_source()``用
+
+        Returns
+        -------
+        version: int
+            全プロセスで通しのバージョン番号
+        """
+        with self._locked():
+            (seq, version) = self._HEADER.unpack_from(self._mm, 0)
+            version += 1
+            self._HEADER.pack_into(self._mm, 0, seq, version)
+
+        return version
+
+    def poll(self) -> list:
+        """
+        Returns
+        -------
+        date_list: list of datetime.date or None
+            前回から、他のプロセスが変更した日 (None: ToDo)
+            None: 遅れすぎて、読み出せなかった
+        """
+        (seq, _) = self._HEADER.unpack_from(self._mm, 0)
+        if seq == self._seen:
+            return []
+
+        date_list = []
+        pid = os.getpid()
+        with self._locked():
+            (seq, _) = self._HEADER.unpack_from(self._mm, 0)
+            if seq - self._seen > self._n_slots:
+                self._seen = seq
+                return None
+
+            for seq1 in range(self._seen + 1, seq + 1):
+                (_, pid1, key) = self._SLOT.unpack_from(
+                    self._mm,
+                    self._HEADER.size + self._SLOT.size *
+                    (seq1 % self._n_slots))
+                if pid1 == pid:
+                    continue
+                date_list.append(
+                    datetime.date.fromordinal(key) if key else None)
+
+            self._seen = seq
+
+        return date_list
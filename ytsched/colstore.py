@@ -0,0 +1,498 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+列指向の年単位ストア
+
+1年分のスケジュール・データを、エンティティのオブジェクトではなく、
+配列と文字列プールで保持する。
+
+  行(エンティティ)ごとの列:
+    _min_start:   開始時刻 (0時からの分, MIN_NULL: なし)   array('h')
+    _min_end:     終了時刻                                 array('h')
+
+  文字列プール:
+    _text:        sde_id, type, title, place, detail を連結した文字列
+    _text_offset: 各フィールドの終了位置 (行ごとに``N_TEXT``個)
+    _search:      検索用文字列(``SchedDataEnt.search_str()``)を連結した文字列
+    _search_offset: 各行の終了位置
+
+  日ごとの索引:
+    _day_start:   元日からの日数 -> 先頭の行番号
+    _text_base:   元日からの日数 -> ``_text``の開始位置
+    _search_base: 元日からの日数 -> ``_search``の開始位置
+    _holiday:     元日からの日数 -> 休日・祝日か
+
+Notes
+-----
+エンティティ(``SchedDataEnt``)は、表示する行についてのみ、
+``factory``で生成する。(このモジュールは、``SchedDataEnt``に依存しない)
+
+文字列プールの位置は、その日の開始位置(``_text_base``, ``_search_base``)
+からの相対位置なので、1日分を置き換える時(``set_day()``)は、
+その日の範囲の配列・文字列を入れ替え、後の日の索引(最大366個)をずらすだけ。
+(他の日の行は、作り直さない)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import sys
+import bisect
+import datetime
+from array import array
+from . import dayparser
+from . import snapshot
+
+N_TEXT = 5
+""" 文字列フィールドの数: sde_id, type, title, place, detail """
+
+
+def sde2row(sde) -> tuple:
+    """
+    エンティティを、``YearStore``の行に変換する
+
+    Parameters
+    ----------
+    sde: SchedDataEnt
+
+    Returns
+    -------
+    row: tuple
+        (min_start, min_end, search_str, sde_id, type, title, place, detail)
+    """
+    return (dayparser.time2min(sde.time_start),
+            dayparser.time2min(sde.time_end),
+            sde.search_str(),
+            sde.sde_id, sde.type, sde.title, sde.place, sde.detail)
+
+
+class YearStore:
+    """
+    1年分のスケジュール・データ (列指向)
+
+    Attributes
+    ----------
+    year: int
+    n_days: int
+        データがある日数
+    n_rows: int
+        行(エンティティ)数
+    nbytes: int
+        メモリ使用量 (配列と文字列プール)
+    """
+    def __init__(self, year: int, days=()):
+        """ Constructor
+
+        Parameters
+        ----------
+        year: int
+        days: iterable of (date, is_holiday, rows)
+            rows: list of row (``sde2row()``), 表示順
+        """
+        self.year = year
+        self._jan1 = datetime.date(year, 1, 1).toordinal()
+        self._n_yday = datetime.date(year, 12, 31).toordinal() - self._jan1 + 1
+
+        self._build(days)
+
+    def __str__(self):
+        """ __str__ """
+        return 'year:%s, days:%s, rows:%s' % (
+            self.year, self.n_days, self.n_rows)
+
+    @staticmethod
+    def _pack(rows: list) -> tuple:
+        """
+        1日分の行を、列と文字列にする
+
+        Parameters
+        ----------
+        rows: list of row (``sde2row()``)
+
+        Returns
+        -------
+        (min_start, min_end, text, text_offset, search, search_offset)
+            offset: その日の先頭からの相対位置
+        """
+        min_start = array('h')
+        min_end = array('h')
+        text = []
+        text_offset = array('i')
+        search = []
+        search_offset = array('i')
+
+        text_pos = 0
+        search_pos = 0
+        for row in rows:
+            min_start.append(row[0])
+            min_end.append(row[1])
+
+            search.append(row[2])
+            search_pos += len(row[2])
+            search_offset.append(search_pos)
+
+            for field in row[3:]:
+                text.append(field)
+                text_pos += len(field)
+                text_offset.append(text_pos)
+
+        return (min_start, min_end, ''.join(text), text_offset,
+                ''.join(search), search_offset)
+
+    def _build(self, days) -> None:
+        """
+        全ての列を生成する
+
+        Parameters
+        ----------
+        days: iterable of (date, is_holiday, rows)
+        """
+        min_start = array('h')
+        min_end = array('h')
+        text = []
+        text_offset = array('i')
+        search = []
+        search_offset = array('i')
+
+        day_start = array('i', [0]) * (self._n_yday + 1)
+        text_base = array('i', [0]) * (self._n_yday + 1)
+        search_base = array('i', [0]) * (self._n_yday + 1)
+        holiday = bytearray(self._n_yday)
+
+        n_days = 0
+        for (date, is_holiday, rows) in sorted(days, key=lambda d: d[0]):
+            yday = date.toordinal() - self._jan1
+            holiday[yday] = bool(is_holiday)
+
+            if not rows:
+                continue
+
+            n_days += 1
+            packed = self._pack(rows)
+            min_start += packed[0]
+            min_end += packed[1]
+            text.append(packed[2])
+            text_offset += packed[3]
+            search.append(packed[4])
+            search_offset += packed[5]
+
+            # 日ごとの行数・文字数 -> 後で累積して、開始位置にする
+            day_start[yday + 1] = len(rows)
+            text_base[yday + 1] = len(packed[2])
+            search_base[yday + 1] = len(packed[4])
+
+        for i in range(1, self._n_yday + 1):
+            day_start[i] += day_start[i - 1]
+            text_base[i] += text_base[i - 1]
+            search_base[i] += search_base[i - 1]
+
+        self._min_start = min_start
+        self._min_end = min_end
+        self._text = ''.join(text)
+        self._text_offset = text_offset
+        self._search = ''.join(search)
+        self._search_offset = search_offset
+        self._day_start = day_start
+        self._text_base = text_base
+        self._search_base = search_base
+        self._holiday = holiday
+
+        self.n_days = n_days
+        self._update_size()
+
+    def _update_size(self) -> None:
+        """ ``n_rows``, ``nbytes``を更新する """
+        self.n_rows = len(self._min_start)
+        self.nbytes = sum([sys.getsizeof(col) for col in (
+            self._min_start, self._min_end, self._text, self._text_offset,
+            self._search, self._search_offset, self._day_start,
+            self._text_base, self._search_base, self._holiday)])
+
+    _ARRAYS = ('_min_start', '_min_end', '_text_offset', '_search_offset',
+               '_day_start', '_text_base', '_search_base')
+
+    def to_state(self) -> dict:
+        """
+        保存用の状態 (文字列・数値のみ)
+
+        Returns
+        -------
+        state: dict
+        """
+        state = {name: snapshot.encode_array(getattr(self, name))
+                 for name in self._ARRAYS}
+        state.update({
+            'year': self.year,
+            'n_days': self.n_days,
+            '_text': self._text,
+            '_search': self._search,
+            '_holiday': snapshot.encode_array(array('B', self._holiday)),
+        })
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """
+        ``to_state()``の逆
+
+        Parameters
+        ----------
+        state: dict
+
+        Returns
+        -------
+        store: YearStore
+
+        Raises
+        ------
+        ValueError
+            不正な状態 (配列の長さ・位置が合わない)
+        """
+        try:
+            store = cls(int(state['year']))
+            for name in cls._ARRAYS:
+                setattr(store, name, snapshot.decode_array(
+                    getattr(store, name).typecode, state[name]))
+            store._text = str(state['_text'])
+            store._search = str(state['_search'])
+            store._holiday = bytearray(
+                snapshot.decode_array('B', state['_holiday']))
+            store.n_days = int(state['n_days'])
+        except (KeyError, TypeError) as ex:
+            raise ValueError('invalid store: %s: %s' % (
+                type(ex).__name__, ex))
+
+        n_rows = len(store._min_start)
+        n_yday = store._n_yday
+        if (len(store._min_end) != n_rows
+                or len(store._search_offset) != n_rows
+                or len(store._text_offset) != n_rows * N_TEXT
+                or len(store._holiday) != n_yday
+                or len(store._day_start) != n_yday + 1
+                or len(store._text_base) != n_yday + 1
+                or len(store._search_base) != n_yday + 1
+                or store._day_start[n_yday] != n_rows
+                or store._text_base[n_yday] != len(store._text)
+                or store._search_base[n_yday] != len(store._search)):
+            raise ValueError('invalid store: %s' % (store.year))
+
+        store._update_size()
+        return store
+
+    def _yday(self, date: datetime.date) -> int:
+        """
+        Raises
+        ------
+        ValueError
+            ``year``以外の日付
+        """
+        if date.year != self.year:
+            raise ValueError('%s: not in %s' % (date, self.year))
+        return date.toordinal() - self._jan1
+
+    def _mk_sde(self, i: int, r0: int, yday: int, date: datetime.date,
+                factory):
+        """
+        行 -> ``factory``で生成したエンティティ
+
+        Parameters
+        ----------
+        i: int
+            行番号
+        r0: int
+            その日の先頭の行番号
+        yday: int
+        """
+        o = self._text_offset
+        k = i * N_TEXT
+        b = self._text_base[yday]
+        s = b + o[k - 1] if i > r0 else b
+        (e0, e1, e2, e3, e4) = o[k:k + N_TEXT]
+        t = self._text
+        return factory(t[s:b + e0], date,
+                       dayparser.min2time(self._min_start[i]),
+                       dayparser.min2time(self._min_end[i]),
+                       t[b + e0:b + e1], t[b + e1:b + e2],
+                       t[b + e2:b + e3], t[b + e3:b + e4])
+
+    def is_holiday(self, date: datetime.date) -> bool:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+        """
+        return bool(self._holiday[self._yday(date)])
+
+    def get_day(self, date: datetime.date, factory) -> list:
+        """
+        1日分のエンティティを生成する
+
+        Parameters
+        ----------
+        date: datetime.date
+        factory: callable
+            factory(sde_id, date, time_start, time_end,
+                    sde_type, title, place, detail) -> SchedDataEnt
+
+        Returns
+        -------
+        sde_list: list of SchedDataEnt
+        """
+        yday = self._yday(date)
+        r0 = self._day_start[yday]
+        return [self._mk_sde(i, r0, yday, date, factory)
+                for i in range(r0, self._day_start[yday + 1])]
+
+    def set_day(self, date: datetime.date, is_holiday: bool,
+                rows: list) -> None:
+        """
+        1日分のデータを置き換える
+
+        その日の範囲の配列・文字列を入れ替え、後の日の開始位置をずらす。
+
+        Parameters
+        ----------
+        date: datetime.date
+        is_holiday: bool
+        rows: list of row (``sde2row()``)
+        """
+        yday = self._yday(date)
+        (r0, r1) = (self._day_start[yday], self._day_start[yday + 1])
+        (t0, t1) = (self._text_base[yday], self._text_base[yday + 1])
+        (s0, s1) = (self._search_base[yday], self._search_base[yday + 1])
+
+        (min_start, min_end, text, text_offset,
+         search, search_offset) = self._pack(rows)
+
+        self._min_start[r0:r1] = min_start
+        self._min_end[r0:r1] = min_end
+        self._text_offset[r0 * N_TEXT:r1 * N_TEXT] = text_offset
+        self._search_offset[r0:r1] = search_offset
+        self._text = self._text[:t0] + text + self._text[t1:]
+        self._search = self._search[:s0] + search + self._search[s1:]
+        self._holiday[yday] = bool(is_holiday)
+
+        d_rows = len(rows) - (r1 - r0)
+        d_text = len(text) - (t1 - t0)
+        d_search = len(search) - (s1 - s0)
+        if d_rows or d_text or d_search:
+            for i in range(yday + 1, self._n_yday + 1):
+                self._day_start[i] += d_rows
+                self._text_base[i] += d_text
+                self._search_base[i] += d_search
+
+        self.n_days += bool(rows) - (r1 > r0)
+        self._update_size()
+
+    def _find_days(self, literals: list, yday_from: int,
+                   yday_to: int) -> set:
+        """
+        検索用文字列に、全ての``literals``を含む日
+
+        日ごとに照合せず、期間全体の文字列プールを``str.find()``し、
+        見つかった位置の日を求め、次の日の先頭から探し直す。
+
+        Parameters
+        ----------
+        literals: list of str
+        yday_from, yday_to: int
+            期間 (両端を含む)
+
+        Returns
+        -------
+        ydays: set of int
+        """
+        search = self._search
+        sb = self._search_base
+        end = sb[yday_to + 1]
+
+        ydays = None
+        for literal in literals:
+            found = set()
+            pos = search.find(literal, sb[yday_from], end)
+            while pos >= 0:
+                yday = bisect.bisect_right(sb, pos, yday_from,
+                                           yday_to + 1) - 1
+                found.add(yday)
+                pos = search.find(literal, sb[yday + 1], end)
+
+            ydays = found if ydays is None else ydays & found
+            if not ydays:
+                break
+
+        return ydays
+
+    def scan(self, date_from: datetime.date, date_to: datetime.date,
+             match, factory, reverse: bool = False, dates=None,
+             literals=None):
+        """
+        期間内の、データがある日ごとに、条件に合う行のエンティティを生成する
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            期間 (両端を含む。``year``の範囲に切り詰める)
+        match: callable or None
+            match(search_str, date) -> bool
+            None: 全ての行
+        factory: callable
+            ``get_day()``と同じ
+        reverse: bool
+            True: 新しい日付から
+        dates: iterable of datetime.date
+            候補の日 (None: 全ての日)
+        literals: list of str or None
+            条件に合う検索用文字列に、必ず含まれる文字列
+            (``Query.required_literals()``)
+            含まない日は、文字列プールで先に求め、行ごとに照合しない
+            (``is_holiday``のため、空の``sde_list``で生成する)
+
+        Yields
+        ------
+        (date, is_holiday, sde_list): (datetime.date, bool, list)
+        """
+        yday_from = max(date_from.toordinal() - self._jan1, 0)
+        yday_to = min(date_to.toordinal() - self._jan1, self._n_yday - 1)
+        if yday_from > yday_to:
+            return
+
+        if dates is None:
+            ydays = range(yday_from, yday_to + 1)
+            if reverse:
+                ydays = reversed(ydays)
+        else:
+            ydays = sorted([d.toordinal() - self._jan1 for d in dates
+                            if d.year == self.year], reverse=reverse)
+            ydays = [y for y in ydays if yday_from <= y <= yday_to]
+
+        found = None
+        if literals and match is not None:
+            found = self._find_days(literals, yday_from, yday_to)
+
+        day_start = self._day_start
+        search = self._search
+        sb = self._search_base
+        so = self._search_offset
+
+        for yday in ydays:
+            (r0, r1) = (day_start[yday], day_start[yday + 1])
+            if r0 == r1:
+                continue
+
+            date = datetime.date.fromordinal(self._jan1 + yday)
+
+            if match is None:
+                rows = range(r0, r1)
+            elif found is not None and yday not in found:
+                rows = []
+            else:
+                rows = []
+                (b, pos) = (sb[yday], sb[yday])
+                for i in range(r0, r1):
+                    end = b + so[i]
+                    if match(search[pos:end], date):
+                        rows.append(i)
+                    pos = end
+
+            yield (date, bool(self._holiday[yday]),
+                   [self._mk_sde(i, r0, yday, date, factory) for i in rows])
@@ -0,0 +1,253 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+設定ファイル(``Conf.cgi``)のプロセス内のストア
+
+リクエストのたびに設定ファイルを読み書きしないように、
+一度読み込んだ内容を保持し、変更はまとめて書き込む。
+
+  get():  ファイルの mtime, size が変わっていなければ、保持している内容
+          (他のプロセスなどが書き換えた場合は、読み込み直す)
+  set():  保持している内容を変更し、最後の変更から``flush_delay``秒後に
+          まとめて書き込む (``flush()``)
+          ``flush_delay``が 0 の場合は、書き込んでから戻る
+          (複数のプロセスで動かす場合。次のリクエストを、
+          他のプロセスが処理しても、変更後の内容を読み込む)
+
+  Conf.cgi:
+      name1<tab>value1
+      :
+
+Notes
+-----
+* 書き込む時は、ファイルを読み直して、まだ書き込んでいない変更のみを
+  上書きする。(他のプロセスの変更を消さない)
+  読み直しから置き換えまでは、``fcntl.flock()``で、他のプロセスと排他する。
+* 書き込みは、一時ファイルに書いてから置き換える。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import fcntl
+import asyncio
+import tornado.ioloop
+from . import snapshot
+from .my_logger import get_logger
+
+
+class ConfStore:
+    """
+    設定ファイルのストア
+
+    Attributes
+    ----------
+    n_loads: int
+        ファイルを読み込んだ回数
+    n_writes: int
+        ファイルに書き込んだ回数
+    """
+    DEF_FLUSH_DELAY = 2.0  # sec
+
+    LOCK_EXT = '.lock'
+    TMP_EXT = '.tmp'
+
+    def __init__(self, pathname: str, flush_delay: float = DEF_FLUSH_DELAY,
+                 run=None, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        pathname: str
+        flush_delay: float
+            最後の変更から書き込むまでの秒数
+            (0: ``set()``で、すぐに書き込む)
+        run: coroutine function
+            ``run(func, *args)``: ファイルの読み書きを実行する
+            (``AsyncSchedData.run``: スレッドプールで)
+            None: IOLoop のスレッドで実行する
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('pathname=%s, flush_delay=%s',
+                          pathname, flush_delay)
+
+        self._pathname = pathname
+        self._flush_delay = flush_delay
+        self._run = run
+
+        self._conf = {}
+        self._key = None
+        self._loaded = False
+        self._dirty = {}
+        self._timeout = None
+        self._flush_lock = None
+
+        self.n_loads = 0
+        self.n_writes = 0
+
+    def __str__(self):
+        """ __str__ """
+        return 'conf:%s, dirty:%s, loads:%s, writes:%s' % (
+            len(self._conf), len(self._dirty), self.n_loads, self.n_writes)
+
+    async def _call(self, func, *args):
+        if self._run is None:
+            return func(*args)
+
+        return await self._run(func, *args)
+
+    def _stat_key(self):
+        try:
+            return snapshot.stat_key(os.stat(self._pathname))
+        except FileNotFoundError:
+            return None
+
+    def _read(self) -> (dict, tuple):
+        """
+        Returns
+        -------
+        (conf, key): (dict, tuple)
+            key: 読み込んだファイルの``snapshot.stat_key()``
+            (None: ファイルがない)
+        """
+        conf = {}
+        try:
+            with open(self._pathname) as f:
+                key = snapshot.stat_key(os.fstat(f.fileno()))
+                lines = f.readlines()
+        except FileNotFoundError:
+            return (conf, None)
+
+        for line in lines:
+            if '\t' not in line:
+                continue
+            (name, value) = line.rstrip('\n').split('\t', maxsplit=1)
+            conf[name] = value
+
+        return (conf, key)
+
+    def _merge_write(self, dirty: dict) -> (dict, tuple):
+        """
+        ファイルを読み直し、``dirty``を上書きして、書き込む
+
+        Returns
+        -------
+        (conf, key): (dict, tuple)
+            書き込んだ内容と、ファイルの``snapshot.stat_key()``
+        """
+        with open(self._pathname + self.LOCK_EXT, 'a') as lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+
+            (conf, _) = self._read()
+            conf.update(dirty)
+
+            tmp_pathname = self._pathname + self.TMP_EXT
+            with open(tmp_pathname, mode='w') as f:
+                for (name, value) in conf.items():
+                    f.write('%s\t%s\n' % (name, value))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_pathname, self._pathname)
+
+            return (conf, self._stat_key())
+
+    async def get(self) -> dict:
+        """
+        Returns
+        -------
+        conf: dict
+            {name: value} (まだ書き込んでいない変更を含む)
+        """
+        key = self._stat_key()
+        if not self._loaded or key != self._key:
+            (conf, key) = await self._call(self._read)
+            conf.update(self._dirty)
+            self._conf = conf
+            self._key = key
+            self._loaded = True
+            self.n_loads += 1
+            self._mylog.debug('loaded: %s', self)
+
+        return dict(self._conf)
+
+    async def set(self, name: str, value: str) -> None:
+        """
+        変更する (最後の変更から``flush_delay``秒後に書き込む)
+        (``flush_delay``が 0 の場合は、書き込んでから戻る)
+
+        Parameters
+        ----------
+        name: str
+        value: str
+        """
+        self._mylog.debug('name=%s, value=%a', name, value)
+
+        self._conf[name] = value
+        self._dirty[name] = value
+
+        if self._flush_delay <= 0:
+            await self.flush()
+            return
+
+        ioloop = tornado.ioloop.IOLoop.current()
+        if self._timeout is not None:
+            ioloop.remove_timeout(self._timeout)
+        self._timeout = ioloop.call_later(self._flush_delay, self._on_timeout)
+
+    def _on_timeout(self) -> None:
+        self._timeout = None
+        tornado.ioloop.IOLoop.current().spawn_callback(self.flush)
+
+    async def flush(self) -> bool:
+        """
+        まだ書き込んでいない変更を、書き込む
+
+        Returns
+        -------
+        result: bool
+            True: 書き込んだ
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return False
+
+            dirty = dict(self._dirty)
+            try:
+                (conf, key) = await self._call(self._merge_write, dirty)
+            except OSError as ex:
+                # 変更は保持したまま、次の変更の時に書き込む
+                self._mylog.warning('%s: %s', type(ex).__name__, ex)
+                return False
+
+            # 書き込んでいる間に、さらに変更されたものは残す
+            for (name, value) in dirty.items():
+                if self._dirty.get(name) == value:
+                    del self._dirty[name]
+
+            conf.update(self._dirty)
+            self._conf = conf
+            self._key = key
+            self.n_writes += 1
+
+        self._mylog.debug('flushed: %s', self)
+        return True
+
+    def flush_now(self) -> None:
+        """
+        まだ書き込んでいない変更を、すぐに書き込む (終了時用)
+        """
+        if self._timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+
+        if not self._dirty:
+            return
+
+        (self._conf, self._key) = self._merge_write(self._dirty)
+        self._dirty = {}
+        self.n_writes += 1
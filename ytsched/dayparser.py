@@ -0,0 +1,309 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+データファイル(1日分、または ToDo)の解析
+
+データファイルの1行:
+  ID<tab>YYYY/MM/DD<tab>HH:MM-HH:MM<tab>type<tab>title<tab>place<tab>detail
+
+Notes
+-----
+* 日付は、ファイルのパスから決まるので、各行の日付は解析しない。
+  (ToDoファイルの場合のみ、各行の日付を解析する)
+* 時刻は、一つのコンパイル済みパターンで「0時からの分」に変換し、
+  ``datetime.time``は共有の変換表から取得する。
+* 不正な行は、読み飛ばして報告する。(ページ全体を失敗させない)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+import datetime
+from . import htmlcodec
+
+N_FIELDS = 7
+
+_TIME_RE = re.compile(r'(?:(\d+):(\d+)|:)-(?:(\d+):(\d+)|:)$')
+_DATE_RE = re.compile(r'(\d+)/(\d+)/(\d+)$')
+
+MIN_NULL = -1
+""" 時刻なし """
+
+TIME_TBL = [datetime.time(m // 60, m % 60) for m in range(24 * 60)]
+""" 0時からの分 -> datetime.time """
+
+# ソートキー: 従来の文字列キー(``SchedDataEnt.get_sortkey()``)と同じ順序
+#   '  :  -  :  ' < 'HH:MM' < '33:33' < '99:99' < ':'
+KEY_NULL_HOLIDAY = -1
+KEY_NULL = 33 * 60 + 33
+KEY_NULL_PAREN = 99 * 60 + 99
+KEY_NONE = 10000
+
+
+def parse_time(time_str: str) -> (int, int):
+    """
+    'HH:MM-HH:MM'を解析する
+
+    Parameters
+    ----------
+    time_str: str
+        'HH:MM-HH:MM', ':-:', 'HH:MM-:', ':-HH:MM'
+
+    Returns
+    -------
+    (min_start, min_end): (int, int)
+        0時からの分。時刻なしは``MIN_NULL``
+
+    Raises
+    ------
+    ValueError
+    """
+    m = _TIME_RE.match(time_str)
+    if not m:
+        raise ValueError('invalid time: %a' % (time_str))
+
+    (h1, m1, h2, m2) = m.groups()
+
+    min_start = MIN_NULL
+    if h1:
+        min_start = int(h1) % 24 * 60 + int(m1) % 60
+
+    min_end = MIN_NULL
+    if h2:
+        min_end = int(h2) % 24 * 60 + int(m2) % 60
+
+    return (min_start, min_end)
+
+
+def min2time(minute: int):
+    """
+    Parameters
+    ----------
+    minute: int
+        0時からの分、または``MIN_NULL``
+
+    Returns
+    -------
+    t: datetime.time or ''
+    """
+    if minute < 0:
+        return ''
+    return TIME_TBL[minute]
+
+
+def time2min(t) -> int:
+    """
+    Parameters
+    ----------
+    t: datetime.time or ''
+
+    Returns
+    -------
+    minute: int
+        0時からの分、または``MIN_NULL``
+    """
+    if not t:
+        return MIN_NULL
+    return t.hour * 60 + t.minute
+
+
+def mk_sortkey(date: datetime.date, min_start: int, min_end: int,
+               sde) -> tuple:
+    """
+    ソートキー
+
+    Parameters
+    ----------
+    date: datetime.date
+    min_start, min_end: int
+    sde: SchedDataEnt
+        時刻がない場合のみ、``is_holiday()``と``title``を参照する
+
+    Returns
+    -------
+    key: (date, int, int)
+    """
+    if min_start < 0 and min_end < 0:
+        if sde.is_holiday():
+            return (date, KEY_NULL_HOLIDAY, KEY_NULL_HOLIDAY)
+        if sde.title.startswith('('):
+            return (date, KEY_NULL_PAREN, KEY_NULL_PAREN)
+        return (date, KEY_NULL, KEY_NULL)
+
+    if min_start < 0:
+        min_start = KEY_NONE
+    if min_end < 0:
+        min_end = KEY_NONE
+
+    return (date, min_start, min_end)
+
+
+def sortkey(sde) -> tuple:
+    """
+    ``SchedDataEnt``のソートキー
+
+    Notes
+    -----
+    ``SchedDataEnt.get_sortkey()``と同じ順序になるが、
+    ``strftime()``を使わない。
+    """
+    return mk_sortkey(sde.date,
+                      time2min(sde.time_start), time2min(sde.time_end), sde)
+
+
+def _parse_date(date_str: str, date_cache: dict) -> datetime.date:
+    """
+    'YYYY/MM/DD'を解析する
+
+    Raises
+    ------
+    ValueError
+    """
+    date = date_cache.get(date_str)
+    if date is None:
+        m = _DATE_RE.match(date_str)
+        if not m:
+            raise ValueError('invalid date: %a' % (date_str))
+        date = datetime.date(*map(int, m.groups()))
+        date_cache[date_str] = date
+
+    return date
+
+
+def field_offsets(line: str) -> tuple:
+    """
+    各フィールドの開始位置
+
+    Parameters
+    ----------
+    line: str
+
+    Returns
+    -------
+    offsets: tuple of int
+        フィールド i は ``line[offsets[i]:offsets[i + 1] - 1]``
+        (``N_FIELDS + 1``個)。フィールドが足りない場合は、それまでの分
+    """
+    offsets = [0]
+    pos = -1
+    for _ in range(N_FIELDS):
+        pos = line.find('\t', pos + 1)
+        if pos < 0:
+            break
+        offsets.append(pos + 1)
+
+    if len(offsets) == N_FIELDS:
+        offsets.append(len(line) + 1)
+
+    return tuple(offsets)
+
+
+def parse(lines: list, date: datetime.date, factory) -> (list, list):
+    """
+    解析して、ソート済みのエンティティのリストを生成する
+
+    Parameters
+    ----------
+    lines: list of str
+        変換済み(``htmlcodec.decode_lines()``)の行
+    date: datetime.date
+        ファイルの日付。None: ToDo (各行の日付を使う)
+    factory: callable
+        factory(sde_id, date, time_start, time_end,
+                sde_type, title, place, detail) -> SchedDataEnt
+
+    Returns
+    -------
+    (sde_list, errors): (list, list)
+        errors: [(line_number, reason, line), ..]
+    """
+    keyed = []
+    errors = []
+    date_cache = {}
+
+    for (i, line) in enumerate(lines, 1):
+        d = line.split('\t')
+
+        if len(d) < N_FIELDS:
+            if line.strip():
+                errors.append((i, 'too few fields', line))
+            continue
+
+        try:
+            (min_start, min_end) = parse_time(d[2])
+
+            date1 = date
+            if date1 is None:
+                date1 = _parse_date(d[1], date_cache)
+
+        except ValueError as ex:
+            errors.append((i, str(ex), line))
+            continue
+
+        sde = factory(d[0], date1, min2time(min_start), min2time(min_end),
+                      d[3], d[4], d[5], d[6])
+
+        keyed.append((mk_sortkey(date1, min_start, min_end, sde), sde))
+
+    keyed.sort(key=lambda x: x[0])
+
+    return ([sde for (key, sde) in keyed], errors)
+
+
+def parse_lazy(lines: list, date: datetime.date, factory) -> (list, list):
+    """
+    ``parse()``の遅延変換版。
+
+    変換前の行をそのまま渡し、フィールドの変換は行わない。
+    (時刻と、ToDoの日付だけは解析する)
+
+    Parameters
+    ----------
+    lines: list of str
+        変換前(``htmlcodec.split_lines()``)の行
+    date: datetime.date
+        ファイルの日付。None: ToDo (各行の日付を使う)
+    factory: callable
+        factory(line, offsets, date, min_start, min_end) -> SchedDataEnt
+
+    Returns
+    -------
+    (sde_list, errors): (list, list)
+        errors: [(line_number, reason, line), ..]
+    """
+    keyed = []
+    errors = []
+    date_cache = {}
+
+    for (i, line) in enumerate(lines, 1):
+        o = field_offsets(line)
+
+        if len(o) <= N_FIELDS:
+            if line.strip():
+                errors.append((i, 'too few fields', line))
+            continue
+
+        time_str = line[o[2]:o[3] - 1]
+        try:
+            try:
+                (min_start, min_end) = parse_time(time_str)
+            except ValueError:
+                (min_start, min_end) = parse_time(htmlcodec.decode(time_str))
+
+            date1 = date
+            if date1 is None:
+                date1 = _parse_date(
+                    htmlcodec.decode(line[o[1]:o[2] - 1]), date_cache)
+
+        except ValueError as ex:
+            errors.append((i, str(ex), line))
+            continue
+
+        sde = factory(line, o, date1, min_start, min_end)
+
+        keyed.append((mk_sortkey(date1, min_start, min_end, sde), sde))
+
+    keyed.sort(key=lambda x: x[0])
+
+    return ([sde for (key, sde) in keyed], errors)
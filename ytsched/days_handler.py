@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+DaysHandler
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import tornado.web
+from .main_handler import MainHandler
+from .query import Query, is_structured
+
+
+class DaysHandler(MainHandler):
+    """
+    日の範囲の断片 (無限スクロール用)
+
+      GET /ytsched/days?from=YYYY-MM-DD&to=YYYY-MM-DD[&date=YYYY-MM-DD]
+
+    ``from``から``to``までの日を``HTML_DAY``で描画して返す。
+    ``my.js``の``scrollHdr()``が、表示中のページの前後に追加する。
+
+    フィルター文字列と ToDo の表示日数は、設定ファイルの値を使う。
+    (検索モードでは、使わない)
+    """
+    MAX_DAYS = 62
+
+    async def get(self):
+        """ GET """
+        self._mylog.debug('request=%s', self.request)
+
+        try:
+            date_from = datetime.date.fromisoformat(self.get_argument('from'))
+            date_to = datetime.date.fromisoformat(self.get_argument('to'))
+
+            date = None
+            date_str = self.get_argument('date', None)
+            if date_str:
+                date = datetime.date.fromisoformat(date_str)
+
+        except ValueError as ex:
+            raise tornado.web.HTTPError(400, '%s' % (ex))
+
+        days = (date_to - date_from).days + 1
+        if not 0 < days <= self.MAX_DAYS:
+            raise tornado.web.HTTPError(
+                400, 'from=%s, to=%s: 1..%s days' % (
+                    date_from, date_to, self.MAX_DAYS))
+
+        self._mylog.debug('date_from=%s, date_to=%s, date=%s',
+                          date_from, date_to, date)
+
+        filter_str = self.get_conf(self.CONF_KEY_FILTER_STR) or ''
+        if not is_structured(filter_str):
+            filter_str = filter_str.lower()
+
+        todo_days_value = int(self.get_conf(self.CONF_KEY_TODO_DAYS) or
+                              self.DEF_TODO_DAYS)
+
+        if self.not_modified(date_from, date_to, date, filter_str,
+                             todo_days_value, self._sd.version(None),
+                             self._sd.range_version(date_from, date_to)):
+            return
+
+        query = Query(filter_str, debug=self._dbg)
+
+        (todo_sde, todo_today_sde) = await self.load_todo(
+            query, todo_days_value, date_from, date_to)
+        await self._sd.prefetch(date_from, date_to)
+
+        day_args = dict(url_prefix=self._url_prefix,
+                        today=datetime.date.today(),
+                        delta_day1=datetime.timedelta(1),
+                        date=date,
+                        modified_sde_id=None,
+                        filter_str=filter_str,
+                        search_str='',
+                        todo_days_value=todo_days_value,
+                        )
+
+        async for sched_ent in self.gen_sched(
+                date_from, date_to, query, None,
+                todo_sde, todo_today_sde, todo_days_value, reverse=False):
+            self.write(self.render_day(sched_ent, None, day_args))
+
+        self.finish()
@@ -17,7 +17,7 @@ class EditHandler(HandlerBase):
     """
     Web request handler
     """
-    def get(self, date=None, sde_id=None, todo_flag=False):
+    async def get(self, date=None, sde_id=None, todo_flag=False):
         """
         ``date``の優先順位
           1. Parameter
@@ -86,9 +86,9 @@ class EditHandler(HandlerBase):
 
         if sde_id:
             if todo_flag:
-                sdf = self._sd.get_sdf(None)
+                sdf = await self._sd.get_sdf(None)
             else:
-                sdf = self._sd.get_sdf(date)
+                sdf = await self._sd.get_sdf(date)
 
             sde = sdf.get_sde(sde_id)
 
@@ -111,9 +111,9 @@ class EditHandler(HandlerBase):
                     search_str=search_str,
                     )
 
-    def post(self):
+    async def post(self):
         """
         """
         self._mylog.debug('request.body_arguments=%s',
                           self.request.body_arguments)
-        self.get()
+        await self.get()
@@ -0,0 +1,139 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+描画済みの日ごとの HTML(``day.html``)のキャッシュ
+
+過去の日の HTML は、ほとんど変わらないので、
+ページを表示するたびに描画し直さないように、日ごとに保持する。
+
+  _cache = {  # LRU
+      date1: (version1, {variant1: html1, variant2: html2, ..}),
+      :
+  }
+
+  version: ``SchedData.version()``
+      日のバージョンが変わったら、その日の全ての HTML を捨てる
+  variant: tuple
+      同じ日の表示条件 (今日の日付、フィルター文字列など)
+
+Notes
+-----
+* ``SchedData.add_listener()``に``discard()``を登録すると、
+  変更された日は、すぐに捨てる。
+  (登録しなくても、バージョンが違うものは使わない)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import datetime
+import collections
+from .my_logger import get_logger
+
+
+class FragmentCache:
+    """
+    描画済みの日ごとの HTML の LRU キャッシュ
+
+    Attributes
+    ----------
+    n_hits, n_misses: int
+    """
+    DEF_SIZE = 5000
+    """ 日数 """
+
+    MAX_VARIANTS = 4
+    """ 1日あたりの表示条件の数 (古いものから捨てる) """
+
+    def __init__(self, size: int = DEF_SIZE, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        size: int
+            保持する日数
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('size=%s', size)
+
+        self._size = size
+        self._cache = collections.OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __str__(self):
+        """ __str__ """
+        return 'days:%s, hits:%s, misses:%s' % (
+            len(self._cache), self.n_hits, self.n_misses)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, date: datetime.date, version: int, variant: tuple):
+        """
+        Parameters
+        ----------
+        date: datetime.date
+        version: int
+            ``SchedData.version(date)``
+        variant: tuple
+
+        Returns
+        -------
+        html: bytes or None
+            None: キャッシュにない
+        """
+        ent = self._cache.get(date)
+        if ent is None or ent[0] != version:
+            self.n_misses += 1
+            return None
+
+        html = ent[1].get(variant)
+        if html is None:
+            self.n_misses += 1
+            return None
+
+        self._cache.move_to_end(date)
+        self.n_hits += 1
+        return html
+
+    def put(self, date: datetime.date, version: int, variant: tuple,
+            html: bytes) -> None:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+        version: int
+        variant: tuple
+        html: bytes
+        """
+        ent = self._cache.get(date)
+        if ent is None or ent[0] != version:
+            ent = (version, {})
+            self._cache[date] = ent
+
+        variants = ent[1]
+        if variant not in variants and len(variants) >= self.MAX_VARIANTS:
+            del variants[next(iter(variants))]
+        variants[variant] = html
+
+        self._cache.move_to_end(date)
+        while len(self._cache) > self._size:
+            self._cache.popitem(last=False)
+
+    def discard(self, date: datetime.date) -> None:
+        """
+        1日分を捨てる (``SchedData.add_listener()``用)
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo (ToDo を含む日は、バージョンで判定するので何もしない)
+        """
+        if date is not None:
+            self._cache.pop(date, None)
+
+    def clear(self) -> None:
+        """ 全て捨てる """
+        self._cache.clear()
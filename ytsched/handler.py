@@ -8,7 +8,9 @@ HandlerBase
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
-import os
+import hashlib
+import urllib.parse
+import datetime
 import tornado.web
 from .my_logger import get_logger
 
@@ -21,8 +23,12 @@ class HandlerBase(tornado.web.RequestHandler):
     CONF_KEY_SEARCH_STR = 'SearchStr'
     CONF_KEY_SEARCH_N = 'SearchN'
 
+    COOKIE_PREFIX = 'ytsched_'
+    COOKIE_EXPIRES_DAYS = 365
+
     HTML_MAIN = 'main.html'
     HTML_EDIT = 'edit.html'
+    HTML_DAY = 'day.html'
 
     def __init__(self, app, req):
         """ Constructor """
@@ -56,47 +62,79 @@ class HandlerBase(tornado.web.RequestHandler):
         self._sd = app.settings.get('sd')
         self._mylog.debug('sd=%s', self._sd)
 
-        self._conf_file = os.path.join(self._datadir, self.CONF_FNAME)
-        self._mylog.debug('conf_file=%s', self._conf_file)
+        self._stream = app.settings.get('stream')
+        self._mylog.debug('stream=%s', self._stream)
+
+        self._frag = app.settings.get('frag_cache')
+        self._mylog.debug('frag=%s', self._frag)
+
+        self._conf_store = app.settings.get('conf_store')
+        self._mylog.debug('conf_store=%s', self._conf_store)
 
-        self._conf = self.load_conf()
+        self._conf_cookie = app.settings.get('conf_cookie')
+        self._mylog.debug('conf_cookie=%s', self._conf_cookie)
+
+        self._conf = {}
 
         super().__init__(app, req)
 
-    def load_conf(self):
+    async def prepare(self):
         """
+        設定を取得する (設定ファイルが変更されていなければ、読み込まない)
+
+        ``conf_cookie``の場合は、クッキーの値を優先する
         """
-        self._mylog.debug('')
+        self._conf = await self._conf_store.get()
 
-        conf = {}
+        if self._conf_cookie:
+            for (name, morsel) in self.request.cookies.items():
+                if name.startswith(self.COOKIE_PREFIX):
+                    self._conf[name[len(self.COOKIE_PREFIX):]] = \
+                        urllib.parse.unquote(morsel.value)
 
-        try:
-            with open(self._conf_file) as f:
-                lines = f.readlines()
-        except FileNotFoundError:
-            return conf
-
-        for line in lines:
-            if line:
-                self._mylog.debug('line=%s', line)
-                (param, value) = line.split('\t', maxsplit=2)
-                value = value.rstrip('\n')
-                self._mylog.debug('%a,%a.', param, value)
-                conf[param] = value
-
-        return conf
-
-    def save_conf(self):
+    def not_modified(self, *keys) -> bool:
         """
+        ETag を設定し、クライアントのキャッシュが有効なら
+        304 Not Modified を返す
+
+        ETag は、``keys``と、起動ID・バージョン・今日の日付から生成する。
+        (``Cache-Control: no-cache``で、毎回、確認させる)
+
+        Parameters
+        ----------
+        keys:
+            表示内容を決める全ての値
+            (``SchedData.version()``, ``SchedData.range_version()``,
+            フィルター文字列など)
+
+        Returns
+        -------
+        result: bool
+            True: 304 を返した (描画する必要はない)
         """
-        self._mylog.debug('')
+        etag = hashlib.blake2b(repr(
+            (self._sd.boot_id, self._version, datetime.date.today()) + keys
+        ).encode(), digest_size=16).hexdigest()
+        self._mylog.debug('etag=%s, keys=%s', etag, keys)
 
-        with open(self._conf_file, mode='w') as f:
-            for p in self._conf:
-                f.write('%s\t%s\n' % (p, self._conf[p]))
+        self.set_header('Etag', '"%s"' % etag)
+        self.set_header('Cache-Control', 'no-cache')
+
+        if self.request.method not in ('GET', 'HEAD'):
+            return False
+        if not self.check_etag_header():
+            return False
+
+        self.set_status(304)
+        self.finish()
+        return True
 
     def get_conf(self, name):
         """
+        Returns
+        -------
+        value: str
+            None: 設定されていない
         """
         self._mylog.debug('name=%s', name)
 
@@ -105,9 +143,21 @@ class HandlerBase(tornado.web.RequestHandler):
         except KeyError:
             return None
 
-    def set_conf(self, name, value):
+    async def set_conf(self, name, value):
         """
+        設定を変更する
+
+        ``conf_cookie``の場合は、クッキーに保存する (ファイルに書き込まない)
+        そうでなければ、``ConfStore``に変更し、少し後にまとめて書き込む
+        (複数のプロセスで動かす場合は、すぐに書き込む)
         """
         self._mylog.debug('name=%s, value=\'%s\'', name, value)
         self._conf[name] = value
-        self.save_conf()
+
+        if self._conf_cookie:
+            self.set_cookie(self.COOKIE_PREFIX + name,
+                            urllib.parse.quote(value), path='/',
+                            expires_days=self.COOKIE_EXPIRES_DAYS)
+            return
+
+        await self._conf_store.set(name, value)
@@ -0,0 +1,150 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+HTML文字列 <-> テキスト の変換
+
+データファイルの各フィールドは、HTML文字列として保存されている。
+
+Notes
+-----
+全ての置換を一つのコンパイル済みパターンで、一回の走査で行う。
+``<BR>``の判定は、置換後の文字(``&lt;``, ``&gt;``, ``&nbsp;``など)
+も考慮するので、従来の逐次置換と同じ結果になる。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+
+# ``&nbsp;``だけは大文字・小文字を区別する (従来の``str.replace()``と同じ)
+_SPACE = r'(?: |&nbsp;|&(?i:amp;#160;|nbsp:|#160;))'
+
+# 先頭の先読みで、置換対象の先頭文字まで高速に読み飛ばす
+_PATTERN = re.compile(
+    r'(?=[&<（）])(?:'
+    r'(?P<br>(?:<|&(?i:lt);)(?i:br)' + _SPACE + r'*/*(?:>|&(?i:gt);))'
+    r'|(?P<sp>&nbsp;|&(?i:amp;#160;|nbsp:|#160;))'
+    r'|(?P<gt>&(?i:gt);)|(?P<lt>&(?i:lt);)|(?P<lp>（)|(?P<rp>）))')
+
+_DECODE_TBL = {
+    'br': '\n',
+    'sp': ' ',
+    'gt': '>',
+    'lt': '<',
+    'lp': '(',
+    'rp': ')',
+}
+""" パターンのグループ名 -> 置換文字列 """
+
+_ENCODE_TBL = str.maketrans({'\t': ' ', '\r': None, '\n': '<br />'})
+
+_LINE_MARK = '\0'
+""" 一括変換で、改行に変換される``<BR>``の仮の文字 """
+
+
+def _need_decode(intext: str) -> bool:
+    """
+    置換対象は、必ず'&', '<', '（', '）'のいずれかを含む
+    """
+    return ('&' in intext or '<' in intext
+            or '（' in intext or '）' in intext)
+
+
+def _repl(m) -> str:
+    return _DECODE_TBL[m.lastgroup]
+
+
+def _repl_mark(m) -> str:
+    if m.lastgroup == 'br':
+        return _LINE_MARK
+    return _DECODE_TBL[m.lastgroup]
+
+
+def decode(intext: str) -> str:
+    """
+    HTML文字列をテキストに変換する
+
+    Parameters
+    ----------
+    intext: str
+        HTML text
+
+    Returns
+    -------
+    outtext: str
+    """
+    if not _need_decode(intext):
+        return intext
+
+    return _PATTERN.sub(_repl, intext)
+
+
+def encode(intext: str) -> str:
+    """
+    テキストをHTML文字列に変換する
+
+    Parameters
+    ----------
+    intext: str
+        normal text string
+
+    Returns
+    -------
+    outtext: str
+        HTML text
+    """
+    return intext.rstrip('\n').translate(_ENCODE_TBL)
+
+
+def split_lines(intext: str) -> list:
+    """
+    ``readlines()``と同様に、行末の'\\n'を残して行に分割する
+
+    Parameters
+    ----------
+    intext: str
+
+    Returns
+    -------
+    lines: list of str
+    """
+    lines = [line + '\n' for line in intext.split('\n')]
+
+    last = lines.pop()
+    if last != '\n':
+        lines.append(last[:-1])
+
+    return lines
+
+
+def decode_lines(intext: str) -> list:
+    """
+    ファイル全体を一括して変換し、行に分割する
+
+    Notes
+    -----
+    ``[decode(line) for line in split_lines(intext)]``と同じ結果になる。
+
+    Parameters
+    ----------
+    intext: str
+        ファイル全体のHTML文字列
+
+    Returns
+    -------
+    lines: list of str
+    """
+    if _LINE_MARK in intext:
+        return [decode(line) for line in split_lines(intext)]
+
+    if _need_decode(intext):
+        intext = _PATTERN.sub(_repl_mark, intext)
+
+    lines = split_lines(intext)
+
+    if _LINE_MARK not in intext:
+        return lines
+
+    return [line.replace(_LINE_MARK, '\n') if _LINE_MARK in line else line
+            for line in lines]
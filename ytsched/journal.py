@@ -0,0 +1,325 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+変更のジャーナル (追記のみのログ)
+
+予定の追加・削除のたびに、日のデータファイル(特に、全ての ToDo を含む
+``ToDo.cgi``)を全て書き直さないように、変更を1行ずつ追記して``fsync()``する。
+(書き込みの時間は、データファイルの大きさによらない)
+
+  {"seq": 1, "ops": [[date, sde_id, line], ..]}
+  :
+
+  date: "YYYY-MM-DD" (null: ToDo)
+  line: ``SchedDataEnt.mk_dataline()`` (null: 削除)
+
+一つの変更(レコード)の``ops``は、順に「``sde_id``の予定を削除し、
+``line``があれば追加する」。同じ操作を何度行っても結果は変わらないので、
+既に反映済みのデータファイルに、もう一度適用してもよい。
+
+データファイルの内容は、ファイルの内容に、まだ反映していない
+レコード(``pending()``)を適用したもの。(``SchedData._new_sdf()``)
+
+  compact: ``plan()``で取り出したレコードを、データファイルに反映してから
+           (``SchedData.compact_days()``)、``truncate()``で捨てる。
+           (最後の番号は、空のレコード``{"seq": N, "ops": []}``で残す)
+
+Notes
+-----
+* 複数のプロセス(``--workers``)で共有する。
+  追記・圧縮は``fcntl.flock()``で排他し、番号(``seq``)は全体で通しにする。
+  圧縮でファイルが置き換えられた(inode が変わった)場合は、全て読み直す。
+* 書き込み途中で終了した、最後の不完全な行は、開く時に捨てる。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import json
+import fcntl
+import datetime
+import threading
+import contextlib
+from .my_logger import get_logger
+
+DEF_FILENAME = '.ytsched.journal'
+
+
+class Journal:
+    """
+    変更のジャーナル
+
+    Attributes
+    ----------
+    n_appends: int
+        このプロセスで追記したレコード数
+    """
+    TMP_EXT = '.tmp'
+
+    def __init__(self, pathname: str, debug=False):
+        """ Constructor
+
+        ファイルがなければ作り、あれば、まだ反映していないレコードを読み込む
+
+        Parameters
+        ----------
+        pathname: str
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('pathname=%s', pathname)
+
+        self._pathname = pathname
+        self._lock = threading.RLock()
+
+        self._pending = {}
+        self._seq = 0
+        self._ino = None
+        self._offset = 0
+        self.n_appends = 0
+
+        with self._lock, self._locked() as f:
+            size = os.fstat(f.fileno()).st_size
+            with open(self._pathname, 'rb') as f1:
+                data = f1.read()
+            end = data.rfind(b'\n') + 1
+            if end < size:
+                self._mylog.warning('%s: incomplete record (%s bytes)'
+                                    ' .. discarded', pathname, size - end)
+                os.ftruncate(f.fileno(), end)
+
+            self._read_new()
+
+    def __str__(self):
+        """ __str__ """
+        return 'seq:%s, days:%s, appends:%s' % (
+            self._seq, len(self._pending), self.n_appends)
+
+    def __len__(self):
+        """ まだ反映していないレコードのある日数 """
+        return len(self._pending)
+
+    @contextlib.contextmanager
+    def _locked(self, operation=fcntl.LOCK_EX):
+        """
+        ジャーナルファイルをロックする (追記用に開く)
+        (ロックを待つ間に、圧縮で置き換えられた場合は、開き直す)
+        """
+        while True:
+            f = open(self._pathname, 'ab')
+            fcntl.flock(f, operation)
+            try:
+                if os.fstat(f.fileno()).st_ino == \
+                   os.stat(self._pathname).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+
+        try:
+            yield f
+        finally:
+            f.close()
+
+    @staticmethod
+    def _str2date(date_str: str) -> datetime.date:
+        return datetime.date.fromisoformat(date_str) if date_str else None
+
+    def _add_pending(self, rec: dict) -> list:
+        date_list = []
+        for (date_str, sde_id, line) in rec['ops']:
+            date = self._str2date(date_str)
+            self._pending.setdefault(date, []).append(
+                (rec['seq'], sde_id, line))
+            date_list.append(date)
+
+        self._seq = max(self._seq, rec['seq'])
+        return date_list
+
+    def _read_new(self) -> list:
+        """
+        他のプロセスが追記したレコードを読み込む
+        (ロックして呼ぶこと)
+
+        Returns
+        -------
+        date_list: list
+            読み込んだレコードの日
+        """
+        st = os.stat(self._pathname)
+        if st.st_ino != self._ino:
+            # 圧縮された: 全て読み直す
+            self._ino = st.st_ino
+            self._offset = 0
+            self._pending = {}
+
+        if st.st_size <= self._offset:
+            return []
+
+        with open(self._pathname, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+
+        date_list = []
+        for line in data.decode('utf-8').splitlines():
+            try:
+                date_list += self._add_pending(json.loads(line))
+            except (ValueError, KeyError, TypeError) as ex:
+                self._mylog.warning('%s: %s: %a .. skipped',
+                                    type(ex).__name__, ex, line)
+
+        return date_list
+
+    def refresh(self) -> list:
+        """
+        他のプロセスが追記したレコードを読み込む
+        (追記・圧縮されていなければ、``os.stat()``のみ)
+
+        Returns
+        -------
+        date_list: list
+            読み込んだレコードの日
+        """
+        with self._lock:
+            try:
+                st = os.stat(self._pathname)
+                if st.st_ino == self._ino and st.st_size == self._offset:
+                    return []
+            except FileNotFoundError:
+                pass
+
+            with self._locked(fcntl.LOCK_SH):
+                return self._read_new()
+
+    def append(self, ops: list) -> int:
+        """
+        一つの変更を、1行で追記して``fsync()``する
+        (別スレッドから呼んでもよい)
+
+        Parameters
+        ----------
+        ops: list of (date, sde_id, line)
+            date: datetime.date (None: ToDo)
+            line: str (None: 削除)
+
+        Returns
+        -------
+        seq: int
+        """
+        with self._lock, self._locked() as f:
+            self._read_new()
+
+            rec = {'seq': self._seq + 1,
+                   'ops': [[date.isoformat() if date else None, sde_id, line]
+                           for (date, sde_id, line) in ops]}
+            data = (json.dumps(rec, ensure_ascii=False) + '\n').encode(
+                'utf-8')
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+            self._offset += len(data)
+            self._add_pending(rec)
+            self.n_appends += 1
+
+        return rec['seq']
+
+    def dates(self) -> list:
+        """
+        Returns
+        -------
+        date_list: list
+            まだ反映していないレコードのある日 (None: ToDo)
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def pending(self, date: datetime.date = None) -> list:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+
+        Returns
+        -------
+        ops: list of (seq, sde_id, line)
+            まだ反映していない、``date``の操作 (順番どおり)
+        """
+        with self._lock:
+            return list(self._pending.get(date, ()))
+
+    @staticmethod
+    def apply(sdf, ops: list) -> None:
+        """
+        操作を、データファイルの内容に適用する
+
+        Parameters
+        ----------
+        sdf: SchedDataFile
+        ops: list of (seq, sde_id, line)
+            ``pending()``
+        """
+        for (_, sde_id, line) in ops:
+            sdf.del_sde(sde_id)
+            if line is not None:
+                for sde in sdf.parse_text(line + '\n'):
+                    sdf.add_sde(sde)
+
+    def plan(self) -> (int, dict):
+        """
+        圧縮する(データファイルに反映する)レコードを取り出す
+
+        Returns
+        -------
+        (seq, days): (int, dict)
+            seq: 取り出した最後のレコードの番号 (``truncate()``に渡す)
+            days: {date: ops}
+        """
+        with self._lock:
+            with self._locked(fcntl.LOCK_SH):
+                self._read_new()
+
+            return (self._seq, {date: list(ops) for (date, ops)
+                                in self._pending.items()})
+
+    def truncate(self, seq: int) -> int:
+        """
+        データファイルに反映したレコード(番号が``seq``以下)を捨てる
+        (一時ファイルに書いて、置き換える)
+
+        Returns
+        -------
+        n_records: int
+            残ったレコード数
+            (番号を引き継ぐための、空のレコードを含まない)
+        """
+        with self._lock, self._locked() as f:
+            self._read_new()
+
+            with open(self._pathname, 'rb') as f1:
+                lines = f1.read().splitlines(keepends=True)
+
+            # 番号を振り直さないように、最後の番号を残す
+            keep = [(json.dumps({'seq': seq, 'ops': []}) + '\n').encode()]
+            for line in lines:
+                try:
+                    if json.loads(line)['seq'] > seq:
+                        keep.append(line)
+                except (ValueError, KeyError, TypeError):
+                    pass
+
+            tmp_pathname = self._pathname + self.TMP_EXT
+            with open(tmp_pathname, 'wb') as f1:
+                f1.writelines(keep)
+                f1.flush()
+                os.fsync(f1.fileno())
+            os.replace(tmp_pathname, self._pathname)
+
+            # 置き換えたファイルを読み直す (他のプロセスも同様)
+            self._read_new()
+
+        return len(keep) - 1
@@ -8,11 +8,29 @@ MainHandler
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
-import re
 import math
+import asyncio
+import functools
+import itertools
 import datetime
+import tornado.ioloop
 from .handler import HandlerBase
 from .ytsched import SchedDataEnt
+from .query import Query, is_structured
+from . import dayparser
+
+
+async def _next_or_none(it):
+    """
+    Returns
+    -------
+    item: any
+        async iterator の次の要素 (None: 終わり)
+    """
+    try:
+        return await it.__anext__()
+    except StopAsyncIteration:
+        return None
 
 
 def days2y_offset(days: float) -> int:
@@ -88,15 +106,18 @@ class MainHandler(HandlerBase):
 
     COOKIE_TODO_DAYS = "todo_days"
 
-    def post(self):
+    STREAM_MARK = '<!-- ytsched:stream -->'
+    STREAM_CHUNK_DAYS = 7
+
+    async def post(self):
         """ POST """
         self._mylog.debug('request=%s', self.request.__dict__)
         self._mylog.debug('request.body_arguments=%s',
                           self.request.body_arguments)
 
-        self.get()
+        await self.get()
 
-    def get(self):
+    async def get(self):
         """ GET method and rendering """
         self._mylog.debug('request=%s', self.request)
         self._mylog.debug('request.path=%s', self.request.path)
@@ -110,7 +131,7 @@ class MainHandler(HandlerBase):
         search_str = self.get_argument('search_str', None)
         if search_str:
             if search_str != search_str0:
-                self.set_conf(self.CONF_KEY_SEARCH_STR, search_str)
+                await self.set_conf(self.CONF_KEY_SEARCH_STR, search_str)
             else:
                 pass
 
@@ -130,12 +151,12 @@ class MainHandler(HandlerBase):
         modified_date = None
         modified_sde_id = None
         if cmd in ['add', 'fix', 'update', 'del']:
-            modified_date, modified_sde_id = self.exec_update(cmd)
+            modified_date, modified_sde_id = await self.exec_update(cmd)
             self._mylog.debug('modified_date=%s, modified_sde_id=%s',
                               modified_date, modified_sde_id)
 
             if cmd not in ['del']:
-                sdf = self._sd.get_sdf(modified_date)
+                sdf = await self._sd.get_sdf(modified_date)
                 sde = sdf.get_sde(modified_sde_id)
                 self._mylog.debug('sde=%s', sde)
 
@@ -202,7 +223,7 @@ class MainHandler(HandlerBase):
         todo_days_value = self.get_argument('todo_days', None)
         if todo_days_value:
             if todo_days_value != todo_days_value0:
-                self.set_conf(self.CONF_KEY_TODO_DAYS, todo_days_value)
+                await self.set_conf(self.CONF_KEY_TODO_DAYS, todo_days_value)
             else:
                 pass
 
@@ -233,7 +254,7 @@ class MainHandler(HandlerBase):
         self._mylog.debug('filter_str=%a', filter_str)
         if filter_str:
             if filter_str != filter_str0:
-                self.set_conf(self.CONF_KEY_FILTER_STR, filter_str)
+                await self.set_conf(self.CONF_KEY_FILTER_STR, filter_str)
             else:
                 pass
 
@@ -243,7 +264,9 @@ class MainHandler(HandlerBase):
         else:
             filter_str = ''
 
-        filter_str = filter_str.lower()
+        if not is_structured(filter_str):
+            # クエリーの``AND``, ``OR``, ``NOT``は、大文字のまま
+            filter_str = filter_str.lower()
         self._mylog.debug('filter_str=%a', filter_str)
 
         #
@@ -254,7 +277,7 @@ class MainHandler(HandlerBase):
         self._mylog.debug('search_str=\'%s\'', search_str)
         if search_str is not None:
             if search_str != search_str0:
-                self.set_conf(self.CONF_KEY_SEARCH_STR, search_str)
+                await self.set_conf(self.CONF_KEY_SEARCH_STR, search_str)
             else:
                 pass
 
@@ -263,9 +286,16 @@ class MainHandler(HandlerBase):
         else:
             search_str = ''
 
-        search_str = search_str.lower()
+        if not is_structured(search_str):
+            search_str = search_str.lower()
         self._mylog.debug('search_str=\'%s\'', search_str)
 
+        query = Query(filter_str, search_str, debug=self._dbg)
+
+        if cmd in ['add', 'fix', 'del'] and self._frag is not None:
+            # 次に表示される今日の周辺を、描画し直しておく
+            self.warm_today(filter_str, todo_days_value)
+
         #
         # search_n
         #
@@ -273,7 +303,7 @@ class MainHandler(HandlerBase):
         search_n_str = self.get_argument('search_n', None)
         if search_n_str is not None:
             if search_n_str != search_n_str0:
-                self.set_conf(self.CONF_KEY_SEARCH_N, search_n_str)
+                await self.set_conf(self.CONF_KEY_SEARCH_N, search_n_str)
             else:
                 pass
 
@@ -288,59 +318,15 @@ class MainHandler(HandlerBase):
         #
         # load ToDo
         #
-        today = datetime.date.today()
-
-        todo_sdf = self._sd.get_sdf(None)
-        todo_sde = []  # 後に、日々のスケジュール`out_sde`に統合
-        todo_today_sde = []  # 期限は先だが、今日に表示すべきToDo
-        for sde in todo_sdf.sde:
-            try:
-                if filter_str.startswith('!'):
-                    if re.search(filter_str[1:], sde.search_str()):
-                        continue
-
-                else:
-                    if not re.search(filter_str, sde.search_str()):
-                        continue
-
-            except re.error as ex:
-                self._mylog.warning(
-                    '%s:%s:%s:%s',
-                    type(ex).__name__, ex,
-                    filter_str, sde.search_str())
-                continue
-
-            if search_str:
-                try:
-                    if not re.search(search_str, sde.search_str()):
-                        continue
-
-                except re.error as ex:
-                    self._mylog.warning(
-                        '%s:%s:%s:%s',
-                        type(ex).__name__, ex,
-                        search_str, sde.search_str())
-                    continue
-
-            todo_sde.append(sde)
-            self._mylog.debug('sde=%s', sde)
-
-            if sde.date > today + datetime.timedelta(todo_days_value):
-                continue
-
-            if sde.date == today:
-                continue
-
-            todo_today_sde.append(sde)
-            self._mylog.debug('sde=%s', sde)
+        await self._sd.get_sdf(None)
 
         #
         # load schedule data
         #
-        sched = []
         date_from = date - datetime.timedelta(self._days)
         date_to = date + datetime.timedelta(self._days - 1)
 
+        candidates = None
         if search_str:
             date_from = date - datetime.timedelta(
                 self.SEARCH_MODE_MAX_DAYS)
@@ -348,122 +334,472 @@ class MainHandler(HandlerBase):
                 self.SEARCH_MODE_DAYS)
             date_to = date
 
-        search_count = 0
+            # ``before:``, ``after:``
+            (bound_from, bound_to) = query.date_bounds()
+            if bound_to is not None and bound_to < date_to:
+                date_to = bound_to
+            if bound_from is not None:
+                date_from = date_from1 = bound_from
+
+            # インデックスで候補の日を絞り込める場合は、全期間を検索する
+            candidates = self._sd.search_dates(query.required_literals())
+            if candidates is not None and bound_from is None:
+                # ToDo は期限順なので、最初に一致したものが最も古い
+                todo_first = next(
+                    (sde for sde in self._sd.todo_range(None, date_to)
+                     if query.match_sde(sde)), None)
+                date_from = min(
+                    [date_from] +
+                    [d for d in candidates if d <= date_to] +
+                    ([todo_first.date] if todo_first else []))
+                self._mylog.debug('candidates: %s days, date_from=%s',
+                                  len(candidates), date_from)
+
+        #
+        # 表示する範囲の日と ToDo が変更されていなければ、304
+        #
+        if self.not_modified(date, date_from, date_to, sde_align,
+                             modified_sde_id, filter_str, search_str,
+                             search_n, todo_days_value, self._stream,
+                             self._sd.version(None),
+                             self._sd.range_version(date_from, date_to)):
+            return
+
+        # 表示する範囲のデータを、先に読み込んでおく (スレッドプールで)
+        # (検索モードでは、見つかり次第止めるので、``gen_sched()``の中で
+        # 月ごとに読み込む)
+        if not search_str:
+            await self._sd.prefetch(date_from, date_to)
+
+        (todo_sde, todo_today_sde) = await self.load_todo(
+            query, todo_days_value, date_from, date_to)
+
         delta_day1 = datetime.timedelta(1)
-        date1 = date_to + delta_day1
-        while date1 > date_from:
-            if search_str and search_count > 0:
-                if search_count >= search_n:
-                    date_from = date1
-                    break
+        self._date_from = date_from
+
+        render_args = dict(title=self._title,
+                           author=self._author,
+                           version=self._version,
+                           url_prefix=self._url_prefix,
+
+                           today=datetime.date.today(),
+                           delta_day1=delta_day1,
+                           date=date,
+                           date_to=date_to,
+                           modified_sde_id=modified_sde_id,
+                           todo_days_list=self.TODO_DAYS,
+                           todo_days_value=todo_days_value,
+                           filter_str=filter_str,
+                           search_str=search_str,
+                           search_n=search_n,
+                           sde_align=sde_align,
+                           sd=self._sd,
+                           gage=GAGE,
+                           )
+
+        sched_args = (query, candidates,
+                      todo_sde, todo_today_sde, todo_days_value)
+
+        if search_str:
+            # 新しい日付から順に、見つかり次第
+            parts = [(1, True, self.gen_sched(
+                date_from, date_to, *sched_args,
+                search_n=search_n, date_from1=date_from1))]
+        else:
+            # 目的の日に近い方から
+            forward = (2, False, self.gen_sched(
+                date, date_to, *sched_args, reverse=False))
+            backward = (1, True, self.gen_sched(
+                date_from, date - delta_day1, *sched_args))
+            if sde_align == 'bottom':
+                parts = [backward, forward]
+            else:
+                parts = [forward, backward]
+
+        if self._stream:
+            await self.render_stream(render_args, date_from, parts)
+            return
+
+        sched = []
+        for (_, reverse, sched_iter) in sorted(parts, key=lambda p: p[0]):
+            part = [sched_ent async for sched_ent in sched_iter]
+            if reverse:
+                part = part[::-1]
+            sched += part
+
+        # 検索モードでは、各年の最初の日に年を表示する
+        days_html = []
+        year = 0
+        for sched_ent in sched:
+            year_header = None
+            if search_str and sched_ent['date'].year != year:
+                year = year_header = sched_ent['date'].year
+            days_html.append(
+                self.render_day(sched_ent, year_header, render_args))
+
+        #
+        # render
+        #
+        self.render(self.HTML_MAIN,
+                    date_from=self._date_from,
+                    days_html=days_html,
+                    stream=None,
+                    **render_args)
+
+    async def load_todo(self, query: Query, todo_days_value: int,
+                        date_from: datetime.date,
+                        date_to: datetime.date) -> (list, list):
+        """
+        期限順のインデックス(``SchedData.todo_range()``)で、
+        必要な範囲の ToDo のみを、条件と照合する
+
+        Parameters
+        ----------
+        query: Query
+        todo_days_value: int
+            負: ToDo を表示しない
+        date_from, date_to: datetime.date
+            表示する期間
+
+        Returns
+        -------
+        todo_sde: list of SchedDataEnt
+            期限が期間内で、条件に一致する ToDo (期限順)
+            (後に、日々のスケジュールに統合)
+        todo_today_sde: list of SchedDataEnt
+            期限は先だが、今日に表示すべき ToDo
+        """
+        if todo_days_value < 0:
+            return ([], [])
+
+        today = datetime.date.today()
+
+        await self._sd.get_sdf(None)
+        todo_sde = [sde for sde in self._sd.todo_range(date_from, date_to)
+                    if query.match_sde(sde)]
+
+        todo_today_sde = [
+            sde for sde in self._sd.todo_range(
+                None, today + datetime.timedelta(todo_days_value))
+            if sde.date != today and query.match_sde(sde)]
+        self._mylog.debug('todo_sde=%s, todo_today_sde=%s',
+                          len(todo_sde), len(todo_today_sde))
+
+        return (todo_sde, todo_today_sde)
+
+    async def gen_sched(self, date_from, date_to, query, candidates,
+                        todo_sde, todo_today_sde, todo_days_value,
+                        search_n=None, date_from1=None, reverse=True):
+        """
+        日ごとの表示内容
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+        query: Query
+        candidates: set of datetime.date or None
+            ``SchedData.search_dates()``
+        todo_sde: list of SchedDataEnt
+            条件に一致する ToDo (期限順: ``load_todo()``)
+        todo_today_sde: list of SchedDataEnt
+            期限は先だが、今日に表示すべき ToDo
+        todo_days_value: int
+        search_n: int
+            None: 検索モードではない
+            検索モード: 見つかった件数が``search_n``以上になるか、
+            ``date_from1``まで遡ったら、そこで止める
+        date_from1: datetime.date
+        reverse: bool
+
+        Yields
+        ------
+        sched_ent: dict
+            {'date': datetime.date, 'is_holiday': bool, 'sde': list}
+            検索モードでは、見つかった日のみ
+            (async generator)
+
+        Notes
+        -----
+        検索モードで止めた場合は、``self._date_from``を、その日にする。
+        (``AsyncSchedData.iter_range()``も、``search_n``件で止め、
+        その先の月は読み込まない)
+        """
+        days = self._sd.iter_range(date_from, date_to, reverse=reverse,
+                                   query=query, limit=search_n,
+                                   dates=candidates)
+        day1 = await _next_or_none(days)
+
+        # 期限ごとにまとめ、日の順に一つずつ統合する (同じ日の中は元の順)
+        todo_groups = []
+        if todo_days_value >= 0:
+            todo_groups = [
+                (d, list(g)) for (d, g) in itertools.groupby(
+                    [sde for sde in todo_sde
+                     if date_from <= sde.date <= date_to],
+                    key=lambda sde: sde.date)]
+            if reverse:
+                todo_groups.reverse()
+        todo_i = 0
+
+        search_count = 0
+        step = datetime.timedelta(1)
+        if reverse:
+            step = -step
+            date1 = date_to - step
+        else:
+            date1 = date_from - step
 
-                if date1 <= date_from1:
-                    date_from = date1
+        while (date1 > date_from) if reverse else (date1 < date_to):
+            if search_n is not None and search_count > 0:
+                if search_count >= search_n or date1 <= date_from1:
+                    self._date_from = date1
                     break
 
-            date1 -= delta_day1
+            if search_n is not None and reverse and day1 is None and \
+                    todo_i >= len(todo_groups):
+                # 残りの日には、見つかるものがない
+                # (見つかっていれば、``date_from1``で止まるはずだった)
+                if search_count > 0:
+                    self._date_from = date_from1
+                break
 
-            sdf = self._sd.get_sdf(date1)
+            date1 += step
 
+            is_holiday = False
             out_sde = []
-            for sde in sdf.sde:
-                # self._mylog.debug('sde=%s', sde)
-                if filter_str.startswith('!'):
-                    try:
-                        if re.search(filter_str[1:],
-                                      sde.search_str()):
-                            continue
-                    except re.error as ex:
-                        self._mylog.warning(
-                            '%s:%s:%s:%s',
-                            type(ex).__name__, ex,
-                            filter_str, sde.search_str())
-                        continue
-                else:
-                    try:
-                        if not re.search(filter_str, sde.search_str()):
-                            continue
-                    except re.error as ex:
-                        self._mylog.warning(
-                            '%s:%s:%s:%s',
-                            type(ex).__name__, ex,
-                            filter_str, sde.search_str())
-                        continue
-
-                if search_str:
-                    if sde.date == datetime.date(2021, 3, 1):
-                        self._mylog.debug('sde.search_str()=%s',
-                                          sde.search_str())
-                    try:
-                        if not re.search(search_str, sde.search_str()):
-                            continue
-                    except re.error as ex:
-                        self._mylog.warning(
-                            '%s:%s:%s:%s',
-                            type(ex).__name__, ex,
-                            search_str, sde.search_str())
-                        continue
-
-                out_sde.append(sde)
-                search_count += 1
+            if day1 and day1[0] == date1:
+                (_, is_holiday, out_sde) = day1
+                day1 = await _next_or_none(days)
+
+            search_count += len(out_sde)
 
             if todo_days_value >= 0:
                 # todo_sde
-                for sde in todo_sde:
-                    if search_str:
-                        if not re.search(search_str, sde.search_str()):
-                            continue
-
-                    if sde.date == date1:
-                        out_sde.append(sde)
-                        self._mylog.debug('out_sde.append:%s', sde)
+                if todo_i < len(todo_groups) and \
+                        todo_groups[todo_i][0] == date1:
+                    out_sde += todo_groups[todo_i][1]
+                    todo_i += 1
 
                 # todo_today_sde
-                if not search_str:
+                if search_n is None:
                     if date1 == datetime.date.today():
                         for sde in todo_today_sde:
                             out_sde.append(sde)
 
-            if search_str and not out_sde:
+            if search_n is not None and not out_sde:
                 continue
 
-            out_sde = sorted(out_sde, key=lambda x: x.get_sortkey())
-
-            sched.append({
+            yield {
                 'date': date1,
-                'is_holiday': sdf.is_holiday,
-                'sde': out_sde
-            })
+                'is_holiday': is_holiday,
+                'sde': sorted(out_sde, key=dayparser.sortkey)
+            }
 
-        sched = sched[::-1]
+    async def render_stream(self, render_args: dict,
+                            date_from: datetime.date, parts: list) -> None:
+        """
+        ``HTML_MAIN``を、分割して送る
 
-        #
-        # render
-        #
-        self.render(self.HTML_MAIN,
-                    title=self._title,
-                    author=self._author,
-                    version=self._version,
-                    url_prefix=self._url_prefix,
-
-                    today=datetime.date.today(),
-                    delta_day1=delta_day1,
-                    date=date,
-                    date_from=date_from,
-                    date_to=date_to,
-                    sched=sched,
-                    modified_sde_id=modified_sde_id,
-                    todo_days_list=self.TODO_DAYS,
-                    todo_days_value=todo_days_value,
-                    filter_str=filter_str,
-                    search_str=search_str,
-                    search_n=search_n,
-                    sde_align=sde_align,
-                    sd=self._sd,
-                    gage=GAGE,
-                    )
-
-    def exec_update(self, cmd: str) -> (datetime.date, str):
+        ヘッダー(検索バーなど)を先に送り、
+        各部分の日を``HTML_DAY``で描画して、少しずつ送る。
+        (送った順と表示順が逆の部分は、``column-reverse``で並べる)
+
+        Parameters
+        ----------
+        render_args: dict
+        date_from: datetime.date
+            最初に送る時点での値 (検索モードでは、最後に確定する)
+        parts: list of (order, reverse, sched_iter)
+            order: int
+                表示する順
+            reverse: bool
+                新しい日付から送る
+            sched_iter: async iterator
+                ``gen_sched()``
+        """
+        stream = [(order, reverse) for (order, reverse, _) in parts]
+        mark = self.STREAM_MARK.encode()
+
+        page = self.render_string(self.HTML_MAIN,
+                                  date_from=date_from, days_html=[],
+                                  stream=stream, stream_mark=self.STREAM_MARK,
+                                  **render_args)
+        chunks = page.split(mark)
+
+        self.write(chunks[0])
+        await self.flush()
+
+        search_mode = bool(render_args['search_str'])
+
+        for (i, (_, reverse, sched_iter)) in enumerate(parts):
+            buf = []
+            year = 0
+            async for sched_ent in sched_iter:
+                # 年の区切りは、その年の最後に送った(最も古い)日の次
+                year_header = None
+                sched_year = sched_ent['date'].year
+                if search_mode:
+                    if year and sched_year != year:
+                        year_header = year
+                    year = sched_year
+
+                buf.append(self.render_day(sched_ent, year_header,
+                                           render_args))
+
+                if search_mode or len(buf) >= self.STREAM_CHUNK_DAYS:
+                    self.write(b''.join(buf))
+                    await self.flush()
+                    buf = []
+
+            if year:
+                buf.append(self.render_day(None, year, render_args))
+
+            if i == len(parts) - 1 and self._date_from != date_from:
+                # 検索した期間が確定した
+                page = self.render_string(self.HTML_MAIN,
+                                          date_from=self._date_from,
+                                          days_html=[],
+                                          stream=stream,
+                                          stream_mark=self.STREAM_MARK,
+                                          **render_args)
+                chunks = page.split(mark)
+
+            buf.append(chunks[i + 1])
+            self.write(b''.join(buf))
+            await self.flush()
+
+        self.finish()
+
+    def render_day(self, sched_ent: dict, year_header: int,
+                   day_args: dict, render=None) -> bytes:
+        """
+        1日分を``HTML_DAY``で描画する
+
+        描画結果は``FragmentCache``に保持し、
+        日のバージョンと表示条件が同じなら、それを使う。
+
+        Parameters
+        ----------
+        sched_ent: dict
+            ``gen_sched()``
+            None: ``year_header``のみ
+        year_header: int
+        day_args: dict
+            テンプレートの引数
+            (``today``, ``date``, ``filter_str``, ``search_str``,
+            ``todo_days_value``, ``modified_sde_id``, ..)
+        render: callable
+            render(**kwargs) -> bytes
+            None: ``render_string(HTML_DAY, ..)``
+
+        Returns
+        -------
+        html: bytes
+        """
+        if render is None:
+            render = functools.partial(self.render_string, self.HTML_DAY)
+
+        if sched_ent is None or self._frag is None:
+            return render(sched_ent=sched_ent, year_header=year_header,
+                          **day_args)
+
+        date1 = sched_ent['date']
+        modified_sde_id = day_args['modified_sde_id']
+
+        # ToDo や、更新されたスケジュールを含む日だけ、それにも依存する
+        todo_version = None
+        modified = None
+        for sde in sched_ent['sde']:
+            if sde.is_todo():
+                todo_version = self._sd.version(None)
+            if sde.sde_id == modified_sde_id:
+                modified = modified_sde_id
+
+        version = self._sd.version(date1)
+        variant = (day_args['today'], day_args['filter_str'],
+                   day_args['search_str'], day_args['todo_days_value'],
+                   date1 == day_args['date'], year_header,
+                   todo_version, modified)
+
+        html = self._frag.get(date1, version, variant)
+        if html is None:
+            html = render(sched_ent=sched_ent, year_header=year_header,
+                          **day_args)
+            self._frag.put(date1, version, variant, html)
+
+        return html
+
+    def warm_today(self, filter_str: str, todo_days_value: int) -> None:
+        """
+        今日の周辺を、バックグラウンドで描画して``FragmentCache``に入れておく
+        (編集後、次の表示を速くする)
+
+        Parameters
+        ----------
+        filter_str: str
+        todo_days_value: int
+
+        Notes
+        -----
+        レスポンスを返した後は``render_string()``が使えないので、
+        テンプレートと名前空間を、先に用意しておく。
+        """
+        template = self.create_template_loader(
+            self.get_template_path()).load(self.HTML_DAY)
+        namespace = self.get_template_namespace()
+
+        def render(**kwargs):
+            return template.generate(**dict(namespace, **kwargs))
+
+        tornado.ioloop.IOLoop.current().spawn_callback(
+            self._warm_days, render, filter_str, todo_days_value)
+
+    async def _warm_days(self, render, filter_str: str,
+                         todo_days_value: int) -> None:
+        today = datetime.date.today()
+        date_from = today - datetime.timedelta(self._days)
+        date_to = today + datetime.timedelta(self._days - 1)
+        self._mylog.debug('%s .. %s', date_from, date_to)
+
+        # 描画中に変更されたら、やめる
+        # (古い内容を、新しいバージョンでキャッシュしない)
+        versions = (self._sd.version(None),
+                    self._sd.range_version(date_from, date_to))
+
+        query = Query(filter_str, debug=self._dbg)
+        (todo_sde, todo_today_sde) = await self.load_todo(
+            query, todo_days_value, date_from, date_to)
+        await self._sd.prefetch(date_from, date_to)
+
+        day_args = dict(url_prefix=self._url_prefix,
+                        today=today,
+                        delta_day1=datetime.timedelta(1),
+                        date=today,
+                        modified_sde_id=None,
+                        filter_str=filter_str,
+                        search_str='',
+                        todo_days_value=todo_days_value,
+                        )
+
+        count = 0
+        async for sched_ent in self.gen_sched(
+                date_from, date_to, query, None,
+                todo_sde, todo_today_sde, todo_days_value, reverse=False):
+            if (self._sd.version(None),
+                    self._sd.range_version(date_from, date_to)) != versions:
+                self._mylog.debug('changed .. stop')
+                break
+
+            self.render_day(sched_ent, None, day_args, render)
+
+            # 他のリクエストを待たせない
+            count += 1
+            if count % self.STREAM_CHUNK_DAYS == 0:
+                await asyncio.sleep(0)
+
+        self._mylog.debug('frag: %s', self._frag)
+
+    async def exec_update(self, cmd: str) -> (datetime.date, str):
         """
         Parameters
         ----------
@@ -564,12 +900,17 @@ class MainHandler(HandlerBase):
         if cmd in ['add']:
             sde_id = None
 
-        if cmd in ['del', 'fix', 'update']:
-            self.cmd_del(orig_date, sde_id)
+        if cmd in ['del']:
+            await self.cmd_del(orig_date, sde_id)
+
+        if cmd in ['add']:
+            new_sde = await self.cmd_add(sde_id, date, time_start, time_end,
+                                         sde_type, title, place, detail)
 
-        if cmd in ['add', 'fix', 'update']:
-            new_sde = self.cmd_add(sde_id, date, time_start, time_end,
-                                   sde_type, title, place, detail)
+        if cmd in ['fix', 'update']:
+            new_sde = await self.cmd_fix(orig_date, sde_id, date,
+                                         time_start, time_end,
+                                         sde_type, title, place, detail)
 
         if new_sde:
             modified_sde_id = new_sde.sde_id
@@ -581,8 +922,8 @@ class MainHandler(HandlerBase):
                           date, modified_sde_id)
         return date, modified_sde_id
 
-    def cmd_add(self, sde_id, date, time_start, time_end,
-                sde_type, title, place, detail):
+    async def cmd_add(self, sde_id, date, time_start, time_end,
+                      sde_type, title, place, detail):
         """
         Parameters
         ----------
@@ -605,13 +946,45 @@ class MainHandler(HandlerBase):
                                sde_type, title, place, detail,
                                debug=self._dbg)
         if new_sde.is_todo():
-            self._sd.add_sde(None, new_sde)
+            await self._sd.add_sde(None, new_sde)
         else:
-            self._sd.add_sde(date, new_sde)
+            await self._sd.add_sde(date, new_sde)
+
+        return new_sde
+
+    async def cmd_fix(self, orig_date, sde_id, date, time_start, time_end,
+                      sde_type, title, place, detail):
+        """
+        ``orig_date``の予定を置き換える (ファイルの書き込みは、日ごとに1回)
+
+        Parameters
+        ----------
+        orig_date: datetime.date
+            変更前の日 (None: ToDo)
+        sde_id: str
+        date: datetime.date
+        time_start, time_end:
+        sde_type: str
+        title: str
+        place: str
+        detail: str
+
+        Returns
+        -------
+        new_sde: SchedDataEnt
+
+        """
+        self._mylog.debug('orig_date=%s, sde_id=%s, date=%s',
+                          orig_date, sde_id, date)
+
+        new_sde = SchedDataEnt(sde_id, date, time_start, time_end,
+                               sde_type, title, place, detail,
+                               debug=self._dbg)
+        await self._sd.replace_sde(orig_date, new_sde)
 
         return new_sde
 
-    def cmd_del(self, date, sde_id):
+    async def cmd_del(self, date, sde_id):
         """
         Parameters
         ----------
@@ -622,4 +995,4 @@ class MainHandler(HandlerBase):
         """
         self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
 
-        self._sd.del_sde(date, sde_id)
+        await self._sd.del_sde(date, sde_id)
@@ -7,7 +7,8 @@ my_logger.py
 __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021'
 
-import inspect
+import os
+import sys
 from logging import getLogger, StreamHandler, Formatter
 from logging import DEBUG, INFO
 # from logging import NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -21,30 +22,58 @@ CONSOLE_HANDLER = StreamHandler()
 CONSOLE_HANDLER.setFormatter(HANDLER_FMT)
 CONSOLE_HANDLER.setLevel(DEBUG)
 
+_LOGGERS = {}
+""" name -> logger (生成済みのロガー) """
 
-def get_logger(name, dbg=False):
+
+def _dbg2level(dbg) -> int:
     """
-    get logger
+    Raises
+    ------
+    ValueError
     """
-    filename = inspect.stack()[1].filename.split('/')[-1]
-    name = filename + '.' + name
-    logger = getLogger(name)
-    logger.propagate = False
-    logger.addHandler(CONSOLE_HANDLER)
-    logger.setLevel(INFO)
-
     # [Important !! ]
     # isinstance()では、boolもintと判定されるので、
     # 先に bool かどうかを判定する
 
     if isinstance(dbg, bool):
         if dbg:
-            logger.setLevel(DEBUG)
-
-        return logger
+            return DEBUG
+        return INFO
 
     if isinstance(dbg, int):
-        logger.setLevel(dbg)
-        return logger
+        return dbg
 
     raise ValueError('invalid `dbg` value: %s' % (dbg))
+
+
+def get_logger(name, dbg=False):
+    """
+    get logger
+
+    Notes
+    -----
+    ロガーは、(呼び出し元のファイル名, name)ごとに一度だけ生成し、
+    以降は生成済みのものを返す。
+    レベルは、変更がある場合のみ設定する。
+    (``setLevel()``は、全ロガーのキャッシュをクリアするため)
+
+    呼び出し元のファイル名は、``inspect.stack()``ではなく、
+    ``sys._getframe()``で取得する。
+    """
+    level = _dbg2level(dbg)
+
+    filename = os.path.basename(sys._getframe(1).f_code.co_filename)
+    name = filename + '.' + name
+
+    logger = _LOGGERS.get(name)
+    if logger is None:
+        logger = getLogger(name)
+        logger.propagate = False
+        logger.addHandler(CONSOLE_HANDLER)
+        logger = _LOGGERS.setdefault(name, logger)
+
+    if logger.level != level:
+        logger.setLevel(level)
+
+    return logger
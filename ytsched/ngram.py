@@ -0,0 +1,314 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+検索用の N-gram 転置インデックス
+
+日ごとの検索用文字列(``SchedDataEnt.search_str()``)の
+1文字(uni-gram)と2文字(bi-gram)ごとに、その文字列を含む日の一覧を保持する。
+(日本語は単語に分割できないので、文字単位の N-gram にする)
+
+  _postings = {
+      gram1: array('i', [ordinal1, ordinal2, ..]),  # 日付順
+      :
+  }
+
+検索文字列(正規表現)から、必ず含まれる文字列(``required_literals()``)を取り出し、
+それらの全ての N-gram を含む日を、候補とする。
+3文字以上の文字列は、全ての bi-gram を含む日に絞り込む。
+
+Notes
+-----
+* 候補の日は、必ず実際のデータで照合すること。
+  (N-gram が全て含まれていても、文字列が含まれているとは限らない)
+* 更新された日は、新しい N-gram を追加するだけで、古いものは削除しない。
+  (削除された文字列の候補が残るだけで、照合すれば結果は変わらない)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+import bisect
+import datetime
+from array import array
+from . import snapshot
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+N_GRAM = 2
+
+DEF_FILENAME = '.ytsched.ngram'
+
+
+def grams(text: str) -> set:
+    """
+    Parameters
+    ----------
+    text: str
+
+    Returns
+    -------
+    gram_set: set of str
+        1文字から``N_GRAM``文字までの部分文字列
+    """
+    gram_set = set(text)
+    for n in range(2, N_GRAM + 1):
+        gram_set.update([text[i:i + n] for i in range(len(text) - n + 1)])
+
+    return gram_set
+
+
+def _literals(parsed, out: list) -> None:
+    """
+    正規表現の解析結果から、必ず含まれる文字列を取り出す
+
+    連続する``LITERAL``を一つの文字列にする。
+    それ以外(文字クラス、選択、0回を含む繰り返しなど)で区切る。
+    """
+    run = []
+    for (op, av) in parsed:
+        if op == sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+
+        if run:
+            out.append(''.join(run))
+            run = []
+
+        if op == sre_constants.SUBPATTERN:
+            if len(av) == 4 and av[1] & re.IGNORECASE:
+                # (?i:...)
+                continue
+            _literals(av[-1], out)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            (min_count, _, item) = av
+            if min_count >= 1:
+                _literals(item, out)
+
+    if run:
+        out.append(''.join(run))
+
+
+def required_literals(pattern: str) -> list:
+    """
+    正規表現にマッチする文字列に、必ず含まれる文字列
+
+    Parameters
+    ----------
+    pattern: str
+        正規表現
+
+    Returns
+    -------
+    literal_list: list of str or None
+        None: 不正な正規表現、または必ず含まれる文字列がない
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError, OverflowError):
+        return None
+
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return None
+
+    out = []
+    _literals(parsed, out)
+    out = [s for s in out if s]
+
+    if not out:
+        return None
+    return out
+
+
+class NgramIndex:
+    """
+    N-gram 転置インデックス
+
+    Attributes
+    ----------
+    keys: dict
+        {date: key} インデックスに登録した時のファイルの
+        ``snapshot.stat_key()`` (読み込み時の検証用)
+    n_updates: int
+        変更回数 (保存が必要かどうかの判定用)
+    """
+    def __init__(self):
+        """ Constructor """
+        self._postings = {}
+        self.keys = {}
+        self.n_updates = 0
+
+    def __str__(self):
+        """ __str__ """
+        return 'grams:%s, days:%s, postings:%s' % (
+            len(self._postings), len(self.keys), self.n_postings())
+
+    def to_state(self) -> dict:
+        """
+        保存用の状態 (文字列・数値のみ)
+
+        Returns
+        -------
+        state: dict
+            {'postings': {gram: str}, 'keys': [[ordinal, kind, mtime, size]],
+             'n_updates': int}
+        """
+        return {
+            'postings': {gram: snapshot.encode_array(postings)
+                         for (gram, postings) in self._postings.items()},
+            'keys': [[date.toordinal()] + list(key)
+                     for (date, key) in self.keys.items()],
+            'n_updates': self.n_updates,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """
+        ``to_state()``の逆
+
+        Parameters
+        ----------
+        state: dict
+
+        Returns
+        -------
+        index: NgramIndex
+
+        Raises
+        ------
+        ValueError
+            不正な状態
+        """
+        index = cls()
+        try:
+            for (gram, s) in state['postings'].items():
+                index._postings[gram] = snapshot.decode_array('i', s)
+            for (ordinal, kind, mtime, size) in state['keys']:
+                index.keys[datetime.date.fromordinal(ordinal)] = (
+                    str(kind), int(mtime), int(size))
+            index.n_updates = int(state['n_updates'])
+        except (KeyError, TypeError, AttributeError, OverflowError) as ex:
+            raise ValueError('invalid index: %s: %s' % (
+                type(ex).__name__, ex))
+
+        return index
+
+    def n_postings(self) -> int:
+        """
+        Returns
+        -------
+        n: int
+            全ての日付の一覧の長さの合計
+        """
+        return sum([len(a) for a in self._postings.values()])
+
+    def add(self, date: datetime.date, texts, key=None) -> None:
+        """
+        1日分の検索用文字列を登録する
+
+        Parameters
+        ----------
+        date: datetime.date
+        texts: iterable of str
+            ``SchedDataEnt.search_str()``
+        key: tuple
+            ``snapshot.stat_key()``
+        """
+        ordinal = date.toordinal()
+
+        gram_set = set()
+        for text in texts:
+            gram_set |= grams(text)
+
+        for gram in gram_set:
+            postings = self._postings.get(gram)
+            if postings is None:
+                self._postings[gram] = array('i', [ordinal])
+                continue
+
+            # 日付順に読み込むことが多いので、末尾への追加を先に判定する
+            if postings[-1] < ordinal:
+                postings.append(ordinal)
+                continue
+
+            i = bisect.bisect_left(postings, ordinal)
+            if postings[i] != ordinal:
+                postings.insert(i, ordinal)
+
+        if key is None:
+            self.keys.pop(date, None)
+        else:
+            self.keys[date] = key
+        self.n_updates += 1
+
+    def remove(self, date: datetime.date) -> None:
+        """
+        ファイルが削除された日
+
+        Notes
+        -----
+        N-gram の日付の一覧からは削除しない。(候補の日として残るだけ)
+        """
+        self.keys.pop(date, None)
+        self.n_updates += 1
+
+    def candidates(self, literal_list: list) -> set:
+        """
+        全ての文字列の N-gram を含む日
+
+        Parameters
+        ----------
+        literal_list: list of str
+
+        Returns
+        -------
+        date_set: set of datetime.date
+        """
+        gram_set = set()
+        for literal in literal_list:
+            if len(literal) < N_GRAM:
+                gram_set.add(literal)
+            else:
+                gram_set.update([literal[i:i + N_GRAM] for i in
+                                 range(len(literal) - N_GRAM + 1)])
+
+        postings_list = []
+        for gram in gram_set:
+            postings = self._postings.get(gram)
+            if postings is None:
+                return set()
+            postings_list.append(postings)
+
+        # 短いものから絞り込む
+        postings_list.sort(key=len)
+        ordinal_set = set(postings_list[0])
+        for postings in postings_list[1:]:
+            if not ordinal_set:
+                break
+            ordinal_set.intersection_update(postings)
+
+        return {datetime.date.fromordinal(o) for o in ordinal_set}
+
+    def query(self, pattern: str) -> set:
+        """
+        検索文字列(正規表現)にマッチする可能性がある日
+
+        Parameters
+        ----------
+        pattern: str
+
+        Returns
+        -------
+        date_set: set of datetime.date or None
+            None: インデックスでは絞り込めない (全ての日を照合する必要がある)
+        """
+        literal_list = required_literals(pattern)
+        if literal_list is None:
+            return None
+
+        return self.candidates(literal_list)
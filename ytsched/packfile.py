@@ -0,0 +1,402 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+過去の年のデータファイルをまとめたパックファイル
+
+``YYYY/MM/DD.cgi``の1年分を、``TOPDIR/YYYY.pack``の一つのファイルにまとめる。
+各日のデータは、元のファイルの内容(バイト列)をそのまま格納するので、
+``unpack()``で、元の``.cgi``ファイルを復元できる。
+
+  ヘッダー: MAGIC, 年, 索引の数 (``_HDR``)
+  索引:     元日からの日数ごとに (位置, 長さ) (``_IDX``)
+            位置が 0 の場合は、その日のファイルはない
+  データ:   各日のファイルの内容
+
+Notes
+-----
+* パックファイルは``mmap``で読み込む。
+* 同じ日の``.cgi``ファイルがある場合は、``.cgi``ファイルを優先する。
+  (パックした後に編集された日は、``.cgi``ファイルに保存される)
+* 今年以降のデータは、パックできない。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import mmap
+import struct
+import datetime
+
+MAGIC = b'YTSPACK1'
+PACK_EXT = '.pack'
+N_INDEX = 366
+
+_HDR = struct.Struct('<8sHH')
+""" MAGIC, year, N_INDEX """
+_IDX = struct.Struct('<II')
+""" offset, length """
+
+_PACKS = {}
+""" pathname -> PackFile (開いているパックファイル) """
+
+
+def pack_path(topdir: str, year: int) -> str:
+    """
+    Parameters
+    ----------
+    topdir: str
+    year: int
+
+    Returns
+    -------
+    pathname: str
+    """
+    return os.path.join(os.path.expanduser(topdir),
+                        '%04d%s' % (year, PACK_EXT))
+
+
+def cgi_path(topdir: str, date: datetime.date) -> str:
+    """
+    ``SchedDataFile.date2path()``と同じパス
+
+    Parameters
+    ----------
+    topdir: str
+    date: datetime.date
+
+    Returns
+    -------
+    pathname: str
+    """
+    return os.path.join(os.path.expanduser(topdir),
+                        '%04d' % date.year, '%02d' % date.month,
+                        '%02d.cgi' % date.day)
+
+
+class PackFile:
+    """
+    パックファイル (読み込み専用)
+
+    Attributes
+    ----------
+    pathname: str
+    year: int
+    stat_key: (int, int)
+        (st_mtime_ns, st_size) 開いた時のファイル
+    """
+    def __init__(self, pathname: str):
+        """ Constructor
+
+        Parameters
+        ----------
+        pathname: str
+
+        Raises
+        ------
+        ValueError
+            不正なパックファイル
+        """
+        self.pathname = pathname
+
+        with open(pathname, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.stat_key = (st.st_mtime_ns, st.st_size)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        hdr_size = _HDR.size + _IDX.size * N_INDEX
+        if len(self._mm) < hdr_size:
+            self.close()
+            raise ValueError('%s: invalid pack file' % (pathname))
+
+        (magic, self.year, n_index) = _HDR.unpack_from(self._mm, 0)
+        if magic != MAGIC or n_index != N_INDEX:
+            self.close()
+            raise ValueError('%s: invalid pack file' % (pathname))
+
+        self._index = [_IDX.unpack_from(self._mm, _HDR.size + _IDX.size * i)
+                       for i in range(N_INDEX)]
+        self._jan1 = datetime.date(self.year, 1, 1).toordinal()
+
+    def __str__(self):
+        """ __str__ """
+        return 'pack:%s, days:%s' % (self.pathname, len(self.dates()))
+
+    def close(self) -> None:
+        """ close """
+        self._mm.close()
+
+    def read(self, date: datetime.date) -> bytes:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+
+        Returns
+        -------
+        data: bytes or None
+            None: その日のファイルはない
+        """
+        if date.year != self.year:
+            return None
+
+        (offset, length) = self._index[date.toordinal() - self._jan1]
+        if offset == 0:
+            return None
+
+        return self._mm[offset:offset + length]
+
+    def dates(self) -> list:
+        """
+        Returns
+        -------
+        date_list: list of datetime.date (sorted)
+        """
+        return [datetime.date.fromordinal(self._jan1 + i)
+                for (i, (offset, length)) in enumerate(self._index)
+                if offset]
+
+    def month_bitmap(self, month: int) -> int:
+        """
+        ``SchedData._month_bitmap()``と同じ形式のビットマップ
+
+        Parameters
+        ----------
+        month: int
+
+        Returns
+        -------
+        bitmap: int
+            bit N: N日のファイルがある
+        """
+        bitmap = 0
+        for date in self.dates():
+            if date.month == month:
+                bitmap |= 1 << date.day
+
+        return bitmap
+
+
+def open_pack(topdir: str, year: int) -> PackFile:
+    """
+    パックファイルを開く
+
+    一度開いたパックファイルは、ファイルが置き換えられるまで再利用する。
+
+    Parameters
+    ----------
+    topdir: str
+    year: int
+
+    Returns
+    -------
+    pack: PackFile or None
+        None: パックファイルがない
+    """
+    pathname = pack_path(topdir, year)
+    try:
+        st = os.stat(pathname)
+    except FileNotFoundError:
+        _PACKS.pop(pathname, None)
+        return None
+
+    pack = _PACKS.get(pathname)
+    if pack is not None and pack.stat_key == (st.st_mtime_ns, st.st_size):
+        return pack
+
+    pack = PackFile(pathname)
+    _PACKS[pathname] = pack
+    return pack
+
+
+def read_day(topdir: str, date: datetime.date) -> bytes:
+    """
+    パックファイルから、1日分のデータを読み込む
+
+    Parameters
+    ----------
+    topdir: str
+    date: datetime.date
+
+    Returns
+    -------
+    data: bytes or None
+        None: パックファイル、またはその日のデータがない
+    """
+    pack = open_pack(topdir, date.year)
+    if pack is None:
+        return None
+
+    return pack.read(date)
+
+
+def list_years(topdir: str) -> list:
+    """
+    Returns
+    -------
+    year_list: list of int (sorted)
+        パックファイルがある年
+    """
+    year_list = []
+    try:
+        for ent in os.scandir(os.path.expanduser(topdir)):
+            (year, ext) = os.path.splitext(ent.name)
+            if ext == PACK_EXT and year.isdigit():
+                year_list.append(int(year))
+    except FileNotFoundError:
+        pass
+
+    return sorted(year_list)
+
+
+def _write_pack(pathname: str, year: int, days: dict) -> None:
+    """
+    パックファイルを書き込む (一時ファイルに書いてから置き換える)
+
+    Parameters
+    ----------
+    pathname: str
+    year: int
+    days: dict
+        {date: data(bytes)}
+    """
+    jan1 = datetime.date(year, 1, 1).toordinal()
+
+    index = [(0, 0)] * N_INDEX
+    offset = _HDR.size + _IDX.size * N_INDEX
+    data_list = []
+    for date in sorted(days):
+        data = days[date]
+        index[date.toordinal() - jan1] = (offset, len(data))
+        data_list.append(data)
+        offset += len(data)
+
+    tmp_pathname = pathname + '.tmp'
+    with open(tmp_pathname, 'wb') as f:
+        f.write(_HDR.pack(MAGIC, year, N_INDEX))
+        for (offset, length) in index:
+            f.write(_IDX.pack(offset, length))
+        for data in data_list:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_pathname, pathname)
+
+
+def pack(topdir: str, year: int) -> int:
+    """
+    1年分の``.cgi``ファイルを、パックファイルにまとめる
+
+    パックファイルが既にある場合は、``.cgi``ファイルを優先して統合する。
+    パックした``.cgi``ファイルは削除する。(``.bak``ファイルは残す)
+
+    Parameters
+    ----------
+    topdir: str
+    year: int
+
+    Returns
+    -------
+    n_days: int
+        パックファイルに含まれる日数
+
+    Raises
+    ------
+    ValueError
+        今年以降
+    """
+    if year >= datetime.date.today().year:
+        raise ValueError('%s: only past years can be packed' % (year))
+
+    days = {}
+
+    old_pack = open_pack(topdir, year)
+    if old_pack is not None:
+        for date in old_pack.dates():
+            days[date] = old_pack.read(date)
+
+    year_dir = os.path.join(os.path.expanduser(topdir), '%04d' % year)
+    cgi_list = []
+    for month in range(1, 13):
+        month_dir = os.path.join(year_dir, '%02d' % month)
+        try:
+            ents = list(os.scandir(month_dir))
+        except FileNotFoundError:
+            continue
+
+        for ent in ents:
+            (day, ext) = os.path.splitext(ent.name)
+            if ext != '.cgi' or not day.isdigit():
+                continue
+            try:
+                date = datetime.date(year, month, int(day))
+            except ValueError:
+                continue
+
+            with open(ent.path, 'rb') as f:
+                days[date] = f.read()
+            cgi_list.append(ent.path)
+
+    if not days:
+        return 0
+
+    _write_pack(pack_path(topdir, year), year, days)
+
+    for pathname in cgi_list:
+        os.remove(pathname)
+
+    for month in range(1, 13):
+        try:
+            os.rmdir(os.path.join(year_dir, '%02d' % month))
+        except OSError:
+            pass
+    try:
+        os.rmdir(year_dir)
+    except OSError:
+        pass
+
+    return len(days)
+
+
+def unpack(topdir: str, year: int) -> int:
+    """
+    パックファイルから、元の``.cgi``ファイルを復元し、パックファイルを削除する
+
+    既に``.cgi``ファイルがある日は、``.cgi``ファイルを残す。
+
+    Parameters
+    ----------
+    topdir: str
+    year: int
+
+    Returns
+    -------
+    n_files: int
+        復元したファイルの数
+
+    Raises
+    ------
+    FileNotFoundError
+        パックファイルがない
+    """
+    old_pack = open_pack(topdir, year)
+    if old_pack is None:
+        raise FileNotFoundError(pack_path(topdir, year))
+
+    n_files = 0
+    for date in old_pack.dates():
+        pathname = cgi_path(topdir, date)
+        if os.path.exists(pathname):
+            continue
+
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        with open(pathname, 'wb') as f:
+            f.write(old_pack.read(date))
+        n_files += 1
+
+    _PACKS.pop(old_pack.pathname, None)
+    old_pack.close()
+    os.remove(old_pack.pathname)
+
+    return n_files
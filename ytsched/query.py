@@ -0,0 +1,534 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+フィルター・検索文字列のクエリー
+
+フィルター文字列(``filter_str``)と検索文字列(``search_str``)を、
+リクエストごとに一度だけ解析し、条件の木(クロージャー)にする。
+条件は、エンティティ(``SchedDataEnt``)、または、
+検索用文字列(``SchedDataEnt.search_str()``)と日付で評価する。
+
+従来の文字列(正規表現)は、そのまま同じ結果になる。
+先頭に``?``(``QUERY_MARK``)をつけた場合のみ、クエリーとして解析する。
+(``?``で始まる正規表現は不正で、従来は何にも一致しなかった)
+
+クエリーの例::
+
+  ?会議 OR 打合せ
+  ?#仕事 AND NOT (渋谷 OR 新宿)
+  ?+歯医者 after:2020 before:2021-04
+  ?"lunch & talk"
+
+  * 空白で区切った条件は、``AND``と同じ。
+  * 優先順位は、``NOT``, ``AND``, ``OR``の順。
+  * ``#``, ``+``, ``@``, ``detail:``で始まる条件は、
+    それぞれ、タイプ、タイトル、場所、詳細のみで照合する。
+  * ``"``で囲んだ条件は、(正規表現ではない)文字列として照合する。
+  * ``before:``, ``after:``は、その期間を含まない。
+    (``YYYY-MM-DD``, ``YYYY-MM``, ``YYYY``)
+
+Notes
+-----
+* 正規表現の特殊文字を含まない条件は、``re``を使わず、``in``で照合する。
+* 不正な正規表現の条件は、何にも一致しない。(従来と同じ)
+* 解析できないクエリーは、``?``を除いた部分を、従来の文字列として扱う。
+* フィールドの条件は、エンティティでは、小文字にしたフィールド
+  (``SchedDataEnt.search_fields()``)で照合する。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import re
+import datetime
+from . import ngram
+from .my_logger import get_logger
+
+QUERY_MARK = '?'
+KEYWORDS = ('AND', 'OR', 'NOT', '(', ')')
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+FIELD_PREFIX = (('detail:', 3), ('#', 0), ('+', 1), ('@', 2))
+""" (接頭辞, ``split_fields()``, ``search_fields()``の何番目か) """
+
+_DATE_TERM = re.compile(r'^(before|after):(\d{4})(?:[-/](\d{1,2}))?'
+                        r'(?:[-/](\d{1,2}))?$', re.IGNORECASE)
+
+_mylog = get_logger(__name__, False)
+
+
+class QueryError(Exception):
+    """ クエリーの解析エラー """
+
+
+def split_fields(search_str: str) -> tuple:
+    """
+    検索用文字列を、フィールドに分ける
+
+    ``'#type +title @place detail:detail'``の形式なので、
+    タイプは最初の``' +'``まで、詳細は最初の``' detail:'``から、
+    場所は、その前の最後の``' @'``からとする。
+
+    Parameters
+    ----------
+    search_str: str
+        ``SchedDataEnt.search_str()``
+
+    Returns
+    -------
+    (sde_type, title, place, detail): (str, str, str, str)
+    """
+    i_title = search_str.find(' +')
+    i_detail = search_str.find(' detail:', max(i_title, 0))
+    if i_title < 0 or i_detail < 0:
+        return (search_str, '', '', '')
+
+    i_place = search_str.rfind(' @', i_title, i_detail)
+    if i_place < 0:
+        i_place = i_detail
+
+    return (search_str[1:i_title],
+            search_str[i_title + 2:i_place],
+            search_str[i_place + 2:i_detail],
+            search_str[i_detail + 8:])
+
+
+def _period(year: str, month: str, day: str) -> (datetime.date,
+                                                 datetime.date):
+    """
+    Returns
+    -------
+    (first, last): (datetime.date, datetime.date)
+        期間の最初と最後の日
+
+    Raises
+    ------
+    ValueError
+    """
+    year = int(year)
+    if day:
+        first = last = datetime.date(year, int(month), int(day))
+    elif month:
+        first = datetime.date(year, int(month), 1)
+        last = (datetime.date(year + int(month) // 12, int(month) % 12 + 1, 1)
+                - datetime.timedelta(1))
+    else:
+        first = datetime.date(year, 1, 1)
+        last = datetime.date(year, 12, 31)
+
+    return (first, last)
+
+
+class _Node:
+    """
+    条件の木の節
+
+    Attributes
+    ----------
+    func: callable
+        func(search_str, date) -> bool
+    sde_func: callable
+        sde_func(sde) -> bool (``func``と同じ条件)
+    literals: list of str or None
+        一致する検索用文字列に必ず含まれる文字列 (``ngram``用)
+    bounds: (datetime.date, datetime.date)
+        一致する日付の範囲 (None: 制限なし)
+    """
+    def __init__(self, func, sde_func, literals=None, bounds=(None, None)):
+        self.func = func
+        self.sde_func = sde_func
+        self.literals = literals
+        self.bounds = bounds
+
+
+_NEVER = _Node(lambda s, d: False, lambda sde: False)
+
+
+def _term_node(term: str, literal: bool = False,
+               fields: bool = True) -> _Node:
+    """
+    文字列(正規表現)の条件
+
+    Parameters
+    ----------
+    term: str
+        小文字にしたもの
+    literal: bool
+        True: 正規表現ではない
+    fields: bool
+        True: ``FIELD_PREFIX``で始まる場合は、そのフィールドのみで照合する
+    """
+    field = None
+    for (prefix, i) in FIELD_PREFIX:
+        if fields and not literal and term.startswith(prefix):
+            (field, term) = (i, term[len(prefix):])
+            break
+
+    if literal or not (set(term) & REGEX_SPECIAL):
+        literals = [term] if term else None
+
+        if field is None:
+            def func(s, d):
+                return term in s
+
+            def sde_func(sde):
+                return term in sde.search_str()
+        else:
+            def func(s, d):
+                return term in split_fields(s)[field]
+
+            def sde_func(sde):
+                return term in sde.search_fields()[field]
+
+        return _Node(func, sde_func, literals)
+
+    try:
+        pattern = re.compile(term)
+    except re.error as ex:
+        _mylog.warning('%s:%s:%a .. never match', type(ex).__name__, ex, term)
+        return _NEVER
+
+    search = pattern.search
+    literals = ngram.required_literals(term)
+
+    if field is None:
+        def func(s, d):
+            return search(s) is not None
+
+        def sde_func(sde):
+            return search(sde.search_str()) is not None
+    else:
+        def func(s, d):
+            return search(split_fields(s)[field]) is not None
+
+        def sde_func(sde):
+            return search(sde.search_fields()[field]) is not None
+
+    return _Node(func, sde_func, literals)
+
+
+def _date_node(token: str) -> _Node:
+    """
+    ``before:``, ``after:``
+
+    Raises
+    ------
+    QueryError
+    """
+    m = _DATE_TERM.match(token)
+    try:
+        (first, last) = _period(*m.groups()[1:])
+    except (AttributeError, ValueError, OverflowError):
+        raise QueryError('invalid date: %s' % (token))
+
+    if m.group(1).lower() == 'before':
+        return _Node(lambda s, d: d < first, lambda sde: sde.date < first,
+                     bounds=(None, first - datetime.timedelta(1)))
+
+    return _Node(lambda s, d: d > last, lambda sde: sde.date > last,
+                 bounds=(last + datetime.timedelta(1), None))
+
+
+def _and_node(children: list) -> _Node:
+    if len(children) == 1:
+        return children[0]
+
+    funcs = [c.func for c in children]
+    sde_funcs = [c.sde_func for c in children]
+
+    def func(s, d):
+        for f in funcs:
+            if not f(s, d):
+                return False
+        return True
+
+    def sde_func(sde):
+        for f in sde_funcs:
+            if not f(sde):
+                return False
+        return True
+
+    literals = [lit for c in children if c.literals for lit in c.literals]
+
+    (lo, hi) = (None, None)
+    for c in children:
+        (lo1, hi1) = c.bounds
+        if lo1 is not None and (lo is None or lo1 > lo):
+            lo = lo1
+        if hi1 is not None and (hi is None or hi1 < hi):
+            hi = hi1
+
+    return _Node(func, sde_func, literals or None, (lo, hi))
+
+
+def _or_node(children: list) -> _Node:
+    if len(children) == 1:
+        return children[0]
+
+    funcs = [c.func for c in children]
+    sde_funcs = [c.sde_func for c in children]
+
+    def func(s, d):
+        for f in funcs:
+            if f(s, d):
+                return True
+        return False
+
+    def sde_func(sde):
+        for f in sde_funcs:
+            if f(sde):
+                return True
+        return False
+
+    return _Node(func, sde_func)
+
+
+def _not_node(child: _Node) -> _Node:
+    (f, sde_f) = (child.func, child.sde_func)
+    return _Node(lambda s, d: not f(s, d), lambda sde: not sde_f(sde))
+
+
+def tokenize(query_str: str) -> list:
+    """
+    Parameters
+    ----------
+    query_str: str
+
+    Returns
+    -------
+    tokens: list of (str, bool)
+        (token, quoted)
+
+    Raises
+    ------
+    QueryError
+    """
+    tokens = []
+    for (i, part) in enumerate(query_str.split('"')):
+        if i % 2:
+            # "..."
+            tokens.append((part, True))
+            continue
+
+        for word in part.split():
+            # 正規表現のかっこと区別するため、
+            # 対応していない``(``, ``)``のみ分ける
+            n_open = 0
+            while word.startswith('(') and \
+                    word.count('(') > word.count(')'):
+                word = word[1:]
+                n_open += 1
+            n_close = 0
+            while word.endswith(')') and \
+                    word.count(')') > word.count('('):
+                word = word[:-1]
+                n_close += 1
+
+            tokens += [('(', False)] * n_open
+            if word:
+                tokens.append((word, False))
+            tokens += [(')', False)] * n_close
+
+    if query_str.count('"') % 2:
+        raise QueryError('unbalanced quote')
+
+    return tokens
+
+
+class _Parser:
+    """
+    expr := and ('OR' and)*
+    and  := not (['AND'] not)*
+    not  := 'NOT' not | atom
+    atom := '(' expr ')' | term
+    """
+    def __init__(self, tokens: list):
+        self._tokens = tokens
+        self._pos = 0
+
+    def _peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return (None, False)
+
+    def _is_op(self, token, op) -> bool:
+        return token == (op, False)
+
+    def parse(self) -> _Node:
+        node = self._expr()
+        if self._pos != len(self._tokens):
+            raise QueryError('unexpected: %s' % (self._peek()[0]))
+        return node
+
+    def _expr(self) -> _Node:
+        children = [self._and()]
+        while self._is_op(self._peek(), 'OR'):
+            self._pos += 1
+            children.append(self._and())
+        return _or_node(children)
+
+    def _and(self) -> _Node:
+        children = [self._not()]
+        while True:
+            token = self._peek()
+            if token[0] is None or self._is_op(token, 'OR') or \
+               self._is_op(token, ')'):
+                break
+            if self._is_op(token, 'AND'):
+                self._pos += 1
+            children.append(self._not())
+        return _and_node(children)
+
+    def _not(self) -> _Node:
+        if self._is_op(self._peek(), 'NOT'):
+            self._pos += 1
+            return _not_node(self._not())
+        return self._atom()
+
+    def _atom(self) -> _Node:
+        (token, quoted) = self._peek()
+        if token is None:
+            raise QueryError('unexpected end')
+        self._pos += 1
+
+        if quoted:
+            return _term_node(token.lower(), literal=True)
+
+        if token == '(':
+            node = self._expr()
+            if not self._is_op(self._peek(), ')'):
+                raise QueryError('missing )')
+            self._pos += 1
+            return node
+
+        if token in KEYWORDS:
+            raise QueryError('unexpected: %s' % (token))
+
+        if token.lower().startswith(('before:', 'after:')):
+            return _date_node(token)
+
+        return _term_node(token.lower())
+
+
+def is_structured(query_str: str) -> bool:
+    """
+    クエリーとして解析するか (``QUERY_MARK``で始まるか)
+
+    Parameters
+    ----------
+    query_str: str
+    """
+    return query_str.startswith(QUERY_MARK)
+
+
+class Query:
+    """
+    コンパイルしたクエリー
+
+    Attributes
+    ----------
+    match: callable or None
+        match(search_str, date) -> bool
+        None: 全てに一致する(条件がない)
+    """
+    def __init__(self, filter_str: str = '', search_str: str = '',
+                 debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        filter_str: str
+            フィルター文字列
+            (従来の文字列の場合、``'!'``で始まると、一致しないものを残す)
+        search_str: str
+            検索文字列
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('filter_str=%a, search_str=%a',
+                          filter_str, search_str)
+
+        children = []
+        for (query_str, legacy_not) in ((filter_str, True),
+                                        (search_str, False)):
+            if query_str:
+                children.append(self._compile(query_str, legacy_not))
+
+        self.match = None
+        self._match_sde = None
+        self._literals = None
+        self._bounds = (None, None)
+        if children:
+            node = _and_node(children)
+            self.match = node.func
+            self._match_sde = node.sde_func
+            self._literals = node.literals
+            self._bounds = node.bounds
+
+    def _compile(self, query_str: str, legacy_not: bool) -> _Node:
+        """
+        Parameters
+        ----------
+        query_str: str
+        legacy_not: bool
+            True: 従来の文字列の場合、先頭の``'!'``は否定
+        """
+        if is_structured(query_str):
+            query_str = query_str[len(QUERY_MARK):]
+            try:
+                return _Parser(tokenize(query_str)).parse()
+            except QueryError as ex:
+                self._mylog.warning('%a: %s .. as a regular expression',
+                                    query_str, ex)
+
+        # 従来の文字列: 全体で一つの正規表現
+        query_str = query_str.lower()
+        if legacy_not and query_str.startswith('!'):
+            try:
+                re.compile(query_str[1:])
+            except re.error as ex:
+                # 従来どおり、否定でも、全て一致しない
+                # (``_term_node()``の「一致しない」を否定しない)
+                self._mylog.warning('%s:%s:%a .. never match',
+                                    type(ex).__name__, ex, query_str)
+                return _NEVER
+
+            return _not_node(_term_node(query_str[1:], fields=False))
+
+        return _term_node(query_str, fields=False)
+
+    def required_literals(self) -> list:
+        """
+        Returns
+        -------
+        literal_list: list of str or None
+            一致する検索用文字列に、必ず含まれる文字列
+            None: 不明
+        """
+        return self._literals
+
+    def date_bounds(self) -> (datetime.date, datetime.date):
+        """
+        Returns
+        -------
+        (date_from, date_to): (datetime.date, datetime.date)
+            一致する日付の範囲 (両端を含む、None: 制限なし)
+        """
+        return self._bounds
+
+    def match_sde(self, sde) -> bool:
+        """
+        ``match``のエンティティ版
+        (検索用文字列・小文字のフィールドは、エンティティが保持する)
+
+        Parameters
+        ----------
+        sde: SchedDataEnt
+
+        Returns
+        -------
+        result: bool
+        """
+        if self._match_sde is None:
+            return True
+        return self._match_sde(sde)
@@ -0,0 +1,223 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+解析済みデータのスナップショット
+
+再起動(``autoreload``を含む)のたびに、データファイルを解析し直さないように、
+``SchedData``のキャッシュの内容をファイルに保存する。
+
+  MAGIC (8 bytes)
+  チェックサム (``hashlib.blake2b``, ``DIGEST_SIZE`` bytes)
+  データ (JSON, UTF-8)
+
+Notes
+-----
+* データは、文字列・数値・リストなどのみ(JSON)で、オブジェクトは含まない。
+  (``pickle``と違い、読み込んでもコードは実行されない)
+  日付は``toordinal()``、配列は``encode_array()``の文字列にする。
+* チェックサムは、破損の検出用。
+* 書き込みは、一時ファイルに書いてから置き換える。
+* MAGIC・チェックサム・バージョンが一致しないスナップショットは使わない。
+* 各日のデータには、解析した時のファイルの(種類, mtime, size)を記録し、
+  読み込む時に、現在のファイルと一致するものだけを使う。
+  (``SchedData.load_snapshot()``)
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import sys
+import base64
+import datetime
+import json
+import hashlib
+from array import array
+
+MAGIC = b'YTSSNAP2'
+DIGEST_SIZE = 16
+VERSION = 3
+
+DEF_FILENAME = '.ytsched.snapshot'
+
+
+def stat_key(st, kind: str = 'cgi') -> tuple:
+    """
+    ファイルの同一性の判定に使うキー
+
+    Parameters
+    ----------
+    st: os.stat_result
+    kind: str
+        'cgi', 'pack'
+
+    Returns
+    -------
+    key: (str, int, int)
+        (kind, st_mtime_ns, st_size)
+    """
+    return (kind, st.st_mtime_ns, st.st_size)
+
+
+def date2ord(date: datetime.date):
+    """
+    日付を、JSON にできる値にする
+
+    Parameters
+    ----------
+    date: datetime.date or None
+
+    Returns
+    -------
+    ordinal: int or None
+    """
+    return date.toordinal() if date else None
+
+
+def ord2date(ordinal) -> datetime.date:
+    """
+    ``date2ord()``の逆
+
+    Parameters
+    ----------
+    ordinal: int or None
+
+    Returns
+    -------
+    date: datetime.date or None
+
+    Raises
+    ------
+    ValueError
+        不正な値
+    """
+    if ordinal is None:
+        return None
+    if type(ordinal) is not int:
+        raise ValueError('invalid date: %r' % (ordinal,))
+    try:
+        return datetime.date.fromordinal(ordinal)
+    except OverflowError as ex:
+        raise ValueError('invalid date: %s' % (ex))
+
+
+def encode_array(a: array) -> str:
+    """
+    配列を、文字列にする (リトルエンディアンの base64)
+
+    Parameters
+    ----------
+    a: array.array
+
+    Returns
+    -------
+    s: str
+    """
+    if sys.byteorder != 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return base64.b64encode(a.tobytes()).decode('ascii')
+
+
+def decode_array(typecode: str, s: str) -> array:
+    """
+    ``encode_array()``の逆
+
+    Parameters
+    ----------
+    typecode: str
+    s: str
+
+    Returns
+    -------
+    a: array.array
+
+    Raises
+    ------
+    ValueError
+        不正な文字列
+    """
+    try:
+        a = array(typecode, base64.b64decode(s, validate=True))
+    except (TypeError, ValueError) as ex:
+        raise ValueError('invalid array: %s' % (ex))
+
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def write(pathname: str, state: dict) -> int:
+    """
+    スナップショットを書き込む
+
+    Parameters
+    ----------
+    pathname: str
+    state: dict
+        JSON にできる値のみ
+        ``'version'``は、自動的に設定される
+
+    Returns
+    -------
+    size: int
+        bytes
+    """
+    data = json.dumps(dict(state, version=VERSION), ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8', 'surrogatepass')
+
+    tmp_pathname = pathname + '.tmp'
+    with open(tmp_pathname, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_digest(data))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_pathname, pathname)
+
+    return len(MAGIC) + DIGEST_SIZE + len(data)
+
+
+def read(pathname: str) -> dict:
+    """
+    スナップショットを読み込む
+
+    Parameters
+    ----------
+    pathname: str
+
+    Returns
+    -------
+    state: dict
+
+    Raises
+    ------
+    FileNotFoundError
+    ValueError
+        不正・破損したスナップショット、またはバージョンが異なる
+    """
+    with open(pathname, 'rb') as f:
+        buf = f.read()
+
+    hdr_size = len(MAGIC) + DIGEST_SIZE
+    if len(buf) < hdr_size or not buf.startswith(MAGIC):
+        raise ValueError('%s: invalid snapshot' % (pathname))
+
+    data = buf[hdr_size:]
+    if _digest(data) != buf[len(MAGIC):hdr_size]:
+        raise ValueError('%s: checksum error' % (pathname))
+
+    try:
+        state = json.loads(data.decode('utf-8', 'surrogatepass'))
+    except ValueError as ex:
+        raise ValueError('%s: %s: %s' % (pathname, type(ex).__name__, ex))
+
+    if not isinstance(state, dict) or state.get('version') != VERSION:
+        raise ValueError('%s: unsupported version' % (pathname))
+
+    return state
@@ -0,0 +1,422 @@
+#
+# (c) 2021 Yoichi Tanibayashi
+#
+"""
+データファイルの変更検出
+
+サーバー以外(同期ジョブ、古いスクリプトなど)による
+データファイルの変更を検出する。
+
+``poll()``は、前回から変更された可能性があるものを返す。
+
+  datetime.date: ``YYYY/MM/DD.cgi``
+  None:          ``ToDo.cgi``
+  int:           ``YYYY.pack`` (年)
+
+実際に内容が変わったかどうか(キャッシュと一致するか)は、
+``SchedData.revalidate()``で判定する。
+
+Notes
+-----
+* Linux では、``inotify``を``ctypes``で使う(``InotifyWatcher``)。
+* それ以外の場合は、月のディレクトリを``os.scandir``で走査し、
+  各ファイルの mtime, size を比較する(``PollWatcher``)。
+"""
+__author__ = 'Yoichi Tanibayashi'
+__date__ = '2021'
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+import datetime
+from . import packfile
+from . import snapshot
+from .my_logger import get_logger
+
+TODO_FILENAME = 'ToDo.cgi'
+
+# <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+IN_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+           IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+           IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+""" wd, mask, cookie, len """
+
+
+def _parse_name(name: str, year: int = None, month: int = None):
+    """
+    ファイル名 -> 変更されたもの
+
+    Parameters
+    ----------
+    name: str
+    year, month: int
+        None: トップディレクトリ
+
+    Returns
+    -------
+    (ok, key): (bool, datetime.date or None or int)
+        ok: False: データファイルではない
+    """
+    (base, ext) = os.path.splitext(name)
+
+    if year is None:
+        if name == TODO_FILENAME:
+            return (True, None)
+        if ext == packfile.PACK_EXT and base.isdigit():
+            return (True, int(base))
+        return (False, None)
+
+    if month is None or ext != '.cgi' or not base.isdigit():
+        return (False, None)
+
+    try:
+        return (True, datetime.date(year, month, int(base)))
+    except ValueError:
+        return (False, None)
+
+
+class PollWatcher:
+    """
+    ディレクトリツリーを走査して、変更を検出する
+
+    ``os.scandir``のエントリーの stat で、mtime, size を比較する。
+    (ファイルを開いたり、読み込んだりはしない)
+    """
+    def __init__(self, topdir: str, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        topdir: str
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('topdir=%s', topdir)
+
+        self._topdir = os.path.expanduser(topdir)
+        self._files = self._scan()
+
+    def __str__(self):
+        """ __str__ """
+        return 'poll:%s, files:%s' % (self._topdir, len(self._files))
+
+    def close(self) -> None:
+        """ close """
+        pass
+
+    def _scan(self) -> dict:
+        """
+        Returns
+        -------
+        files: dict
+            {date or None or year: ``snapshot.stat_key()``}
+        """
+        files = {}
+        try:
+            top_ents = list(os.scandir(self._topdir))
+        except FileNotFoundError:
+            return files
+
+        for y_ent in top_ents:
+            if y_ent.name.isdigit():
+                if not y_ent.is_dir():
+                    continue
+                try:
+                    self._scan_year(files, y_ent.path, int(y_ent.name))
+                except FileNotFoundError:
+                    # 走査中に削除された
+                    pass
+                continue
+
+            (ok, key) = _parse_name(y_ent.name)
+            if not ok:
+                continue
+            try:
+                files[key] = snapshot.stat_key(y_ent.stat())
+            except FileNotFoundError:
+                continue
+
+        return files
+
+    def _scan_year(self, files: dict, year_dir: str, year: int) -> None:
+        """ 1年分を走査して、``files``に追加する """
+        for m_ent in os.scandir(year_dir):
+            if not (m_ent.name.isdigit() and m_ent.is_dir()):
+                continue
+            month = int(m_ent.name)
+            for d_ent in os.scandir(m_ent.path):
+                (ok, date) = _parse_name(d_ent.name, year, month)
+                if not ok:
+                    continue
+                try:
+                    files[date] = snapshot.stat_key(d_ent.stat())
+                except FileNotFoundError:
+                    continue
+
+    def poll(self) -> set:
+        """
+        Returns
+        -------
+        changed: set
+            前回から、追加・削除・変更されたもの
+        """
+        files = self._scan()
+        old_files = self._files
+        self._files = files
+
+        changed = {key for (key, st_key) in files.items()
+                   if old_files.get(key) != st_key}
+        changed.update([key for key in old_files if key not in files])
+
+        return changed
+
+
+class InotifyWatcher:
+    """
+    ``inotify``で、変更を検出する
+
+    トップディレクトリと、全ての年・月のディレクトリを監視する。
+    ``poll()``は、溜まっているイベントを読み出すだけなので、
+    変更がない場合は、ほぼコストがかからない。
+
+    Raises
+    ------
+    OSError
+        ``inotify``が使えない
+    """
+    def __init__(self, topdir: str, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        topdir: str
+        """
+        self._dbg = debug
+        self._mylog = get_logger(self.__class__.__name__, self._dbg)
+        self._mylog.debug('topdir=%s', topdir)
+
+        self._topdir = os.path.expanduser(topdir)
+
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify not supported')
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._wd = {}
+        """ wd -> (year, month) (トップディレクトリ: (None, None)) """
+
+        self._add_tree()
+
+    def __str__(self):
+        """ __str__ """
+        return 'inotify:%s, watches:%s' % (self._topdir, len(self._wd))
+
+    def close(self) -> None:
+        """ close """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watch(self, pathname: str, year: int = None,
+                   month: int = None) -> bool:
+        """
+        Returns
+        -------
+        result: bool
+            False: ディレクトリがない
+        """
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(pathname), IN_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, os.strerror(err), pathname)
+
+        self._wd[wd] = (year, month)
+        return True
+
+    def _add_month(self, year: int, month: int) -> list:
+        """
+        月のディレクトリを監視する
+
+        Returns
+        -------
+        date_list: list of datetime.date
+            既にあるデータファイル
+            (監視を始める前に作られたかも知れない)
+        """
+        month_dir = os.path.join(self._topdir, '%04d' % year, '%02d' % month)
+        if not self._add_watch(month_dir, year, month):
+            return []
+
+        date_list = []
+        try:
+            for ent in os.scandir(month_dir):
+                (ok, date) = _parse_name(ent.name, year, month)
+                if ok:
+                    date_list.append(date)
+        except FileNotFoundError:
+            pass
+
+        return date_list
+
+    def _add_year(self, year: int) -> list:
+        """
+        年のディレクトリと、その月のディレクトリを監視する
+
+        Returns
+        -------
+        date_list: list of datetime.date
+            既にあるデータファイル
+        """
+        year_dir = os.path.join(self._topdir, '%04d' % year)
+        if not self._add_watch(year_dir, year):
+            return []
+
+        try:
+            m_ents = list(os.scandir(year_dir))
+        except FileNotFoundError:
+            return []
+
+        date_list = []
+        for m_ent in m_ents:
+            if m_ent.name.isdigit() and m_ent.is_dir():
+                date_list += self._add_month(year, int(m_ent.name))
+
+        return date_list
+
+    def _add_tree(self) -> list:
+        """
+        Returns
+        -------
+        year_list: list of int
+            監視対象の年
+        """
+        if not self._add_watch(self._topdir):
+            raise OSError(errno.ENOENT, 'not found', self._topdir)
+
+        year_list = []
+        for ent in os.scandir(self._topdir):
+            if ent.name.isdigit() and ent.is_dir():
+                year_list.append(int(ent.name))
+                self._add_year(int(ent.name))
+
+        return year_list
+
+    def _read_events(self) -> bytes:
+        buf = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            buf.append(data)
+
+        return b''.join(buf)
+
+    def poll(self) -> set:
+        """
+        Returns
+        -------
+        changed: set
+            前回から、追加・削除・変更されたもの
+
+        Notes
+        -----
+        イベントが溢れた場合は、全ての年(int)と ToDo(None) を返す。
+        """
+        changed = set()
+
+        buf = self._read_events()
+        pos = 0
+        while pos + _EVENT.size <= len(buf):
+            (wd, mask, cookie, name_len) = _EVENT.unpack_from(buf, pos)
+            name = buf[pos + _EVENT.size:pos + _EVENT.size + name_len]
+            name = os.fsdecode(name.rstrip(b'\0'))
+            pos += _EVENT.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                self._mylog.warning('event queue overflow')
+                for wd1 in list(self._wd):
+                    self._libc.inotify_rm_watch(self._fd, wd1)
+                self._wd = {}
+                changed.update(self._add_tree())
+                changed.add(None)
+                continue
+
+            if mask & IN_IGNORED:
+                self._wd.pop(wd, None)
+                continue
+
+            try:
+                (year, month) = self._wd[wd]
+            except KeyError:
+                continue
+
+            if mask & IN_ISDIR:
+                if not (mask & (IN_CREATE | IN_MOVED_TO)) or \
+                   not name.isdigit() or month is not None:
+                    continue
+
+                # 新しい年・月のディレクトリ
+                if year is None:
+                    changed.update(self._add_year(int(name)))
+                else:
+                    changed.update(self._add_month(year, int(name)))
+                continue
+
+            (ok, key) = _parse_name(name, year, month)
+            if ok:
+                changed.add(key)
+
+        return changed
+
+
+def new_watcher(topdir: str, debug=False):
+    """
+    ``InotifyWatcher``が使えれば使い、使えなければ``PollWatcher``を使う
+
+    Parameters
+    ----------
+    topdir: str
+
+    Returns
+    -------
+    watcher: InotifyWatcher or PollWatcher
+    """
+    try:
+        return InotifyWatcher(topdir, debug=debug)
+    except (OSError, AttributeError) as ex:
+        get_logger(__name__, debug).info(
+            'inotify: %s: %s .. polling', type(ex).__name__, ex)
+
+    return PollWatcher(topdir, debug=debug)
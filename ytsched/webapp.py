@@ -9,9 +9,15 @@ __author__ = 'Yoichi Tanibayashi'
 __date__ = '2021/01'
 
 import os
+import gc
 import sys
+import signal
+import datetime
 import tornado.ioloop
+import tornado.autoreload
 import tornado.httpserver
+import tornado.netutil
+import tornado.process
 import tornado.web
 
 from . import __prog_name__ as PROG_NAME
@@ -20,7 +26,16 @@ from . import __version__ as VERSION
 
 from .main_handler import MainHandler
 from .edit_handler import EditHandler
+from .days_handler import DaysHandler
 from .ytsched import SchedData
+from .async_data import AsyncSchedData
+from .fragcache import FragmentCache
+from .confstore import ConfStore
+from . import snapshot
+from . import watcher
+from . import broadcast
+from . import journal
+from . import ngram
 from .my_logger import get_logger
 
 
@@ -37,11 +52,31 @@ class WebServer:
 
     DEF_SIZE_LIMIT = 100*1024*1024  # 100MB
 
+    DEF_SNAPSHOT_INTERVAL = 0  # minutes
+    INDEX_SAVE_INTERVAL = 10  # minutes
+    DEF_WATCH_INTERVAL = 0  # sec
+    PARENT_CHECK_INTERVAL = 1  # sec
+    SYNC_INTERVAL = 0.2  # sec
+    COMPACT_INTERVAL = 10  # sec
+
     def __init__(self, port: int = DEF_PORT,
                  webroot: str = DEF_WEBROOT,
                  datadir: str = DEF_DATADIR,
                  days: int = MainHandler.DEF_DAYS,
                  size_limit: int = DEF_SIZE_LIMIT,
+                 preload_years: int = 0,
+                 lazy: bool = False,
+                 columnar: bool = False,
+                 snapshot_interval: int = DEF_SNAPSHOT_INTERVAL,
+                 watch_interval: int = DEF_WATCH_INTERVAL,
+                 search_index: bool = False,
+                 stream: bool = False,
+                 fragment_cache: bool = False,
+                 io_workers: int = AsyncSchedData.DEF_WORKERS,
+                 workers: int = 1,
+                 use_journal: bool = False,
+                 conf_cookie: bool = False,
+                 cache_mb: float = SchedData.DEF_CACHE_MB,
                  version: bool = False,
                  debug: bool = False):
         """ Constructor
@@ -59,6 +94,63 @@ class WebServer:
         size_limit: int
             max upload size
 
+        preload_years: int
+            起動時に、何年前からのデータを先読みするか (0: しない)
+
+        lazy: bool
+            データのフィールドを、参照された時に変換する
+
+        columnar: bool
+            データを、年ごとの列指向ストアで保持する
+
+        snapshot_interval: int
+            解析済みデータのスナップショットを保存する間隔(分)
+            (0: スナップショットを使わない(既定))
+            起動時に読み込み、終了時・自動リロード時にも保存する。
+
+        watch_interval: int
+            サーバー以外によるデータファイルの変更を確認する間隔(秒)
+            (0: 確認しない(既定))
+
+        search_index: bool
+            検索用の N-gram インデックスを使い、全期間を検索する
+            (起動時に読み込み(なければ生成し)、定期的に保存する)
+            False: 検索は、直近の期間のみ
+
+        stream: bool
+            ページを分割して、目的の日に近い方から少しずつ送る
+
+        fragment_cache: bool
+            描画済みの日ごとの HTML をキャッシュする
+            (編集後は、今日の周辺を描画し直しておく)
+            False: 毎回描画する(既定)
+
+        io_workers: int
+            データファイル・設定ファイルを読み書きするスレッド数
+            (0: IOLoop のスレッドで読み書きする)
+
+        workers: int
+            サーバーのプロセス数
+            2以上: 先読みしたキャッシュを共有(copy-on-write)するように、
+            起動処理の後に fork する (自動リロードはしない)
+            変更された日は、他のプロセスにも知らせる。
+            設定ファイルへの変更は、まとめずに、すぐに書き込む。
+
+        use_journal: bool
+            予定の追加・削除を、データファイルを書き直さずに、
+            ジャーナルに追記する (書き込みの時間が、ファイルの大きさによらない)
+            データファイルへの反映は、``COMPACT_INTERVAL``秒ごとと、
+            終了時に行う。(起動時には、反映していない変更を適用する)
+
+        conf_cookie: bool
+            フィルター文字列・検索文字列などの表示の設定を、
+            設定ファイルではなく、クライアントのクッキーに保存する
+            (設定ファイルの値は、クッキーがない場合の初期値になる)
+
+        cache_mb: float
+            解析済みデータのキャッシュのメモリ使用量(推定値)の上限 (MB)
+            (超えた分は、最近参照されていない日から捨てる)
+
         version: bool
         """
         self._dbg = debug
@@ -66,13 +158,48 @@ class WebServer:
         self._log.debug('port=%s, webroot=%s, datadir=%s, days=%s',
                         port, webroot, datadir, days)
         self._log.debug('size_limit=%s', size_limit)
+        self._log.debug('preload_years=%s, lazy=%s, columnar=%s',
+                        preload_years, lazy, columnar)
+        self._log.debug('snapshot_interval=%s, watch_interval=%s',
+                        snapshot_interval, watch_interval)
+        self._log.debug('search_index=%s, stream=%s', search_index, stream)
+        self._log.debug('fragment_cache=%s, io_workers=%s, workers=%s',
+                        fragment_cache, io_workers, workers)
+        self._log.debug('use_journal=%s, conf_cookie=%s, cache_mb=%s',
+                        use_journal, conf_cookie, cache_mb)
 
         self._port = port
         self._webroot = os.path.expanduser(webroot)
         self._datadir = os.path.expanduser(datadir)
-        self._sd = SchedData(self._datadir, debug=self._dbg)
+        self._sd = SchedData(self._datadir, lazy=lazy, columnar=columnar,
+                             search_index=search_index, cache_mb=cache_mb,
+                             debug=self._dbg)
+        self._asd = AsyncSchedData(self._sd, io_workers, debug=self._dbg)
+        # 複数のプロセスで動かす場合は、次のリクエストを他のプロセスが
+        # 処理しても、変更後の設定を読み込むように、すぐに書き込む
+        self._conf_store = ConfStore(
+            os.path.join(self._datadir, MainHandler.CONF_FNAME),
+            flush_delay=ConfStore.DEF_FLUSH_DELAY if workers <= 1 else 0,
+            run=self._asd.run, debug=self._dbg)
         self._days = days
         self._size_limit = size_limit
+        self._preload_years = preload_years
+        self._snapshot_interval = snapshot_interval
+        self._snapshot_path = os.path.join(self._datadir,
+                                           snapshot.DEF_FILENAME)
+        self._watch_interval = watch_interval
+        self._search_index = search_index
+        self._index_path = os.path.join(self._datadir, ngram.DEF_FILENAME)
+        self._watcher = None
+        self._workers = workers
+        self._use_journal = use_journal
+        self._journal_path = os.path.join(self._datadir,
+                                          journal.DEF_FILENAME)
+
+        self._frag = None
+        if fragment_cache:
+            self._frag = FragmentCache(debug=self._dbg)
+            self._sd.add_listener(self._frag.discard)
 
         if version:
             print('%s %s by %s' % (PROG_NAME, VERSION, AUTHOR))
@@ -91,12 +218,14 @@ class WebServer:
 
                 (r'%s/edit' % self.URL_PREFIX, EditHandler),
                 (r'%s/edit/' % self.URL_PREFIX, EditHandler),
+
+                (r'%s/days' % self.URL_PREFIX, DaysHandler),
             ],
             static_path=os.path.join(self._webroot, "static"),
             static_url_prefix=self.URL_PREFIX + '/static/',
             template_path=os.path.join(self._webroot, "templates"),
 
-            autoreload=True,
+            autoreload=(self._workers <= 1),
 
             title=PROG_NAME,
             author=AUTHOR,
@@ -106,7 +235,11 @@ class WebServer:
 
             datadir=self._datadir,
             days=self._days,
-            sd=self._sd,
+            sd=self._asd,
+            stream=stream,
+            frag_cache=self._frag,
+            conf_store=self._conf_store,
+            conf_cookie=conf_cookie,
 
             debug=self._dbg
         )
@@ -116,13 +249,172 @@ class WebServer:
             self._app, max_buffer_size=self._size_limit)
         self._log.debug('svr=%s', self._svr.__dict__)
 
+    def save_snapshot(self):
+        """
+        スナップショットと検索インデックスを保存する
+        (失敗しても、サーバーは継続する)
+        """
+        if self._snapshot_interval > 0:
+            try:
+                self._sd.save_snapshot(self._snapshot_path)
+            except Exception as ex:
+                self._log.warning('%s: %s', type(ex).__name__, ex)
+
+        if self._search_index:
+            try:
+                self._sd.save_index(self._index_path)
+            except Exception as ex:
+                self._log.warning('%s: %s', type(ex).__name__, ex)
+
+    async def compact_journal(self):
+        """
+        ジャーナルの変更を、データファイルに反映する
+        (失敗しても、サーバーは継続する。次回に再び反映する)
+        """
+        try:
+            await self._asd.compact_journal()
+        except Exception as ex:
+            self._log.warning('%s: %s', type(ex).__name__, ex)
+
+    async def sync(self):
+        """
+        他のプロセスが変更した日を、キャッシュに反映する
+        """
+        try:
+            await self._asd.sync()
+        except Exception as ex:
+            self._log.warning('%s: %s', type(ex).__name__, ex)
+
+    async def check_changes(self):
+        """
+        サーバー以外によるデータファイルの変更を、キャッシュに反映する
+        """
+        try:
+            changed = self._watcher.poll()
+            if changed:
+                await self._asd.revalidate(changed)
+        except Exception as ex:
+            self._log.warning('%s: %s', type(ex).__name__, ex)
+
+    def fork_workers(self) -> int:
+        """
+        ソケットを開いてから、``workers``個のプロセスを fork する
+        (IOLoop を作る前に呼ぶこと)
+
+        先読みしたキャッシュのページは、fork 後も共有される(copy-on-write)。
+        GC がページに書き込まないように、fork 前のオブジェクトは
+        GC の対象外にする(``gc.freeze()``)。
+
+        親プロセスは、終了したプロセスを再起動し続け、ここから戻らない。
+
+        Returns
+        -------
+        task_id: int
+            0 .. workers - 1
+        """
+        ring = broadcast.ChangeRing(
+            os.path.join(self._datadir, broadcast.DEF_LOCK_FILENAME),
+            max(self._sd.range_version(datetime.date.min, datetime.date.max),
+                self._sd.version(None)))
+        sockets = tornado.netutil.bind_sockets(self._port)
+
+        gc.collect()
+        gc.freeze()
+
+        parent_pid = os.getpid()
+        task_id = tornado.process.fork_processes(self._workers)
+
+        self._asd.set_ring(ring)
+        self._svr.add_sockets(sockets)
+
+        def check_parent():
+            if os.getppid() != parent_pid:
+                self._log.warning('parent process exited')
+                tornado.ioloop.IOLoop.current().stop()
+
+        tornado.ioloop.PeriodicCallback(
+            check_parent, self.PARENT_CHECK_INTERVAL * 1000).start()
+
+        # 他のプロセスの変更は、リクエストの処理とは別に反映する
+        tornado.ioloop.PeriodicCallback(
+            self.sync, self.SYNC_INTERVAL * 1000).start()
+
+        return task_id
+
     def main(self):
         """ main """
         self._log.debug('')
 
-        self._svr.listen(self._port)
+        if self._watch_interval > 0:
+            # 先読みなどの間の変更も検出するため、先に開始する
+            self._watcher = watcher.new_watcher(self._datadir,
+                                                debug=self._dbg)
+            self._log.info('watcher: %s', self._watcher)
+
+        if self._snapshot_interval > 0:
+            self._sd.load_snapshot(self._snapshot_path)
+
+        if self._search_index:
+            self._sd.load_index(self._index_path)
+
+        if self._preload_years > 0:
+            date_from = datetime.date.today() - datetime.timedelta(
+                days=round(365.25 * self._preload_years))
+            self._sd.preload(date_from)
+
+        if self._use_journal:
+            self._sd.open_journal(self._journal_path)
+
+        # SIGTERM でも、終了処理(スナップショット等の保存)を行う
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        task_id = 0
+        if self._workers > 1:
+            task_id = self.fork_workers()
+            self._log.info('worker %s: pid=%s', task_id, os.getpid())
+        else:
+            self._svr.listen(self._port)
+
+        # 変更の確認と保存は、一つのプロセスのみで行う
+        # (他のプロセスには、変更された日を知らせる)
+        main_task = (task_id == 0)
+
+        if self._workers <= 1:
+            tornado.autoreload.add_reload_hook(self._conf_store.flush_now)
+
+        if self._watcher is not None and main_task:
+            tornado.ioloop.PeriodicCallback(
+                self.check_changes, self._watch_interval * 1000).start()
+
+        if (self._snapshot_interval > 0 or self._search_index) and main_task:
+            if self._workers <= 1:
+                tornado.autoreload.add_reload_hook(self.save_snapshot)
+            tornado.ioloop.PeriodicCallback(
+                self.save_snapshot,
+                (self._snapshot_interval or self.INDEX_SAVE_INTERVAL)
+                * 60 * 1000).start()
+
+        if self._use_journal and main_task:
+            tornado.ioloop.PeriodicCallback(
+                self.compact_journal, self.COMPACT_INTERVAL * 1000).start()
+
         self._log.info('start server: run forever ..')
 
-        tornado.ioloop.IOLoop.current().start()
+        try:
+            tornado.ioloop.IOLoop.current().start()
+        finally:
+            if self._watcher is not None:
+                self._watcher.close()
+            try:
+                self._conf_store.flush_now()
+            except Exception as ex:
+                self._log.warning('%s: %s', type(ex).__name__, ex)
+            if main_task:
+                if self._use_journal:
+                    try:
+                        self._sd.compact_journal()
+                    except Exception as ex:
+                        self._log.warning('%s: %s', type(ex).__name__, ex)
+                self.save_snapshot()
 
         self._log.debug('done')
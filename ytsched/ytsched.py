@@ -9,11 +9,22 @@ __author__  = 'Yoichi Tanibayashi'
 __date__    = '2021/01'
 
 import time
+import sys
 import os
 import shutil
-import re
+import bisect
+import calendar
 import datetime
+import itertools
 import collections
+import concurrent.futures
+from . import htmlcodec
+from . import dayparser
+from . import colstore
+from . import packfile
+from . import snapshot
+from . import ngram
+from . import journal
 from .my_logger import get_logger
 
 
@@ -28,28 +39,7 @@ def htmlstr2text(intext: str) -> str:
     outtext: str
 
     """
-    resub_tbl = {
-        r'&amp;#160;': ' ',
-        r'&gt;': '>',
-        r'&lt;': '<',
-        # r'&amp;': '&',
-        r'&nbsp:': ' ',
-        r'&#160;': ' ',
-        r'\<BR *\/*\>': '\n'
-    }
-
-    outtext = intext
-    # outtext = html2text.html2text(intext)
-
-    outtext = outtext.replace('&nbsp;', ' ')
-    outtext = outtext.replace('（', '(')
-    outtext = outtext.replace('）', ')')
-
-    for k in resub_tbl:
-        # outtext = outtext.replace(k, replace_tbl[k])
-        outtext = re.sub(k, resub_tbl[k], outtext, flags=re.IGNORECASE)
-
-    return outtext
+    return htmlcodec.decode(intext)
 
 
 def text2htmlstr(intext: str) -> str:
@@ -64,23 +54,26 @@ def text2htmlstr(intext: str) -> str:
     outtext: str
         HTML text
     """
-    outtext = intext.rstrip('\n')
-
-#    outtext = outtext.replace('&', '&amp;')
-#    outtext = outtext.replace('>', '&gt;')
-#    outtext = outtext.replace('<', '&lt;')
-#    outtext = outtext.replace(' ', '&nbsp;')
-
-    outtext = outtext.replace('\t', ' ')
-    outtext = outtext.replace('\r', '')
-    outtext = outtext.replace('\n', '<br />')
-    return outtext
+    return htmlcodec.encode(intext)
 
 
 class SchedDataEnt:
     """
     スケジュール・データ・エンティティ
+
+    Notes
+    -----
+    メモリ節約のため、``__slots__``を使う。
+    ToDo・休日・重要・取り消しの判定は、生成時に一度だけ行い、
+    ``type``, ``title``が変更された時に更新する。
+    ``type``, ``place``は、同じ文字列が多いので``sys.intern()``する。
+    検索用文字列と、小文字にした各フィールドは、最初に照合した時に保持し、
+    ``type``, ``title``, ``place``, ``detail``が変更された時に捨てる。
     """
+    __slots__ = ('sde_id', 'date', 'time_start', 'time_end',
+                 '_type', '_title', '_place', '_detail', '_flags',
+                 '_search', '_fields')
+
     TIME_NULL = ':-:'
     TITLE_NULL = ''
 
@@ -98,21 +91,43 @@ class SchedDataEnt:
         'x'
     ]
 
-    _mylog = get_logger(__name__, False)
+    FLAG_TODO = 0x01
+    FLAG_HOLIDAY = 0x02
+    FLAG_IMPORTANT = 0x04
+    FLAG_CANCELED = 0x08
+    FLAG_TITLE_DONE = 0x10
+    """ ``title``による判定済み """
+
+    # メモリ使用量の推定 (tracemalloc で測定した値)
+    EST_BYTES = 320
+    EST_CHAR_BYTES = 2
+
+    _mylog = get_logger('SchedDataEnt', False)
 
     def __init__(self, sde_id=None,
                  date: datetime.date = datetime.date.today(),
                  time_start: datetime.time = '',
                  time_end: datetime.time = '',
                  sde_type='', title=TITLE_NULL, place='', detail='',
-                 debug=False):
-        """ Constructor """
-        self._dbg = debug
-        self.__class__._mylog = get_logger(self.__class__.__name__,
-                                           self._dbg)
-        self._mylog.debug('(%s)%s %s-%s [%s] %s @%s:\'%s\'',
-                          sde_id, date, time_start, time_end,
-                          sde_type, title, place, detail)
+                 decode_detail=True, debug=False):
+        """ Constructor
+
+        Parameters
+        ----------
+        decode_detail: bool
+            ``detail``をHTML文字列としてテキストに変換する。
+            変換済みの場合は False
+        """
+        # ロガーの取得・デバッグ出力は、大量に生成されるので、
+        # デバッグ時のみ行う
+        if debug:
+            self.__class__._mylog = get_logger(self.__class__.__name__, debug)
+            self._mylog.debug('(%s)%s %s-%s [%s] %s @%s:\'%s\'',
+                              sde_id, date, time_start, time_end,
+                              sde_type, title, place, detail)
+
+        self._flags = 0
+        self._search = None
 
         self.sde_id = sde_id
         self.date = date
@@ -120,8 +135,10 @@ class SchedDataEnt:
         self.time_end = time_end
         self.type = sde_type
         self.title = title
-        self.place = place
-        self.detail = htmlstr2text(detail)
+        self.place = sys.intern(place)
+        self.detail = detail
+        if decode_detail:
+            self.detail = htmlstr2text(detail)
 
         if not self.title:
             self.title = self.TITLE_NULL
@@ -129,6 +146,78 @@ class SchedDataEnt:
         if not self.sde_id:
             self.sde_id = SchedDataEnt.new_id()
 
+    @property
+    def type(self) -> str:
+        return self._type
+
+    @type.setter
+    def type(self, value: str):
+        self._type = sys.intern(value)
+        self._search = None
+
+        flags = self._flags & ~(self.FLAG_TODO | self.FLAG_HOLIDAY)
+        if value:
+            if value.startswith(self.TYPE_PREFIX_TODO):
+                flags |= self.FLAG_TODO
+            if value in self.TYPE_HOLYDAY:
+                flags |= self.FLAG_HOLIDAY
+        self._flags = flags
+
+    @property
+    def title(self) -> str:
+        return self._title
+
+    @title.setter
+    def title(self, value: str):
+        self._title = value
+        self._search = None
+        self._set_title_flags(value)
+
+    @property
+    def place(self) -> str:
+        return self._place
+
+    @place.setter
+    def place(self, value: str):
+        self._place = value
+        self._search = None
+
+    @property
+    def detail(self) -> str:
+        return self._detail
+
+    @detail.setter
+    def detail(self, value: str):
+        self._detail = value
+        self._search = None
+
+    def _set_title_flags(self, title: str) -> int:
+        """
+        ``title``による判定(重要・取り消し)を更新する
+
+        Returns
+        -------
+        flags: int
+        """
+        flags = self._flags & ~(self.FLAG_IMPORTANT | self.FLAG_CANCELED)
+        flags |= self.FLAG_TITLE_DONE
+
+        if title:
+            title_l = title.lower()
+            if title_l.startswith(tuple(self.TITLE_PREFIX_IMPORTANT)):
+                flags |= self.FLAG_IMPORTANT
+            if title_l.startswith(tuple(self.TITLE_PREFIX_CANCELED)):
+                flags |= self.FLAG_CANCELED
+
+        self._flags = flags
+        return flags
+
+    def _title_flags(self) -> int:
+        flags = self._flags
+        if not flags & self.FLAG_TITLE_DONE:
+            flags = self._set_title_flags(self.title)
+        return flags
+
     def __str__(self):
         """ str(self) """
         out_str = '(%s) ' % (self.sde_id)
@@ -179,11 +268,28 @@ class SchedDataEnt:
         search_str: str
 
         """
-        search_str = '#%s +%s @%s detail:%s' % (
-            self.type, self.title, self.place,
-            self.detail.replace('\n', ' '))
+        if self._search is None:
+            self._set_search()
+        return self._search
+
+    def search_fields(self) -> tuple:
+        """
+        Returns
+        -------
+        (sde_type, title, place, detail): (str, str, str, str)
+            小文字にしたもの (``detail``の改行は空白にする)
+            ``query.split_fields(self.search_str())``と同じ
+        """
+        if self._search is None:
+            self._set_search()
+        return self._fields
 
-        return search_str.lower()
+    def _set_search(self) -> None:
+        """ 検索用文字列と、小文字にした各フィールドを保持する """
+        fields = (self.type.lower(), self.title.lower(), self.place.lower(),
+                  self.detail.replace('\n', ' ').lower())
+        self._fields = fields
+        self._search = '#%s +%s @%s detail:%s' % fields
 
     @classmethod
     def new_id(cls):
@@ -208,42 +314,32 @@ class SchedDataEnt:
     def is_todo(self):
         """
         """
-        # self._mylog.debug('')
-        if self.type:
-            return self.type.startswith(self.TYPE_PREFIX_TODO)
-
-        return False
+        return bool(self._flags & self.FLAG_TODO)
 
     def is_holiday(self):
         """
         """
-        # self._mylog.debug('')
-        if self.type == '':
-            return False
-        return self.type in self.TYPE_HOLYDAY
+        return bool(self._flags & self.FLAG_HOLIDAY)
 
     def is_important(self):
         """
         """
-        if self.title == '':
-            return False
-        for start_str in self.TITLE_PREFIX_IMPORTANT:
-            if self.title.lower().startswith(start_str):
-                return True
-
-        return False
+        return bool(self._title_flags() & self.FLAG_IMPORTANT)
 
     def is_canceled(self):
         """
         """
-        if self.title == '':
-            return False
+        return bool(self._title_flags() & self.FLAG_CANCELED)
 
-        for start_str in self.TITLE_PREFIX_CANCELED:
-            if self.title.lower().startswith(start_str):
-                return True
-
-        return False
+    def est_bytes(self) -> int:
+        """
+        Returns
+        -------
+        nbytes: int
+            メモリ使用量の推定値
+        """
+        return self.EST_BYTES + self.EST_CHAR_BYTES * (
+            len(self.title) + len(self.place) + len(self.detail))
 
     def get_sortkey(self):
         """
@@ -313,21 +409,120 @@ class SchedDataEnt:
         """
         self._mylog.debug('t1=%s, t2=%s', t1, t2)
 
-        if t1 is None or len(t1) < 2:
-            h1 = ''
-            m1 = ''
-        else:
-            h1 = '02d' % t1[0]
-            m1 = '02d' % t1[1]
+        self.time_start = ''
+        if t1 is not None and len(t1) >= 2:
+            self.time_start = datetime.time(t1[0], t1[1])
 
-        if t2 is None or len(t2) < 2:
-            h2 = ''
-            m2 = ''
-        else:
-            h2 = '02d' % t2[0]
-            m2 = '02d' % t2[1]
+        self.time_end = ''
+        if t2 is not None and len(t2) >= 2:
+            self.time_end = datetime.time(t2[0], t2[1])
+
+
+class LazySchedDataEnt(SchedDataEnt):
+    """
+    遅延変換版のスケジュール・データ・エンティティ
+
+    読み込んだ行と、各フィールドの開始位置だけを保持し、
+    ``title``, ``place``, ``detail``, 時刻は、最初に参照された時に変換する。
+
+    Notes
+    -----
+    ``type``は、``is_holiday()``, ``is_todo()``のために、生成時に変換する。
+    変換した値は、``SchedDataEnt``のスロットに保持する。
+    """
+    __slots__ = ('_line', '_offsets', '_min_start', '_min_end')
+
+    EST_BYTES = 480
+
+    def __init__(self, line: str, offsets: tuple, date: datetime.date,
+                 min_start: int, min_end: int):
+        """ Constructor
+
+        Parameters
+        ----------
+        line: str
+            データファイルの1行 (変換前)
+        offsets: tuple of int
+            ``dayparser.field_offsets()``
+        date: datetime.date
+        min_start, min_end: int
+            0時からの分 (``dayparser.MIN_NULL``: 時刻なし)
+        """
+        self._line = line
+        self._offsets = offsets
+        self._min_start = min_start
+        self._min_end = min_end
+
+        self._flags = 0
+        self._search = None
+        self.date = date
+        self.sde_id = self._field(0)
+        self.type = htmlstr2text(self._field(3))
+
+    def est_bytes(self) -> int:
+        """
+        Returns
+        -------
+        nbytes: int
+            メモリ使用量の推定値 (変換前の行から。変換すると増える)
+        """
+        return self.EST_BYTES + self.EST_CHAR_BYTES * len(self._line)
+
+    def _field(self, i: int) -> str:
+        """ 変換前のフィールド """
+        return self._line[self._offsets[i]:self._offsets[i + 1] - 1]
+
+    @property
+    def title(self):
+        try:
+            return self._title
+        except AttributeError:
+            self.title = htmlstr2text(self._field(4)) or self.TITLE_NULL
+            return self._title
+
+    @title.setter
+    def title(self, value):
+        SchedDataEnt.title.fset(self, value)
+
+    @property
+    def place(self):
+        try:
+            return self._place
+        except AttributeError:
+            self._place = sys.intern(htmlstr2text(self._field(5)))
+            return self._place
+
+    @place.setter
+    def place(self, value):
+        SchedDataEnt.place.fset(self, value)
 
-        self.time = '%s:%s-%s:%s' % (h1, m1, h2, m2)
+    @property
+    def detail(self):
+        try:
+            return self._detail
+        except AttributeError:
+            self._detail = htmlstr2text(self._field(6))
+            return self._detail
+
+    @detail.setter
+    def detail(self, value):
+        SchedDataEnt.detail.fset(self, value)
+
+    @property
+    def time_start(self):
+        return dayparser.min2time(self._min_start)
+
+    @time_start.setter
+    def time_start(self, value):
+        self._min_start = dayparser.time2min(value)
+
+    @property
+    def time_end(self):
+        return dayparser.min2time(self._min_end)
+
+    @time_end.setter
+    def time_end(self, value):
+        self._min_end = dayparser.time2min(value)
 
 
 class SchedDataFile:
@@ -339,20 +534,35 @@ class SchedDataFile:
     TODO_PATH_FORMAT = '%s/ToDo.cgi'
 
     BACKUP_EXT = '.bak'
+    TMP_EXT = '.tmp'
     ENCODE = ['utf-8', 'euc_jp']
 
+    EST_BYTES = 450
+
     def __init__(self, date: datetime.date = None, topdir=DEF_TOP_DIR,
-                 debug=False):
+                 lazy=False, sde_list=None, debug=False):
         """
         date: datetime.date
             None: ToDo
         topdir: str
+        lazy: bool
+            True: ``LazySchedDataEnt``で読み込む
+        sde_list: list of SchedDataEnt
+            None以外の場合は、ファイルを読み込まず、これを使う
+            (列指向ストアから生成したビュー)
 
+        Attributes
+        ----------
+        nbytes: int
+            メモリ使用量の推定値 (``add_sde()``, ``del_sde()``で更新する)
         """
         self._dbg = debug
         self._mylog = get_logger(__class__.__name__, self._dbg)
-        self._mylog.debug('date=%s, topdir=%s', date, topdir)
+        if self._dbg:
+            self._mylog.debug('date=%s, topdir=%s, lazy=%s',
+                              date, topdir, lazy)
 
+        self._lazy = lazy
         self.date = date
         self.topdir = os.path.expanduser(topdir)
 
@@ -363,7 +573,15 @@ class SchedDataFile:
         self.dirname  = '/'.join(pl)
 
         self.is_holiday = False
-        self.sde = self.load()
+        self.stat_key = None
+        if sde_list is None:
+            self.sde = self.load()
+        else:
+            self.sde = sde_list
+            self.is_holiday = any([sde.is_holiday() for sde in sde_list])
+
+        self.nbytes = self.EST_BYTES + sum(
+            [sde.est_bytes() for sde in self.sde])
 
     def __str__(self):
         """ __str__ """
@@ -386,9 +604,9 @@ class SchedDataFile:
         """
         if date:
             pathname = self.PATH_FORMAT % (topdir,
-                                           date.strftime('%Y'),
-                                           date.strftime('%m'),
-                                           date.strftime('%d'))
+                                           '%04d' % date.year,
+                                           '%02d' % date.month,
+                                           '%02d' % date.day)
         else:
             pathname = self.TODO_PATH_FORMAT % (topdir)
 
@@ -403,22 +621,33 @@ class SchedDataFile:
         初期化時に自動的に実行される
 
         休日・祝日が含まれる場合は、``is_holiday``をTrueにする
+
+        ``.cgi``ファイルがない場合は、パックファイル(``packfile``)から読み込む
+
+        読み込んだファイルの``snapshot.stat_key()``を、``stat_key``に記録する
         """
         # self._mylog.debug('')
 
         self.is_holiday = False
+        self.stat_key = None
         ok = False
         for enc in self.ENCODE:
             # self._mylog.debug('enc=%s', enc)
             try:
                 with open(self.pathname, encoding=enc) as f:
-                    lines = f.readlines()
+                    # 読み込む前に記録する (途中で更新された場合は不一致になる)
+                    self.stat_key = snapshot.stat_key(os.fstat(f.fileno()))
+                    text = f.read()
                     ok = True
                     break
             except FileNotFoundError:
-                self._mylog.debug('%s: not found .. ignored',
-                                  self.pathname)
-                return []
+                text = self._load_packed()
+                if text is None:
+                    self._mylog.debug('%s: not found .. ignored',
+                                      self.pathname)
+                    return []
+                ok = True
+                break
             except UnicodeDecodeError:
                 self._mylog.debug('%s: decode error .. try next ..', enc)
 
@@ -426,48 +655,88 @@ class SchedDataFile:
             self._mylog.warning('%s: invalid encoding', self.pathname)
             return []
 
-        # self._mylog.debug('lines=%s', lines)
-        out = []
-        for l in lines:
-            d = [htmlstr2text(d1) for d1 in l.split('\t')]
-            # self._mylog.debug('d=%s', d)
+        out = self.parse_text(text)
+
+        for sde in out:
+            if sde.is_holiday():
+                self.is_holiday = True
+                self._mylog.debug('is_holiday=%s', self.is_holiday)
+                break
+
+        return out
+
+    def parse_text(self, text: str) -> list:
+        """
+        データファイルの内容(``mk_dataline()``の行)を解析する
+
+        Parameters
+        ----------
+        text: str
 
-            date1 = d[1].split('/')
-            date2 = datetime.date(int(date1[0]),
-                                  int(date1[1]),
-                                  int(date1[2]))
+        Returns
+        -------
+        sde_list: list of SchedDataEnt
+        """
+        if self._lazy:
+            lines = htmlcodec.split_lines(text)
+            (out, errors) = dayparser.parse_lazy(lines, self.date,
+                                                 LazySchedDataEnt)
+        else:
+            # ファイル全体を一括してテキストに変換してから、分割する
+            lines = htmlcodec.decode_lines(text)
+            (out, errors) = dayparser.parse(lines, self.date, self._mk_sde)
 
-            time1 = d[2].split('-')
+        for (lineno, reason, line) in errors:
+            self._mylog.warning('%s:%s: %s .. skipped: %a',
+                                self.pathname, lineno, reason, line)
 
-            time_start1 = time1[0].split(':')
-            # self._mylog.debug('time_start1=%s', time_start1)
+        return out
 
-            time_end1 = time1[1].split(':')
-            # self._mylog.debug('time_end1=%s', time_end1)
+    def _load_packed(self) -> str:
+        """
+        パックファイルから読み込む
 
-            if time_start1[0]:
-                time_start2 = datetime.time(
-                    int(time_start1[0]) % 24, int(time_start1[1]) % 60)
-            else:
-                time_start2 = ''
+        Returns
+        -------
+        text: str or None
+            None: パックファイルにもない
+        """
+        if self.date is None:
+            return None
 
-            if time_end1[0]:
-                time_end2 = datetime.time(
-                    int(time_end1[0]) % 24, int(time_end1[1]) % 60)
-            else:
-                time_end2 = ''
+        pack = packfile.open_pack(self.topdir, self.date.year)
+        if pack is None:
+            return None
 
-            sde = SchedDataEnt(d[0], date2, time_start2, time_end2,
-                               d[3], d[4], d[5], d[6], debug=self._dbg)
-            if not self.is_holiday:
-                self.is_holiday = sde.is_holiday()
-                if self.is_holiday:
-                    self._mylog.debug('is_holiday=%s', self.is_holiday)
+        data = pack.read(self.date)
+        if data is None:
+            return None
 
-            out.append(sde)
+        self.stat_key = ('pack',) + pack.stat_key
 
-        out2 = sorted(out, key=lambda x: x.get_sortkey())
-        return out2
+        for enc in self.ENCODE:
+            try:
+                text = data.decode(enc)
+            except UnicodeDecodeError:
+                self._mylog.debug('%s: decode error .. try next ..', enc)
+                continue
+
+            # ``open()``のテキストモードと同じ改行の変換
+            if '\r' in text:
+                text = text.replace('\r\n', '\n').replace('\r', '\n')
+            return text
+
+        self._mylog.warning('%s: invalid encoding (packed)', self.pathname)
+        return ''
+
+    def _mk_sde(self, sde_id, date, time_start, time_end,
+                sde_type, title, place, detail) -> SchedDataEnt:
+        """
+        ``dayparser.parse()``から呼ばれる
+        """
+        return SchedDataEnt(sde_id, date, time_start, time_end,
+                            sde_type, title, place, detail,
+                            decode_detail=False, debug=self._dbg)
 
     def save(self):
         """
@@ -476,21 +745,51 @@ class SchedDataFile:
         Notes
         -----
         全て上書きされる。
-        ファイルが存在する場合は、バックアップされる。
+        一時ファイルに書いて``fsync()``してから、``os.replace()``で
+        置き換えるので、途中でファイルがなくなったり、壊れたりしない。
+        ファイルが存在する場合は、``.bak``にバックアップされる。
+        (一つのみ。前回のバックアップは上書きされる)
+
+        空になった場合は、ファイルを``.bak``に移す。
+        ただし、パックファイルにある日は、
+        (パックファイルの内容を隠すため)空のファイルを作る。
         """
         self._mylog.debug('')
 
-        if os.path.exists(self.pathname):
-            backup_pathname = self.pathname + self.BACKUP_EXT
-            shutil.move(self.pathname, backup_pathname)
+        backup_pathname = self.pathname + self.BACKUP_EXT
 
         os.makedirs(os.path.dirname(self.pathname), exist_ok=True)
 
-        if self.sde:
-            with open(self.pathname, mode='w') as f:
+        packed = (self.date is not None and
+                  packfile.read_day(self.topdir, self.date) is not None)
+
+        if self.sde or packed:
+            tmp_pathname = self.pathname + self.TMP_EXT
+            with open(tmp_pathname, mode='w') as f:
                 for sde in self.sde:
                     line = sde.mk_dataline()
                     f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.path.exists(self.pathname):
+                # 現在のファイルは残したまま、バックアップする
+                if os.path.exists(backup_pathname):
+                    os.remove(backup_pathname)
+                try:
+                    os.link(self.pathname, backup_pathname)
+                except OSError:
+                    shutil.copy2(self.pathname, backup_pathname)
+
+            os.replace(tmp_pathname, self.pathname)
+
+        elif os.path.exists(self.pathname):
+            os.replace(self.pathname, backup_pathname)
+
+        try:
+            self.stat_key = snapshot.stat_key(os.stat(self.pathname))
+        except FileNotFoundError:
+            self.stat_key = None
 
     def add_sde(self, sde: SchedDataEnt) -> None:
         """
@@ -500,8 +799,19 @@ class SchedDataFile:
 
         """
         self._mylog.debug('sde=%s', sde)
-        self.sde.append(sde)
-        self.sde = sorted(self.sde, key=lambda x: x.get_sortkey())
+
+        # ソート済みなので、挿入位置を二分探索する
+        # (全てのソートキーを作り直さない。同じキーの場合は後ろ)
+        key = dayparser.sortkey(sde)
+        (lo, hi) = (0, len(self.sde))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < dayparser.sortkey(self.sde[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        self.sde.insert(lo, sde)
+        self.nbytes += sde.est_bytes()
 
     def del_sde(self, sde_id: str = None) -> None:
         """
@@ -515,10 +825,12 @@ class SchedDataFile:
             if sde.sde_id == sde_id:
                 self._mylog.debug('DEL:%s', sde)
                 self.sde.remove(sde)
+                self.nbytes -= sde.est_bytes()
                 break
 
-        for sde in self.sde:
-            self._mylog.debug('%s', sde)
+        if self._dbg:
+            for sde in self.sde:
+                self._mylog.debug('%s', sde)
 
     def get_sde(self, sde_id: str = None) -> SchedDataEnt:
         """
@@ -540,6 +852,51 @@ class SchedDataFile:
         return None
 
 
+class EmptySchedDataFile(SchedDataFile):
+    """
+    データファイルが存在しない日のための、共有・不変の SchedDataFile
+
+    Notes
+    -----
+    ディスクにアクセスせず、キャッシュの枠も消費しない。
+    変更が必要な場合は、日付ごとの SchedDataFile を生成すること。
+    """
+    def __init__(self, debug=False):
+        """ Constructor """
+        self._dbg = debug
+        self._mylog = get_logger(__class__.__name__, self._dbg)
+
+        self.date = None
+        self.topdir = ''
+        self.pathname = ''
+        self.filename = ''
+        self.dirname = ''
+
+        self.is_holiday = False
+        self.stat_key = None
+        self.sde = ()
+        self.nbytes = 0
+
+    def __str__(self):
+        """ __str__ """
+        return 'file:(empty), sde:0, holiday:False'
+
+    def load(self):
+        return ()
+
+    def save(self):
+        raise TypeError('%s is immutable' % (self.__class__.__name__))
+
+    def add_sde(self, sde: SchedDataEnt) -> None:
+        raise TypeError('%s is immutable' % (self.__class__.__name__))
+
+    def del_sde(self, sde_id: str = None) -> None:
+        raise TypeError('%s is immutable' % (self.__class__.__name__))
+
+
+EMPTY_SDF = EmptySchedDataFile()
+
+
 class SchedData:
     """ スケジュール・データ
 
@@ -554,30 +911,157 @@ class SchedData:
     date1, date2, .. : datetime.date
     sdf1, sf2, ..    : SchedDataFile
 
+    キャッシュの上限は、日数(``cache_size``)と、メモリ使用量の推定値
+    (``cache_mb``)の両方。各日の推定値(``SchedDataFile.nbytes``)は、
+    読み込んだ時に求め、合計を``_cache_bytes``に保持する。
+    上限を超えたら、最近参照されていないものから一つずつ捨てる。
+
+    _est_bytes = {
+        date1: nbytes1,  (``_sdf_cache``, ``_snapshot_rows``)
+        :
+    }
+
+    データファイルの有無は、月ごとのビットマップで管理する。
+    (一ヶ月分のディレクトリを``os.scandir``で一度だけ走査する)
+    ファイルが存在しない日は、``EMPTY_SDF``を返し、キャッシングしない。
+
+    _exist_map = {
+        (year1, month1): bitmap1,
+        :
+    }
+
+    bitmap1, .. : int (bit N: N日のファイルが存在する)
+
+    ``columnar=True``の場合は、日ごとの SchedDataFile ではなく、
+    年ごとの列指向ストア(``colstore.YearStore``)で保持し、
+    ``get_sdf()``は、その都度、1日分のビューを生成する。
+    (ToDo は、常に SchedDataFile でキャッシングする)
+
+    _year_store = {
+        year1: store1,
+        :
+    }
+
+    キャッシュの内容は、``save_snapshot()``でファイルに保存し、
+    ``load_snapshot()``で、変更されていない日のみ復元できる。
+    復元したデータは、最初に参照された時に SchedDataFile にする。
+
+    _snapshot_rows = {
+        date1: (key1, rows1),
+        :
+    }
+
+    ``search_index=True``の場合は、検索用の N-gram インデックス
+    (``ngram.NgramIndex``)を、データの更新に合わせて更新する。
+    (``load_index()``で読み込み(なければ生成し)、``save_index()``で保存する)
+
+    サーバー以外によるデータファイルの変更は、``revalidate()``で反映する。
+    (変更された日のみ、キャッシュから捨てる(列指向ストアは読み込み直す))
+    キャッシュから捨てた日は、``add_listener()``で登録した関数に通知する。
+
+    日ごと(と ToDo)のバージョンは、``add_sde()``, ``del_sde()``,
+    ``invalidate()``のたびに増える。(HTTP の ETag 用)
+    値は起動ごとに振り直すので、``boot_id``と組み合わせて使う。
+    (複数のプロセスで同じ番号を使わないように、``set_version_source()``で
+    番号の発行元を変えられる)
+
+    _versions = {
+        date1: version1,  (None: ToDo)
+        :
+    }
+
+    version1, .. : int (全ての日で通しの番号なので、範囲内の最大値が
+                        変われば、範囲内のどこかが変更されている)
+
+    ジャーナル(``open_journal()``)を使う場合は、予定の追加・削除は、
+    データファイルを書き直さずに、ジャーナルに1行追記する。
+    データファイルへの反映は、``compact_journal()``でまとめて行う。
+    (読み込んだデータファイルには、まだ反映していない変更を適用する)
+
+    ToDo は、期限の日付順のインデックスで、期間内のものを二分探索する。
+    (``todo_range()``。ToDo が変更されたら、次に参照された時に作り直す)
+
+    _todo_index = (sdf, dates, sde_list)
+
+    dates: list of datetime.date (``sde_list``の各期限)
+    sde_list: ``sdf.sde``のコピー (編集中の変更の影響を受けない)
+
+    スレッドセーフではない。Web サーバーでは、``AsyncSchedData``
+    (``async_data.py``)を通して、ファイルの読み書きをスレッドプールで行う。
+    (``load_sdf()``, ``read_month_bitmap()``は別スレッドで実行し、
+    結果の登録(``put_sdf()``など)は、呼び出し元のスレッドで行う)
+
     """
     DEF_CACHE_SIZE = 20000
-    CACHE_DISCARD_RATE = 0.1
+    DEF_CACHE_MB = 256
 
     _mylog = get_logger(__name__, False)
 
     def __init__(self,
                  topdir: str = SchedDataFile.DEF_TOP_DIR,
                  cache_size: int = DEF_CACHE_SIZE,
+                 lazy: bool = False,
+                 columnar: bool = False,
+                 search_index: bool = False,
+                 cache_mb: float = DEF_CACHE_MB,
                  debug=False):
         """ Constructor
         Parameters
         ----------
         cache_size: int
+            キャッシュする最大日数
+
+        lazy: bool
+            True: 各フィールドは、参照された時に変換する
+            (``LazySchedDataEnt``)
+
+        columnar: bool
+            True: 年ごとの列指向ストアで保持する
+            (``cache_size``は、ToDo 以外には適用しない)
+
+        search_index: bool
+            True: 検索用の N-gram インデックスを使う
+
+        cache_mb: float
+            キャッシュのメモリ使用量(推定値)の上限 (MB)
+            (列指向ストアは、捨てずに数えるのみ)
 
         """
         self._dbg = debug
         self._mylog = get_logger(self.__class__.__name__, self._dbg)
-        self._mylog.debug('cache_size=%s, topdir=%s', cache_size, topdir)
+        self._mylog.debug('cache_size=%s, topdir=%s, lazy=%s, columnar=%s',
+                          cache_size, topdir, lazy, columnar)
+        self._mylog.debug('search_index=%s, cache_mb=%s',
+                          search_index, cache_mb)
 
         self._cache_size = cache_size
+        self._cache_limit = int(cache_mb * 1024 * 1024)
+        self._cache_bytes = 0
+        self._est_bytes = {}
         self._topdir = topdir
+        self._lazy = lazy
+        self._columnar = columnar
 
         self._sdf_cache = collections.OrderedDict()
+        self._exist_map = {}
+        self._year_store = {}
+        self._year_stat = {}
+        self._snapshot_rows = {}
+        self._listeners = []
+
+        self.boot_id = '%x-%x' % (os.getpid(), time.time_ns())
+        self._versions = {}
+        self._version_seq = 0
+        self._version_source = None
+        self._base_version = 0
+
+        self._ngram = None
+        self._ngram_saved = 0
+        if search_index:
+            self._ngram = ngram.NgramIndex()
+
+        self._journal = None
+        self._todo_index = None
 
     def __str__(self):
         """ __str__ """
@@ -585,6 +1069,16 @@ class SchedData:
             self._topdir, len(self._sdf_cache))
         return out_str
 
+    @property
+    def columnar(self) -> bool:
+        """ 列指向ストアで保持する """
+        return self._columnar
+
+    @property
+    def journal(self) -> journal.Journal:
+        """ None: ジャーナルを使わない """
+        return self._journal
+
     def get_keys(self):
         """
         Returns
@@ -599,7 +1093,24 @@ class SchedData:
         return date_list
 
     def get_cache_size(self):
-        return len(self._sdf_cache)
+        """
+        Returns
+        -------
+        size: int
+            キャッシュされている日数 (列指向ストア・スナップショットを含む)
+        """
+        return len(self._sdf_cache) + len(self._snapshot_rows) + sum(
+            [store.n_days for store in self._year_store.values()])
+
+    def get_cache_bytes(self):
+        """
+        Returns
+        -------
+        nbytes: int
+            キャッシュのメモリ使用量の推定値 (列指向ストアを含む)
+        """
+        return self._cache_bytes + sum(
+            [store.nbytes for store in self._year_store.values()])
 
     def get_sdf(self, date: datetime.date = None) -> SchedDataFile:
         """
@@ -619,85 +1130,1659 @@ class SchedData:
         """
         # self._mylog.debug('date=%s', date)
 
+        if date and not self.exists(date):
+            return EMPTY_SDF
+
+        if date and self._columnar:
+            store = self._get_year_store(date.year)
+            return SchedDataFile(date, self._topdir,
+                                 sde_list=store.get_day(date, self._mk_sde),
+                                 debug=self._dbg)
+
         try:
             # self._mylog.debug('_sdf.keys=%s', self.get_keys())
             sdf = self._sdf_cache.pop(date)
             self._sdf_cache[date] = sdf
             # self._mylog.debug('_sdf.keys=%s', self.get_keys())
         except KeyError:
-            self._mylog.warning('cache miss: date=%s', date)
+            sdf = self._restore_sdf(date)
+            if sdf is None:
+                self._mylog.warning('cache miss: date=%s', date)
+                sdf = self._new_sdf(date)
 
-            if self.get_cache_size() >= self._cache_size:
-                discard_size = int(
-                    self._cache_size * self.CACHE_DISCARD_RATE)
-                for i in range(discard_size):
-                    sdf = self._sdf_cache.popitem(last=False)
-                    # self._mylog.debug('discard[%s/%s]: date=%s',
-                    #                   i + 1, discard_size, sdf[0])
-
-            sdf = SchedDataFile(date, self._topdir, debug=self._dbg)
-            self._sdf_cache[date] = sdf
-            # self._mylog.debug('_sdf.keys=%s', self.get_keys())
+            self._cache_put(date, sdf)
 
         # if not sdf.sde:
             # self._mylog.warning('%s sdf.sde=%s', date, sdf.sde)
 
         return sdf
 
-    def get_sde(self, date: datetime.date = None, sde_id: str = ''
-                ) -> SchedDataEnt:
+    def _new_sdf(self, date: datetime.date = None) -> SchedDataFile:
         """
+        データファイルを読み込む (キャッシュには登録しない)
+
         Parameters
         ----------
         date: datetime.date
-
-        topdir: str
-
-        sde_id: str
-
+            None: ToDo
 
         Returns
         -------
-        sde: SchedDataEnt
-
+        sdf: SchedDataFile
+            (まだ反映していないジャーナルの変更を、適用したもの)
         """
-        self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
+        sdf = SchedDataFile(date, self._topdir, lazy=self._lazy,
+                            debug=self._dbg)
+        if self._journal is not None:
+            self._journal.apply(sdf, self._journal.pending(date))
 
-        sdf = self.get_sdf(date)
-        sde = sdf.get_sde(sde_id)
-        self._mylog.debug('sde=%s', sde)
-        return sde
+        return sdf
 
-    def add_sde(self,
-                date: datetime.date = None,
-                sde: SchedDataEnt = None) -> None:
+    def load_sdf(self, date: datetime.date = None) -> SchedDataFile:
         """
+        データファイルを読み込む
+        (キャッシュには登録しない。別スレッドから呼んでもよい)
+
         Parameters
         ----------
-        sde: SchedDataEnt
+        date: datetime.date
+            None: ToDo
 
+        Returns
+        -------
+        sdf: SchedDataFile
         """
-        self._mylog.debug('date=%s, sde=%s', date, sde)
-
-        sdf = self.get_sdf(date)
-        sdf.add_sde(sde)
-        sdf.save()
+        return self._new_sdf(date)
 
-    def del_sde(self, date: datetime.date = None, sde_id: str = ''
-                ) -> None:
-        """ del_sde
+    def put_sdf(self, date: datetime.date, sdf: SchedDataFile) -> None:
+        """
+        ``load_sdf()``の結果を、キャッシュに登録する
+        (既にある場合は、そちらが新しいので、何もしない)
 
         Parameters
         ----------
         date: datetime.date
+            None: ToDo
+        sdf: SchedDataFile
+        """
+        if self.is_cached(date):
+            return
 
-        topdir: str
+        if date and self._columnar:
+            # 列指向ストアは、年単位で生成する (``put_year()``)
+            return
 
-        sde_id: str
+        self._cache_put(date, sdf)
 
+    def put_year(self, year: int, sdf_list: list) -> None:
         """
-        self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
+        列指向ストアを、読み込んだデータファイルから生成する
+        (既にある場合は、何もしない)
 
-        sdf = self.get_sdf(date)
-        sdf.del_sde(sde_id)
-        sdf.save()
+        Parameters
+        ----------
+        year: int
+        sdf_list: list of SchedDataFile
+            ``year``のデータファイル (``load_sdf()``)
+        """
+        if year not in self._year_store:
+            self._year_store[year] = self._mk_year_store(year, sdf_list)
+
+    def is_cached(self, date: datetime.date = None) -> bool:
+        """
+        ``get_sdf()``が、ファイルを読まずに返せるか
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+
+        Returns
+        -------
+        result: bool
+        """
+        if date is None:
+            return None in self._sdf_cache
+
+        if not self.has_month_bitmap(date.year, date.month):
+            return False
+        if not self.exists(date):
+            return True
+
+        if self._columnar:
+            return date.year in self._year_store
+
+        return date in self._sdf_cache or date in self._snapshot_rows
+
+    def _restore_sdf(self, date: datetime.date = None) -> SchedDataFile:
+        """
+        スナップショットから復元したデータを、SchedDataFile にする
+
+        Returns
+        -------
+        sdf: SchedDataFile or None
+            None: スナップショットにない
+        """
+        try:
+            (key, rows) = self._snapshot_rows.pop(date)
+        except KeyError:
+            return None
+        self._cache_forget(date)
+
+        sdf = SchedDataFile(date, self._topdir, sde_list=[
+            self._mk_sde(sde_id, date1,
+                         dayparser.min2time(min_start),
+                         dayparser.min2time(min_end),
+                         sde_type, title, place, detail)
+            for (sde_id, date1, min_start, min_end,
+                 sde_type, title, place, detail) in rows],
+            debug=self._dbg)
+        sdf.stat_key = key
+
+        return sdf
+
+    def _mk_sde(self, sde_id, date, time_start, time_end,
+                sde_type, title, place, detail) -> SchedDataEnt:
+        """
+        列指向ストア・スナップショットから、エンティティを生成する
+        """
+        return SchedDataEnt(sde_id, date, time_start, time_end,
+                            sde_type, title, place, detail,
+                            decode_detail=False, debug=self._dbg)
+
+    def _mk_year_store(self, year: int,
+                       sdf_list: list) -> colstore.YearStore:
+        """
+        Parameters
+        ----------
+        year: int
+        sdf_list: list of SchedDataFile
+            ``year``のデータファイル
+
+        Returns
+        -------
+        store: colstore.YearStore
+        """
+        self._year_stat[year] = {
+            sdf.date: sdf.stat_key for sdf in sdf_list if sdf.stat_key}
+
+        return colstore.YearStore(year, [
+            (sdf.date, sdf.is_holiday,
+             [colstore.sde2row(sde) for sde in sdf.sde])
+            for sdf in sdf_list])
+
+    def _get_year_store(self, year: int) -> colstore.YearStore:
+        """
+        年ごとの列指向ストアを取得する。
+        未生成の場合は、1年分のデータファイルを読み込んで生成する。
+
+        Parameters
+        ----------
+        year: int
+
+        Returns
+        -------
+        store: colstore.YearStore
+        """
+        try:
+            return self._year_store[year]
+        except KeyError:
+            pass
+
+        self._mylog.warning('cache miss: year=%s', year)
+
+        date_list = self.find_dates(datetime.date(year, 1, 1),
+                                    datetime.date(year, 12, 31))
+        store = self._mk_year_store(
+            year, [self._new_sdf(date) for date in date_list])
+        self._year_store[year] = store
+
+        return store
+
+    def _update_year_store(self, sdf: SchedDataFile) -> None:
+        """
+        更新したデータファイルの内容を、列指向ストアに反映する
+        """
+        store = self._year_store.get(sdf.date.year)
+        if store is None:
+            return
+
+        year_stat = self._year_stat.setdefault(sdf.date.year, {})
+        if sdf.stat_key:
+            year_stat[sdf.date] = sdf.stat_key
+        else:
+            year_stat.pop(sdf.date, None)
+
+        store.set_day(sdf.date, sdf.is_holiday,
+                      [colstore.sde2row(sde) for sde in sdf.sde])
+
+    def _month_bitmap(self, year: int, month: int) -> int:
+        """
+        月ごとのファイル存在ビットマップを取得する。
+        未取得の場合は、月のディレクトリを走査して生成する。
+
+        Parameters
+        ----------
+        year, month: int
+
+        Returns
+        -------
+        bitmap: int
+            bit N: N日のファイルが存在する
+        """
+        try:
+            return self._exist_map[(year, month)]
+        except KeyError:
+            pass
+
+        bitmap = self.read_month_bitmap(year, month)
+        self._exist_map[(year, month)] = bitmap
+        return bitmap
+
+    def read_month_bitmap(self, year: int, month: int) -> int:
+        """
+        月のディレクトリとパックファイルを走査して、
+        ファイル存在ビットマップを生成する
+        (キャッシュには登録しない。別スレッドから呼んでもよい)
+
+        Parameters
+        ----------
+        year, month: int
+
+        Returns
+        -------
+        bitmap: int
+            bit N: N日のファイルが存在する
+        """
+        dirname = os.path.join(os.path.expanduser(self._topdir),
+                               '%04d' % year, '%02d' % month)
+        bitmap = 0
+        try:
+            for ent in os.scandir(dirname):
+                (day, ext) = os.path.splitext(ent.name)
+                if ext == '.cgi' and day.isdigit():
+                    bitmap |= 1 << int(day)
+        except FileNotFoundError:
+            pass
+
+        pack = packfile.open_pack(self._topdir, year)
+        if pack is not None:
+            bitmap |= pack.month_bitmap(month)
+
+        return bitmap
+
+    def put_month_bitmap(self, year: int, month: int, bitmap: int) -> None:
+        """
+        ``read_month_bitmap()``の結果を登録する
+        (既にある場合は、そちらが新しいので、何もしない)
+        """
+        self._exist_map.setdefault((year, month), bitmap)
+
+    def has_month_bitmap(self, year: int, month: int) -> bool:
+        """
+        Returns
+        -------
+        result: bool
+            True: 月のファイル存在ビットマップがある (走査の必要がない)
+        """
+        return (year, month) in self._exist_map
+
+    def existing_dates(self, year: int) -> list:
+        """
+        ファイル存在ビットマップから、ファイルが存在する日を列挙する
+        (ビットマップがない月は、走査する)
+
+        Parameters
+        ----------
+        year: int
+
+        Returns
+        -------
+        date_list: list of datetime.date (sorted)
+        """
+        date_list = []
+        for month in range(1, 13):
+            bitmap = self._month_bitmap(year, month)
+            day = 1
+            while bitmap >> day:
+                if bitmap & (1 << day):
+                    try:
+                        date_list.append(datetime.date(year, month, day))
+                    except ValueError:
+                        pass
+                day += 1
+
+        return date_list
+
+    def exists(self, date: datetime.date) -> bool:
+        """
+        データファイルが存在するか
+
+        Parameters
+        ----------
+        date: datetime.date
+
+        Returns
+        -------
+        result: bool
+        """
+        return bool(self._month_bitmap(date.year, date.month)
+                    & (1 << date.day))
+
+    def _set_exists(self, date: datetime.date, flag: bool) -> None:
+        """
+        ファイル存在ビットマップを更新する
+
+        Parameters
+        ----------
+        date: datetime.date
+        flag: bool
+        """
+        bitmap = self._month_bitmap(date.year, date.month)
+        if flag:
+            bitmap |= 1 << date.day
+        else:
+            bitmap &= ~(1 << date.day)
+        self._exist_map[(date.year, date.month)] = bitmap
+
+    def _cache_put(self, date: datetime.date, sdf: SchedDataFile) -> None:
+        """
+        キャッシュに追加する。
+        上限を超えた場合は、古いものから一つずつ捨てる。(``_cache_evict()``)
+
+        Parameters
+        ----------
+        date: datetime.date
+        sdf: SchedDataFile
+        """
+        self._sdf_cache[date] = sdf
+        self._cache_account(date, sdf.nbytes)
+        self._cache_evict()
+
+    def _cache_account(self, date: datetime.date, nbytes: int) -> None:
+        """ 日のメモリ使用量の推定値を、記録(更新)する """
+        self._cache_bytes += nbytes - self._est_bytes.get(date, 0)
+        self._est_bytes[date] = nbytes
+
+    def _cache_forget(self, date: datetime.date) -> None:
+        """ キャッシュから除いた日の推定値を、差し引く """
+        self._cache_bytes -= self._est_bytes.pop(date, 0)
+
+    def _cache_pop(self, date: datetime.date) -> None:
+        """ キャッシュから除く """
+        self._sdf_cache.pop(date, None)
+        self._snapshot_rows.pop(date, None)
+        self._cache_forget(date)
+
+    def _cache_evict(self) -> None:
+        """
+        上限(日数・メモリ使用量)を下回るまで、
+        スナップショットから復元後、まだ参照されていないもの、
+        最近参照されていないものの順に、一つずつ捨てる
+        (最後に追加したものは、残す)
+        """
+        while (len(self._sdf_cache) + len(self._snapshot_rows) >
+               self._cache_size or self._cache_bytes > self._cache_limit):
+            if self._snapshot_rows:
+                date = next(iter(self._snapshot_rows))
+                del self._snapshot_rows[date]
+            elif len(self._sdf_cache) > 1:
+                (date, _) = self._sdf_cache.popitem(last=False)
+            else:
+                break
+            self._cache_forget(date)
+
+    @staticmethod
+    def _est_rows_bytes(rows: list) -> int:
+        """
+        Returns
+        -------
+        nbytes: int
+            スナップショットの1日分の``rows``のメモリ使用量の推定値
+        """
+        return SchedDataFile.EST_BYTES + sum([
+            SchedDataEnt.EST_BYTES + SchedDataEnt.EST_CHAR_BYTES * (
+                len(title) + len(place) + len(detail))
+            for (_, _, _, _, _, title, place, detail) in rows])
+
+    def _walk_tree(self, year_from: int = 0, year_to: int = 9999,
+                   stat: bool = False) -> dict:
+        """
+        ``YYYY/MM/DD.cgi``のディレクトリツリーとパックファイルを走査し、
+        データファイルが存在する日付を列挙する。
+        (ファイル存在ビットマップも更新する)
+
+        Parameters
+        ----------
+        year_from, year_to: int
+        stat: bool
+            True: 各ファイルの``snapshot.stat_key()``を取得する
+
+        Returns
+        -------
+        files: dict
+            {date: key}
+            key: ``snapshot.stat_key()`` (``stat``が False の場合は None)
+        """
+        topdir = os.path.expanduser(self._topdir)
+
+        files = {}
+        month_map = {}
+        try:
+            year_ents = list(os.scandir(topdir))
+        except FileNotFoundError:
+            return files
+
+        for y_ent in year_ents:
+            if not (y_ent.name.isdigit() and y_ent.is_dir()):
+                continue
+            year = int(y_ent.name)
+            if year < year_from or year > year_to:
+                continue
+
+            for m_ent in os.scandir(y_ent.path):
+                if not (m_ent.name.isdigit() and m_ent.is_dir()):
+                    continue
+                month = int(m_ent.name)
+
+                bitmap = 0
+                for d_ent in os.scandir(m_ent.path):
+                    (day, ext) = os.path.splitext(d_ent.name)
+                    if ext != '.cgi' or not day.isdigit():
+                        continue
+                    bitmap |= 1 << int(day)
+                    try:
+                        date = datetime.date(year, month, int(day))
+                    except ValueError:
+                        continue
+
+                    key = None
+                    if stat:
+                        try:
+                            key = snapshot.stat_key(d_ent.stat())
+                        except FileNotFoundError:
+                            continue
+                    files[date] = key
+
+                self._exist_map[(year, month)] = bitmap
+                month_map[(year, month)] = bitmap
+
+        for year in packfile.list_years(topdir):
+            if year < year_from or year > year_to:
+                continue
+
+            pack = packfile.open_pack(topdir, year)
+            if pack is None:
+                continue
+
+            key = None
+            if stat:
+                key = ('pack',) + pack.stat_key
+
+            for date in pack.dates():
+                month_key = (year, date.month)
+                bitmap = month_map.get(month_key, 0)
+                if bitmap & (1 << date.day):
+                    # ``.cgi``ファイルがある
+                    continue
+                month_map[month_key] = bitmap | (1 << date.day)
+                self._exist_map[month_key] = month_map[month_key]
+
+                files[date] = key
+
+        return files
+
+    def find_dates(self,
+                   date_from: datetime.date = None,
+                   date_to: datetime.date = None) -> list:
+        """
+        データファイルが存在する日付を列挙する。
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            None: 制限なし
+
+        Returns
+        -------
+        date_list: list of datetime.date (sorted)
+        """
+        files = self._walk_tree(date_from.year if date_from else 0,
+                                date_to.year if date_to else 9999)
+
+        return sorted([date for date in files
+                       if (date_from is None or date >= date_from) and
+                       (date_to is None or date <= date_to)])
+
+    def preload(self,
+                date_from: datetime.date = None,
+                date_to: datetime.date = None,
+                workers: int = None) -> (int, float):
+        """
+        指定期間のデータファイルを並列に読み込み、キャッシュを暖める。
+
+        Notes
+        -----
+        ファイルの読み込み・解析はスレッドプールで行い、
+        キャッシュへの登録は呼び出し元のスレッドで行う。
+        キャッシュサイズを超える場合は、新しい日付を優先する。
+        キャッシュ済みの日(列指向ストアの場合は年)は、読み込まない。
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            None: 制限なし
+        workers: int
+            スレッド数 (None: 自動)
+
+        Returns
+        -------
+        (n_files, sec): (int, float)
+        """
+        self._mylog.debug('date_from=%s, date_to=%s, workers=%s',
+                          date_from, date_to, workers)
+
+        t_start = time.monotonic()
+
+        if self._columnar:
+            # 列指向ストアは、年単位で生成する
+            if date_from:
+                date_from = datetime.date(date_from.year, 1, 1)
+            if date_to:
+                date_to = datetime.date(date_to.year, 12, 31)
+
+        date_list = self.find_dates(date_from, date_to)
+        if self._columnar:
+            date_list = [d for d in date_list
+                         if d.year not in self._year_store]
+        else:
+            date_list = [d for d in date_list[-self._cache_size:]
+                         if d not in self._sdf_cache and
+                         d not in self._snapshot_rows]
+        self._mylog.debug('%s files', len(date_list))
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            sdf_list = executor.map(self._new_sdf, date_list)
+
+            if self._columnar:
+                # 日付順なので、年が変わるごとにストアを生成する
+                for (year, year_sdf) in itertools.groupby(
+                        sdf_list, key=lambda sdf: sdf.date.year):
+                    self._year_store[year] = self._mk_year_store(
+                        year, list(year_sdf))
+            else:
+                for date, sdf in zip(date_list, sdf_list):
+                    self._cache_put(date, sdf)
+
+        self.get_sdf(None)  # ToDo
+
+        sec = time.monotonic() - t_start
+        n_files = len(date_list)
+        self._mylog.info('preload: %s files, %.3f sec, %.1f files/sec',
+                         n_files, sec, n_files / sec if sec > 0 else 0)
+
+        return (n_files, sec)
+
+    def add_listener(self, func) -> None:
+        """
+        変更の通知先を登録する
+        (``invalidate()``, ``add_sde()``, ``del_sde()``)
+
+        Parameters
+        ----------
+        func: callable
+            func(date) (date: datetime.date, None: ToDo)
+        """
+        self._listeners.append(func)
+
+    def set_version_source(self, func) -> None:
+        """
+        バージョン番号の発行元を登録する
+        (複数のプロセスで、番号が重ならないようにする)
+
+        Parameters
+        ----------
+        func: callable
+            func() -> int (これまでに発行した全ての番号より大きい値)
+            None: プロセス内で数える
+        """
+        self._version_source = func
+
+    def _new_version(self) -> int:
+        if self._version_source is not None:
+            self._version_seq = self._version_source()
+        else:
+            self._version_seq += 1
+        return self._version_seq
+
+    def _changed(self, date: datetime.date = None) -> None:
+        """ バージョンを上げて、通知先に知らせる """
+        self._versions[date] = self._new_version()
+        if date is None:
+            self._todo_index = None
+
+        for func in self._listeners:
+            func(date)
+
+    def todo_range(self, date_from: datetime.date = None,
+                   date_to: datetime.date = None) -> list:
+        """
+        期限が期間内の ToDo
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            期間 (両端を含む)
+            None: 制限しない
+
+        Returns
+        -------
+        sde_list: list of SchedDataEnt
+            期限の日付順
+        """
+        sdf = self.get_sdf(None)
+        if self._todo_index is None or self._todo_index[0] is not sdf:
+            sde_list = list(sdf.sde)
+            self._todo_index = (sdf, [sde.date for sde in sde_list],
+                                sde_list)
+
+        (_, dates, sde_list) = self._todo_index
+        lo = 0
+        if date_from is not None:
+            lo = bisect.bisect_left(dates, date_from)
+        hi = len(dates)
+        if date_to is not None:
+            hi = bisect.bisect_right(dates, date_to)
+
+        return sde_list[lo:hi]
+
+    def version(self, date: datetime.date = None) -> int:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+
+        Returns
+        -------
+        version: int
+            0: 起動してから変更されていない
+        """
+        return self._versions.get(date, self._base_version)
+
+    def range_version(self, date_from: datetime.date,
+                      date_to: datetime.date) -> int:
+        """
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+
+        Returns
+        -------
+        version: int
+            範囲内の日のバージョンの最大値 (ToDo を含まない)
+            0: 起動してから変更されていない
+        """
+        return max([v for (d, v) in self._versions.items()
+                    if d is not None and date_from <= d <= date_to],
+                   default=self._base_version)
+
+    def invalidate(self, date: datetime.date = None,
+                   sdf: SchedDataFile = None) -> None:
+        """
+        1日分のキャッシュを捨てる (次に参照された時に読み込み直す)
+
+        列指向ストアの場合は、その日を読み込み直す。
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+        sdf: SchedDataFile
+            読み込み直したデータ (``load_sdf()``)
+            None: 必要なら(``reload_on_invalidate()``)、ここで読み込む
+        """
+        self._mylog.debug('date=%s', date)
+
+        self._cache_pop(date)
+
+        if date:
+            # パックファイルの変更もあるので、ビットマップは作り直す
+            self._exist_map.pop((date.year, date.month), None)
+
+            if self.reload_on_invalidate(date):
+                if sdf is None:
+                    sdf = self._new_sdf(date)
+                if date.year in self._year_store:
+                    self._update_year_store(sdf)
+                self._index_sdf(sdf)
+
+        self._changed(date)
+
+    def reload_on_invalidate(self, date: datetime.date = None) -> bool:
+        """
+        ``invalidate()``で、その日を読み込み直すか
+        (列指向ストア・N-gram インデックスを更新するため)
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+        """
+        return bool(date) and (date.year in self._year_store
+                               or self._ngram is not None)
+
+    def _cached_key(self, date: datetime.date = None):
+        """
+        Returns
+        -------
+        (cached, key): (bool, tuple)
+            cached: キャッシュされているか
+            key: キャッシュした時の``snapshot.stat_key()``
+        """
+        sdf = self._sdf_cache.get(date)
+        if sdf is not None:
+            return (True, sdf.stat_key)
+
+        if date in self._snapshot_rows:
+            return (True, self._snapshot_rows[date][0])
+
+        if date and date.year in self._year_store:
+            return (True, self._year_stat.get(date.year, {}).get(date))
+
+        return (False, None)
+
+    def _file_key(self, date: datetime.date = None):
+        """
+        Returns
+        -------
+        key: tuple
+            現在のファイルの``snapshot.stat_key()``
+            (パックファイルの場合は``('pack', mtime_ns, size)``)
+            None: ファイルがない
+        """
+        if date is None:
+            pathname = SchedDataFile.TODO_PATH_FORMAT % (
+                os.path.expanduser(self._topdir))
+        else:
+            pathname = packfile.cgi_path(self._topdir, date)
+
+        try:
+            return snapshot.stat_key(os.stat(pathname))
+        except FileNotFoundError:
+            pass
+
+        if date is None:
+            return None
+
+        pack = packfile.open_pack(self._topdir, date.year)
+        if pack is None or pack.read(date) is None:
+            return None
+
+        return ('pack',) + pack.stat_key
+
+    def cached_keys(self, changed) -> list:
+        """
+        変更された可能性がある日と、
+        キャッシュした時のファイルの mtime, size
+
+        Parameters
+        ----------
+        changed: iterable
+            ``watcher``の``poll()``の結果
+            datetime.date: 日, None: ToDo, int: 年(パックファイル)
+
+        Returns
+        -------
+        keys: list of (date, cached, key)
+            ``stale_dates()``に渡す (``_cached_key()``)
+        """
+        date_set = set()
+        for key in changed:
+            if not isinstance(key, int):
+                date_set.add(key)
+                continue
+
+            # 年: パックファイルにある日と、キャッシュしている日
+            year = key
+            for month in range(1, 13):
+                self._exist_map.pop((year, month), None)
+
+            pack = packfile.open_pack(self._topdir, year)
+            if pack is not None:
+                date_set.update(pack.dates())
+            date_set.update([d for d in self._sdf_cache
+                             if d and d.year == year])
+            date_set.update([d for d in self._snapshot_rows
+                             if d and d.year == year])
+            date_set.update(self._year_stat.get(year, {}))
+
+        return [(date,) + self._cached_key(date) for date in date_set]
+
+    def stale_dates(self, keys: list) -> list:
+        """
+        ``cached_keys()``のうち、キャッシュしていない日と、
+        現在のファイルと一致しない日
+        (キャッシュは参照しない。別スレッドから呼んでもよい)
+
+        Parameters
+        ----------
+        keys: list of (date, cached, key)
+
+        Returns
+        -------
+        date_list: list
+        """
+        return [date for (date, cached, key) in keys
+                if not cached or key != self._file_key(date)]
+
+    def revalidate(self, changed) -> list:
+        """
+        変更された可能性があるものについて、
+        キャッシュしたファイルと現在のファイルの mtime, size を比較し、
+        一致しない日のキャッシュを捨てる
+
+        Parameters
+        ----------
+        changed: iterable
+            ``watcher``の``poll()``の結果
+            datetime.date: 日, None: ToDo, int: 年(パックファイル)
+
+        Returns
+        -------
+        date_list: list
+            キャッシュを捨てた日
+        """
+        date_list = self.stale_dates(self.cached_keys(changed))
+        for date in date_list:
+            self.invalidate(date)
+
+        if date_list:
+            self._mylog.info('revalidate: %s changed', len(date_list))
+
+        return date_list
+
+    def cached_years(self) -> list:
+        """
+        キャッシュ・インデックスにある全ての年と ToDo(None)
+        (``revalidate_all()``)
+        """
+        years = {d.year for d in itertools.chain(self._sdf_cache,
+                                                 self._snapshot_rows)
+                 if d}
+        years.update(self._year_store)
+        if self._ngram is not None:
+            years.update([d.year for d in self._ngram.keys])
+
+        return sorted(years) + [None]
+
+    def reset_versions(self) -> None:
+        """
+        全ての日のバージョンを上げる
+        (キャッシュになかった日(新しいファイルなど)も、変更されたとみなす)
+        """
+        self._exist_map.clear()
+        self._versions.clear()
+        self._base_version = self._new_version()
+
+    def revalidate_all(self) -> list:
+        """
+        キャッシュ・インデックスにある全ての年と ToDo を``revalidate()``し、
+        全ての日のバージョンを上げる
+        (変更の通知を取りこぼした場合)
+
+        Returns
+        -------
+        date_list: list
+            キャッシュを捨てた日
+        """
+        date_list = self.revalidate(self.cached_years())
+        self.reset_versions()
+        return date_list
+
+    def open_journal(self, pathname: str) -> int:
+        """
+        ジャーナルを使う (起動時に、キャッシュなどを読み込んだ後に呼ぶ)
+
+        まだデータファイルに反映していない変更がある日は、
+        キャッシュを捨てて、変更を適用して読み込み直す。
+
+        Parameters
+        ----------
+        pathname: str
+
+        Returns
+        -------
+        n_days: int
+            変更を適用した日数
+        """
+        self._journal = journal.Journal(pathname, debug=self._dbg)
+
+        date_list = self._journal.dates()
+        for date in date_list:
+            self.invalidate(date)
+
+        self._mylog.info('open_journal: %s days: %s',
+                         len(date_list), self._journal)
+        return len(date_list)
+
+    def compact_days(self, days: dict) -> dict:
+        """
+        ジャーナルの変更を、データファイルに反映する
+        (キャッシュは使わないので、別スレッドから呼んでもよい)
+
+        Parameters
+        ----------
+        days: dict
+            {date: ops} (``Journal.plan()``)
+
+        Returns
+        -------
+        keys: dict
+            {date: stat_key} 書き込んだファイルの``snapshot.stat_key()``
+        """
+        keys = {}
+        for (date, ops) in days.items():
+            sdf = SchedDataFile(date, self._topdir, debug=self._dbg)
+            self._journal.apply(sdf, ops)
+            sdf.save()
+            keys[date] = sdf.stat_key
+
+        return keys
+
+    def set_stat_key(self, date: datetime.date, key) -> None:
+        """
+        書き込んだファイルの``snapshot.stat_key()``を、キャッシュ・
+        インデックスに記録する
+        (内容は同じなので、``revalidate()``で読み込み直さないように)
+        """
+        sdf = self._sdf_cache.get(date)
+        if sdf is not None:
+            sdf.stat_key = key
+        if date in self._snapshot_rows:
+            self._snapshot_rows[date] = (key, self._snapshot_rows[date][1])
+        if date and date.year in self._year_stat:
+            if key:
+                self._year_stat[date.year][date] = key
+            else:
+                self._year_stat[date.year].pop(date, None)
+        if self._ngram is not None and date in self._ngram.keys:
+            if key:
+                self._ngram.keys[date] = key
+            else:
+                self._ngram.keys.pop(date, None)
+
+    def compact_journal(self) -> int:
+        """
+        ジャーナルの変更を全て、データファイルに反映し、ジャーナルから捨てる
+
+        Returns
+        -------
+        n_days: int
+            書き込んだ日数
+        """
+        if self._journal is None:
+            return 0
+
+        (seq, days) = self._journal.plan()
+        if not days:
+            return 0
+
+        keys = self.compact_days(days)
+        self._journal.truncate(seq)
+        for (date, key) in keys.items():
+            self.set_stat_key(date, key)
+
+        self._mylog.info('compact_journal: %s days', len(keys))
+        return len(keys)
+
+    def _index_sdf(self, sdf: SchedDataFile) -> None:
+        """
+        1日分のデータを、N-gram インデックスに登録する
+        """
+        if self._ngram is None or sdf.date is None:
+            return
+
+        if sdf.stat_key is None:
+            self._ngram.remove(sdf.date)
+            return
+
+        self._ngram.add(sdf.date, [sde.search_str() for sde in sdf.sde],
+                        sdf.stat_key)
+
+    def search_dates(self, literal_list: list) -> set:
+        """
+        全ての文字列を含む可能性がある日
+
+        Parameters
+        ----------
+        literal_list: list of str or None
+            ``Query.required_literals()``, ``ngram.required_literals()``
+
+        Returns
+        -------
+        date_set: set of datetime.date or None
+            None: インデックスを使わない、またはインデックスでは絞り込めない
+        """
+        if self._ngram is None or not literal_list:
+            return None
+
+        return self._ngram.candidates(literal_list)
+
+    def load_index(self, pathname: str, workers: int = None) -> (int, int):
+        """
+        N-gram インデックスを読み込む
+
+        Notes
+        -----
+        ``load_snapshot()``と同様に、ファイルの mtime, size を比較し、
+        一致しない日(変更・追加された日)のみ、読み込んで登録する。
+        インデックスのファイルがない(不正な)場合は、全てのデータファイルを読み込む。
+
+        Parameters
+        ----------
+        pathname: str
+        workers: int
+            スレッド数 (None: 自動)
+
+        Returns
+        -------
+        (n_valid, n_stale): (int, int)
+            そのまま使えた日数と、読み込み直した日数
+        """
+        if self._ngram is None:
+            return (0, 0)
+
+        t_start = time.monotonic()
+
+        topdir = os.path.abspath(os.path.expanduser(self._topdir))
+        n_saved = -1
+        try:
+            state = snapshot.read(pathname)
+            if state.get('topdir') != topdir:
+                raise ValueError('topdir mismatch: %s' % (state.get('topdir')))
+            self._ngram = ngram.NgramIndex.from_state(state.get('ngram'))
+            n_saved = self._ngram.n_updates
+        except FileNotFoundError:
+            self._mylog.info('%s: no index .. build', pathname)
+        except (OSError, ValueError) as ex:
+            self._mylog.warning('%s: %s .. rebuild', type(ex).__name__, ex)
+
+        files = self._walk_tree(stat=True)
+        keys = self._ngram.keys
+
+        for date in [d for d in keys if d not in files]:
+            self._ngram.remove(date)
+
+        stale = sorted([date for (date, key) in files.items()
+                        if keys.get(date) != key])
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for sdf in executor.map(self._new_sdf, stale):
+                self._index_sdf(sdf)
+
+        self._ngram_saved = n_saved
+
+        n_valid = len(files) - len(stale)
+        self._mylog.info('load_index: %s days, %s stale, %.3f sec: %s',
+                         n_valid, len(stale), time.monotonic() - t_start,
+                         self._ngram)
+
+        return (n_valid, len(stale))
+
+    def save_index(self, pathname: str) -> int:
+        """
+        N-gram インデックスを保存する (変更がなければ、保存しない)
+
+        Parameters
+        ----------
+        pathname: str
+
+        Returns
+        -------
+        size: int
+            bytes (0: 保存しなかった)
+        """
+        if self._ngram is None or self._ngram.n_updates == self._ngram_saved:
+            return 0
+
+        t_start = time.monotonic()
+
+        n_updates = self._ngram.n_updates
+        size = snapshot.write(pathname, {
+            'topdir': os.path.abspath(os.path.expanduser(self._topdir)),
+            'ngram': self._ngram.to_state(),
+        })
+        self._ngram_saved = n_updates
+
+        self._mylog.info('save_index: %s bytes, %.3f sec',
+                         size, time.monotonic() - t_start)
+        return size
+
+    def save_snapshot(self, pathname: str) -> int:
+        """
+        キャッシュの内容を、スナップショットとして保存する
+
+        Parameters
+        ----------
+        pathname: str
+
+        Returns
+        -------
+        n_days: int
+        """
+        t_start = time.monotonic()
+
+        days = [(date, key, rows) for (date, (key, rows))
+                in self._snapshot_rows.items()]
+        for (date, sdf) in self._sdf_cache.items():
+            if sdf.stat_key is None:
+                continue
+            days.append((date, sdf.stat_key, [
+                (sde.sde_id, sde.date,
+                 dayparser.time2min(sde.time_start),
+                 dayparser.time2min(sde.time_end),
+                 sde.type, sde.title, sde.place, sde.detail)
+                for sde in sdf.sde]))
+
+        years = [(year, self._year_stat.get(year, {}), store)
+                 for (year, store) in self._year_store.items()]
+
+        # JSON にできる値のみにする (日付 -> ordinal)
+        d2o = snapshot.date2ord
+        size = snapshot.write(pathname, {
+            'topdir': os.path.abspath(os.path.expanduser(self._topdir)),
+            'days': [
+                [d2o(date), list(key),
+                 [[row[0], d2o(row[1])] + list(row[2:]) for row in rows]]
+                for (date, key, rows) in days],
+            'years': [
+                [year, [[d2o(date)] + list(key)
+                        for (date, key) in year_stat.items()],
+                 store.to_state()]
+                for (year, year_stat, store) in years],
+        })
+
+        n_days = len(days) + sum([store.n_days for (_, _, store) in years])
+        self._mylog.info('save_snapshot: %s days, %s bytes, %.3f sec',
+                         n_days, size, time.monotonic() - t_start)
+        return n_days
+
+    def load_snapshot(self, pathname: str) -> (int, int):
+        """
+        スナップショットから、キャッシュを復元する
+
+        Notes
+        -----
+        ディレクトリツリーを一度だけ走査して、全ファイルの mtime, size を取得し、
+        スナップショットに記録されたものと一致する日のみ復元する。
+        一致しない日(スナップショット保存後に変更された日)は、読み込み直す。
+
+        ``columnar=False``の場合、復元したデータは、
+        最初に参照された時に SchedDataFile にする。
+        スナップショットが不正・破損している場合は、何もしない。
+
+        Parameters
+        ----------
+        pathname: str
+
+        Returns
+        -------
+        (n_valid, n_stale): (int, int)
+            復元した日数と、読み込み直した日数
+        """
+        t_start = time.monotonic()
+
+        try:
+            state = snapshot.read(pathname)
+        except FileNotFoundError:
+            self._mylog.info('%s: no snapshot', pathname)
+            return (0, 0)
+        except (OSError, ValueError) as ex:
+            self._mylog.warning('%s: %s .. ignored',
+                                type(ex).__name__, ex)
+            return (0, 0)
+
+        topdir = os.path.abspath(os.path.expanduser(self._topdir))
+        if state.get('topdir') != topdir:
+            self._mylog.warning('%s: topdir mismatch: %s .. ignored',
+                                pathname, state.get('topdir'))
+            return (0, 0)
+
+        # 全体を変換してから使う (途中で不正な値があれば、何も使わない)
+        o2d = snapshot.ord2date
+        try:
+            days = [
+                (o2d(date), tuple(key),
+                 [(row[0], o2d(row[1])) + tuple(row[2:]) for row in rows])
+                for (date, key, rows) in state['days']]
+            years = [
+                (year, {o2d(date): tuple(key)
+                        for (date, *key) in year_stat},
+                 colstore.YearStore.from_state(store))
+                for (year, year_stat, store) in state['years']]
+            for (_, _, rows) in days:
+                if any([len(row) != 8 for row in rows]):
+                    raise ValueError('invalid row')
+            for (year, _, store) in years:
+                if year != store.year:
+                    raise ValueError('year mismatch: %s' % (year))
+        except (KeyError, TypeError, ValueError) as ex:
+            self._mylog.warning('%s: invalid snapshot: %s: %s .. ignored',
+                                pathname, type(ex).__name__, ex)
+            return (0, 0)
+
+        files = self._walk_tree(stat=True)
+        try:
+            files[None] = snapshot.stat_key(os.stat(
+                SchedDataFile.TODO_PATH_FORMAT % (topdir)))
+        except FileNotFoundError:
+            pass
+
+        n_valid = 0
+        stale = []
+
+        for (date, key, rows) in days:
+            if date and self._columnar:
+                continue
+            if files.get(date) != key:
+                stale.append(date)
+                continue
+
+            # SchedDataFile にするのは、最初に参照された時
+            # (``get_sdf()`` -> ``_restore_sdf()``)
+            self._snapshot_rows[date] = (key, rows)
+            self._cache_account(date, self._est_rows_bytes(rows))
+            n_valid += 1
+
+        # 上限を超える分は、古いもの(最近参照されていないもの)から捨てる
+        self._cache_evict()
+
+        if self._columnar:
+            year_files = collections.defaultdict(dict)
+            for (date, key) in files.items():
+                if date:
+                    year_files[date.year][date] = key
+
+            for (year, year_stat, store) in years:
+                cur_stat = year_files.get(year, {})
+                self._year_store[year] = store
+                self._year_stat[year] = dict(year_stat)
+
+                for date in set(year_stat) | set(cur_stat):
+                    if year_stat.get(date) == cur_stat.get(date):
+                        n_valid += 1
+                        continue
+                    stale.append(date)
+
+        for date in stale:
+            if date and date.year in self._year_store:
+                self._update_year_store(self._new_sdf(date))
+            elif date is None or date in files:
+                self._cache_put(date, self._new_sdf(date))
+
+        self._mylog.info('load_snapshot: %s days, %s stale, %.3f sec',
+                         n_valid, len(stale), time.monotonic() - t_start)
+
+        return (n_valid, len(stale))
+
+    def iter_range(self, date_from: datetime.date, date_to: datetime.date,
+                   reverse: bool = False, query=None, limit: int = None,
+                   dates=None):
+        """
+        期間内の、データがある日ごとに、条件に合うエンティティを、順に生成する
+
+        月ごとに進み、ファイルが一つもない月は、ファイル存在ビットマップ
+        (月のディレクトリの走査結果)で飛ばす。
+        キャッシュにない日は、その月に入った時に、まとめて読み込む。
+        (途中で止めた場合、先の月は読み込まない)
+
+        Notes
+        -----
+        エンティティは``Query.match_sde()``で照合する。
+        (検索用文字列・小文字のフィールドは、エンティティが保持する)
+        ``columnar=True``の場合は、必ず含まれる文字列
+        (``Query.required_literals()``)がない日を、文字列プールで除き、
+        残った日の検索用文字列を``Query.match``で照合して、
+        条件に合う行についてのみ、エンティティを生成する。
+
+        Parameters
+        ----------
+        date_from, date_to: datetime.date
+            期間 (両端を含む)
+        reverse: bool
+            True: 新しい日付から
+        query: query.Query or None
+            None: 全てのエンティティ
+        limit: int
+            条件に合うエンティティを、合計``limit``個以上生成したら止める
+            None: 止めない
+        dates: iterable of datetime.date
+            候補の日 (``search_dates()``)
+            None: 全ての日
+
+        Yields
+        ------
+        (date, is_holiday, sde_list): (datetime.date, bool, list)
+            sde_list: 条件に合うエンティティ (空の場合もある)
+        """
+        if dates is None:
+            months = [((year, month), None) for (year, month)
+                      in self._month_range(date_from, date_to, reverse)]
+        else:
+            dates = sorted([d for d in dates if date_from <= d <= date_to],
+                           reverse=reverse)
+            months = [(ym, list(month_dates)) for (ym, month_dates)
+                      in itertools.groupby(
+                          dates, key=lambda d: (d.year, d.month))]
+
+        if query is not None and query.match is None:
+            query = None
+
+        count = 0
+        for ((year, month), month_dates) in months:
+            bitmap = self._month_bitmap(year, month)
+            if not bitmap:
+                continue
+
+            month_from = max(date_from, datetime.date(year, month, 1))
+            month_to = min(date_to, datetime.date(
+                year, month, calendar.monthrange(year, month)[1]))
+
+            if self._columnar:
+                days = self._get_year_store(year).scan(
+                    month_from, month_to, query and query.match,
+                    self._mk_sde, reverse, month_dates,
+                    query and query.required_literals())
+            else:
+                if month_dates is None:
+                    month_dates = [
+                        datetime.date(year, month, day)
+                        for day in range(month_from.day, month_to.day + 1)
+                        if bitmap & (1 << day)]
+                    if reverse:
+                        month_dates.reverse()
+                else:
+                    month_dates = [d for d in month_dates
+                                   if bitmap & (1 << d.day)]
+                days = self._iter_days(month_dates, query)
+
+            for (date, is_holiday, sde_list) in days:
+                yield (date, is_holiday, sde_list)
+
+                count += len(sde_list)
+                if limit is not None and count >= limit:
+                    return
+
+    def _iter_days(self, date_list: list, query=None):
+        """
+        ``iter_range()``の1ヶ月分 (列指向ストアでない場合)
+
+        キャッシュにない日を、まとめて読み込んでから、順に照合する
+
+        Parameters
+        ----------
+        date_list: list of datetime.date
+            データファイルが存在する日 (同じ月)
+        query: query.Query or None
+        """
+        for date in date_list:
+            if not self.is_cached(date):
+                self.put_sdf(date, self.load_sdf(date))
+
+        for date in date_list:
+            sdf = self.get_sdf(date)
+            if query is None:
+                sde_list = list(sdf.sde)
+            else:
+                sde_list = [sde for sde in sdf.sde if query.match_sde(sde)]
+
+            yield (date, sdf.is_holiday, sde_list)
+
+    @staticmethod
+    def _month_range(date_from: datetime.date, date_to: datetime.date,
+                     reverse: bool = False) -> list:
+        """
+        Returns
+        -------
+        months: list of (year, month)
+            ``date_from``から``date_to``までの全ての月 (両端を含む)
+        """
+        months = [(i // 12, i % 12 + 1) for i in range(
+            date_from.year * 12 + date_from.month - 1,
+            date_to.year * 12 + date_to.month)]
+        if reverse:
+            months.reverse()
+        return months
+
+    @staticmethod
+    def _date_range(date_from: datetime.date, date_to: datetime.date,
+                    reverse: bool = False):
+        """
+        Yields
+        ------
+        date: datetime.date
+            ``date_from``から``date_to``までの全ての日 (両端を含む)
+        """
+        delta_day1 = datetime.timedelta(1)
+        date = date_from
+        if reverse:
+            date = date_to
+            delta_day1 = -delta_day1
+
+        while date_from <= date <= date_to:
+            yield date
+            date += delta_day1
+
+    def get_sde(self, date: datetime.date = None, sde_id: str = ''
+                ) -> SchedDataEnt:
+        """
+        Parameters
+        ----------
+        date: datetime.date
+
+        topdir: str
+
+        sde_id: str
+
+
+        Returns
+        -------
+        sde: SchedDataEnt
+
+        """
+        self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
+
+        sdf = self.get_sdf(date)
+        sde = sdf.get_sde(sde_id)
+        self._mylog.debug('sde=%s', sde)
+        return sde
+
+    def add_sde(self,
+                date: datetime.date = None,
+                sde: SchedDataEnt = None) -> None:
+        """
+        Parameters
+        ----------
+        sde: SchedDataEnt
+
+        """
+        self._mylog.debug('date=%s, sde=%s', date, sde)
+
+        sdf = self.begin_edit(date)
+        sdf.add_sde(sde)
+        self.save_edit([sdf], [(date, sde.sde_id, sde)])
+        self.end_edit(sdf)
+
+    def del_sde(self, date: datetime.date = None, sde_id: str = ''
+                ) -> None:
+        """ del_sde
+
+        Parameters
+        ----------
+        date: datetime.date
+
+        topdir: str
+
+        sde_id: str
+
+        """
+        self._mylog.debug('date=%s, sde_id=%s', date, sde_id)
+
+        sdf = self.get_sdf(date)
+        if sdf is EMPTY_SDF:
+            return
+
+        sdf.del_sde(sde_id)
+        self.save_edit([sdf], [(date, sde_id, None)])
+        self.end_edit(sdf)
+
+    def replace_sde(self, orig_date: datetime.date = None,
+                    new_sde: SchedDataEnt = None) -> None:
+        """
+        ``orig_date``にある``new_sde.sde_id``の予定を、``new_sde``で置き換える
+        (``del_sde()``と``add_sde()``を、ファイルの書き込み1回で行う)
+
+        日付が変わる場合のみ、2つのファイルに書き込む。
+        (先に新しい日に書き込むので、予定がどちらにもない瞬間はない)
+
+        Parameters
+        ----------
+        orig_date: datetime.date
+            変更前の日 (None: ToDo)
+        new_sde: SchedDataEnt
+            ToDo の場合は、ToDo に保存する
+        """
+        self._mylog.debug('orig_date=%s, new_sde=%s', orig_date, new_sde)
+
+        sdf_list = self.begin_replace(orig_date, new_sde)
+        try:
+            self.save_edit(sdf_list,
+                           self.replace_ops(orig_date, new_sde))
+        except Exception:
+            # ファイルの内容に戻す
+            for sdf in sdf_list:
+                self.invalidate(sdf.date)
+            raise
+
+        for sdf in sdf_list:
+            self.end_edit(sdf)
+
+    def begin_replace(self, orig_date: datetime.date = None,
+                      new_sde: SchedDataEnt = None) -> list:
+        """
+        ``replace_sde()``の変更を、メモリ上で行う
+
+        ``save_edit(sdf_list, replace_ops(orig_date, new_sde))``してから、
+        それぞれ``end_edit()``を呼ぶこと。
+
+        Returns
+        -------
+        sdf_list: list of SchedDataFile
+            書き込む日 (1つ、または、新しい日、元の日の2つ)
+        """
+        date = None if new_sde.is_todo() else new_sde.date
+
+        sdf = self.begin_edit(date)
+        if date == orig_date:
+            sdf.del_sde(new_sde.sde_id)
+        sdf.add_sde(new_sde)
+        sdf_list = [sdf]
+
+        if date != orig_date:
+            orig_sdf = self.get_sdf(orig_date)
+            if orig_sdf.get_sde(new_sde.sde_id) is not None:
+                orig_sdf.del_sde(new_sde.sde_id)
+                sdf_list.append(orig_sdf)
+
+        return sdf_list
+
+    @staticmethod
+    def replace_ops(orig_date: datetime.date = None,
+                    new_sde: SchedDataEnt = None) -> list:
+        """
+        ``replace_sde()``の``save_edit()``用の操作
+        """
+        date = None if new_sde.is_todo() else new_sde.date
+        return [(orig_date, new_sde.sde_id, None),
+                (date, new_sde.sde_id, new_sde)]
+
+    def save_edit(self, sdf_list: list, ops: list) -> None:
+        """
+        変更した日を保存する
+        (別スレッドから呼んでもよい)
+
+        ジャーナルを使う場合は、``ops``をジャーナルに1行追記するのみ。
+        (データファイルは書き直さない)
+
+        Parameters
+        ----------
+        sdf_list: list of SchedDataFile
+            変更した日 (保存する順)
+        ops: list of (date, sde_id, sde)
+            ``sde_id``の予定を削除し、``sde``(None以外)を追加する
+        """
+        if self._journal is None:
+            for sdf in sdf_list:
+                sdf.save()
+            return
+
+        self._journal.append([
+            (date, sde_id, sde.mk_dataline() if sde else None)
+            for (date, sde_id, sde) in ops])
+
+    def begin_edit(self, date: datetime.date = None) -> SchedDataFile:
+        """
+        変更する日のデータを取得する (ファイルがなければ、新たに作る)
+
+        変更後、``save_edit()``してから``end_edit()``を呼ぶこと。
+        (ジャーナルを使う場合、ファイルがない日は、空のファイルを作っておく)
+
+        Parameters
+        ----------
+        date: datetime.date
+            None: ToDo
+
+        Returns
+        -------
+        sdf: SchedDataFile
+        """
+        sdf = self.get_sdf(date)
+        if sdf is EMPTY_SDF:
+            if self._journal is not None:
+                pathname = packfile.cgi_path(self._topdir, date)
+                os.makedirs(os.path.dirname(pathname), exist_ok=True)
+                open(pathname, 'a').close()
+
+            sdf = self._new_sdf(date)
+            if not self._columnar:
+                self._cache_put(date, sdf)
+
+        return sdf
+
+    def end_edit(self, sdf: SchedDataFile) -> None:
+        """
+        保存した変更を、キャッシュ・インデックス・バージョンに反映する
+
+        Parameters
+        ----------
+        sdf: SchedDataFile
+            ``begin_edit()``, ``get_sdf()``で取得し、変更して
+            ``save_edit()``したもの
+        """
+        date = sdf.date
+        self._changed(date)
+
+        if self._sdf_cache.get(date) is sdf:
+            self._cache_account(date, sdf.nbytes)
+
+        if not date:
+            return
+
+        self._set_exists(date, bool(sdf.sde))
+        if self._columnar:
+            self._update_year_store(sdf)
+        self._index_sdf(sdf)
+
+        if not sdf.sde:
+            self._cache_pop(date)